@@ -0,0 +1,133 @@
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Dict, List, Optional
+from app.config import ANSWER_CACHE_PATH, ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_MAX_ENTRIES
+
+def normalize_text(text: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation so trivially different phrasings share a key."""
+    text = re.sub(r"\s+", " ", text.strip().lower())
+    return text.rstrip(" ?!.")
+
+
+def normalize_messages(messages: List[Any]) -> List[List[str]]:
+    normalized = []
+    for msg in messages:
+        role = msg["role"] if isinstance(msg, dict) else msg.role
+        content = msg["content"] if isinstance(msg, dict) else msg.content
+        normalized.append([role.lower(), normalize_text(content)])
+    return normalized
+
+
+class AnswerCache:
+    """
+    SQLite-backed cache of agent answers.
+
+    Keys combine the agent kind, a fingerprint of the data the answer was computed
+    on and the normalized (compacted) conversation, so an answer is only reused while the
+    underlying DataFrame / DB file / context text is unchanged.
+    """
+
+    def __init__(self, path: str, ttl_seconds: int, max_entries: int):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS answers (
+                key TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                source TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_source ON answers (kind, source)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_last_access ON answers (last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(kind: str, fingerprint: str, messages: List[Any]) -> str:
+        """`messages` is the conversation as the agent receives it (history.compact), so the key covers all it sees."""
+        payload = json.dumps([kind, fingerprint, normalize_messages(messages)], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT answer, created_at FROM answers WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM answers WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE answers SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, kind: str, source: str, fingerprint: str, answer: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers (key, kind, source, fingerprint, answer, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, kind, source, fingerprint, answer, now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        self._conn.execute("DELETE FROM answers WHERE created_at < ?", (now - self.ttl_seconds,))
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM answers WHERE key IN (SELECT key FROM answers ORDER BY last_access ASC LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def invalidate(self, kind: str, source: str, keep_fingerprint: Optional[str] = None) -> int:
+        """Drop answers computed on `source` (e.g. a DB URI), except those matching its current fingerprint."""
+        with self._lock:
+            cur = self._conn.execute(
+                "DELETE FROM answers WHERE kind = ? AND source = ? AND fingerprint != ?",
+                (kind, source, keep_fingerprint or ""),
+            )
+            self._conn.commit()
+            return cur.rowcount
+
+    def clear(self) -> int:
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM answers")
+            self._conn.commit()
+            self.hits = self.misses = 0
+            return cur.rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            (entries,) = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+        }
+
+
+answer_cache = AnswerCache(ANSWER_CACHE_PATH, ttl_seconds=ANSWER_CACHE_TTL_SECONDS, max_entries=ANSWER_CACHE_MAX_ENTRIES)
@@ -1,27 +1,20 @@
 from fastapi import Header, HTTPException, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from app.config import TOKEN_STORE
-import time
+from app.config import verify_bearer_token
 
 security = HTTPBearer()
 
 def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    current_token = TOKEN_STORE.get("token")
-    expiry = TOKEN_STORE.get("expires_at")
+    # Tokens carry their own signed expiry: no lookup, so any worker can check them
+    problem = verify_bearer_token(credentials.credentials) if credentials.scheme == "Bearer" else "invalid"
 
-    if not current_token or not expiry:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Token not initialized or missing",
-        )
-
-    if time.time() >= expiry:
+    if problem == "expired":
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Token has expired",
         )
 
-    if credentials.scheme != "Bearer" or credentials.credentials != current_token:
+    if problem is not None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid or missing token",
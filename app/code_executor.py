@@ -0,0 +1,300 @@
+import os
+import time
+import fcntl
+import queue
+import pickle
+import atexit
+import threading
+import multiprocessing as mp
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple, Type
+from pydantic import BaseModel, Field
+from langchain_core.tools import BaseTool
+from app.code_worker import worker_main
+from app.config import (
+    PANDAS_POOL_WORKERS, PANDAS_EXEC_TIMEOUT_SECONDS, PANDAS_EXEC_CPU_SECONDS,
+    PANDAS_EXEC_MEMORY_MB, PANDAS_SHARED_DIR,
+)
+from app.tracing import CODE_EXECUTIONS, observe_stage
+
+# === Constants ===
+# Appended to the pandas agent's prompt: unlike the in-process REPL, variables do not survive between calls
+PROCESS_MODE_HINT = (
+    "Each python_repl_ast call runs in a fresh namespace that only has `df` and `rollups`: "
+    "define and use any intermediate variables within the same call."
+)
+
+
+# === Shared DataFrames ===
+# The files in PANDAS_SHARED_DIR are shared by every API process (uvicorn --workers N): each process
+# that publishes a key leaves a <key>.holders/<pid> marker, and the files go only with the last live holder.
+# key -> (df, rollups) this process published, kept to rewrite the files if they disappear
+_published: Dict[str, Tuple[pd.DataFrame, Optional[Dict[str, pd.DataFrame]]]] = {}
+_publish_lock = threading.Lock()
+
+
+def shared_path(key: str) -> str:
+    return os.path.join(PANDAS_SHARED_DIR, f"{key}.arrow")
+
+
+def rollups_path(key: str) -> str:
+    return os.path.join(PANDAS_SHARED_DIR, f"{key}.rollups.pkl")
+
+
+def _holders_dir(key: str) -> str:
+    return os.path.join(PANDAS_SHARED_DIR, f"{key}.holders")
+
+
+@contextmanager
+def _key_lock(key: str):
+    """Exclusive lock on one key across API processes (flock on <key>.lock)."""
+    os.makedirs(PANDAS_SHARED_DIR, exist_ok=True)
+    with open(os.path.join(PANDAS_SHARED_DIR, f"{key}.lock"), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _write_atomic(path: str, write):
+    # Per-process temp name: several API processes may publish the same key at once
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _pickle_to(obj):
+    def write(path: str):
+        with open(path, "wb") as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return write
+
+
+def publish(key: str, df: pd.DataFrame, rollups: Optional[Dict[str, pd.DataFrame]] = None) -> str:
+    """
+    Write a dataset once as an uncompressed Arrow IPC file (in /dev/shm by default),
+    which every worker memory-maps instead of receiving a pickled copy per call.
+    """
+    path = shared_path(key)
+    with _publish_lock:
+        if key in _published and os.path.exists(path):
+            return path
+        with _key_lock(key):
+            if not os.path.exists(path):
+                start = time.perf_counter()
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                _write_atomic(path, lambda tmp: feather.write_feather(table, tmp, compression="uncompressed"))
+                observe_stage("publish", time.perf_counter() - start, "pandas_shared")
+                print(f"📤 Published dataset {key[:12]} for the execution pool: {path}")
+            if rollups and not os.path.exists(rollups_path(key)):
+                _write_atomic(rollups_path(key), _pickle_to(rollups))
+            os.makedirs(_holders_dir(key), exist_ok=True)
+            open(os.path.join(_holders_dir(key), str(os.getpid())), "a").close()
+        _published[key] = (df, rollups)
+        return path
+
+
+def ensure_published(key: str) -> bool:
+    """Rewrite the files of a key this process published if they are gone; False if it never did (or dropped it)."""
+    with _publish_lock:
+        published = _published.get(key)
+    if published is None:
+        return False
+    publish(key, *published)
+    return True
+
+
+def unpublish(key: str):
+    """
+    Drop this process's hold on a published dataset; the files are removed once no other
+    live process holds it (workers that still map it keep their view until they let go).
+    """
+    with _publish_lock:
+        _published.pop(key, None)
+        with _key_lock(key):
+            holders = _holders_dir(key)
+            names = os.listdir(holders) if os.path.isdir(holders) else []
+            live = []
+            for name in names:
+                if name != str(os.getpid()) and name.isdigit() and _pid_alive(int(name)):
+                    live.append(name)
+                else:
+                    os.remove(os.path.join(holders, name))  # ours, or left by a process that died
+            if live:
+                return
+            for path in (shared_path(key), rollups_path(key)):
+                if os.path.exists(path):
+                    os.remove(path)
+            if os.path.isdir(holders):
+                os.rmdir(holders)
+
+
+def _unpublish_all():
+    for key in list(_published):
+        unpublish(key)
+
+
+# === Worker Pool ===
+class _Worker:
+    def __init__(self, ctx, memory_mb: int):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=worker_main, args=(child_conn, memory_mb), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join(timeout=5)
+        self.conn.close()
+
+
+class CodeExecutionPool:
+    """
+    Runs pandas agent code in `workers` separate processes so heavy computations
+    use other cores instead of holding the API process's GIL. Each execution gets a
+    CPU-time budget (enforced in the worker) and a wall-clock timeout (enforced here
+    by killing the worker); each worker's heap is capped at `memory_mb`. A killed or
+    crashed worker is replaced, the server keeps running.
+    """
+
+    def __init__(self, workers: int = PANDAS_POOL_WORKERS, timeout: float = PANDAS_EXEC_TIMEOUT_SECONDS,
+                 cpu_seconds: int = PANDAS_EXEC_CPU_SECONDS, memory_mb: int = PANDAS_EXEC_MEMORY_MB):
+        self.size = max(1, workers)
+        self.timeout = timeout
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        # "spawn": forking a threaded server process is unsafe
+        self._ctx = mp.get_context("spawn")
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._workers: List[_Worker] = []
+        self._lock = threading.Lock()
+        self._started = False
+        self.counts = {"ok": 0, "error": 0, "timeout": 0, "memory_limit": 0, "crashed": 0}
+
+    def _spawn(self) -> _Worker:
+        worker = _Worker(self._ctx, self.memory_mb)
+        with self._lock:
+            self._workers.append(worker)
+        return worker
+
+    def _replace(self, worker: _Worker):
+        worker.kill()
+        with self._lock:
+            if worker in self._workers:
+                self._workers.remove(worker)
+        self._idle.put(self._spawn())
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for _ in range(self.size):
+            self._idle.put(self._spawn())
+        print(f"🧵 Pandas execution pool: {self.size} worker processes")
+
+    def _count(self, outcome: str):
+        with self._lock:
+            self.counts[outcome] += 1
+        CODE_EXECUTIONS.labels(outcome).inc()
+
+    def execute(self, key: str, code: str) -> str:
+        """Run `code` against the published dataset `key`; returns the output (or error) text for the agent."""
+        self.start()
+        try:
+            worker = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            self._count("timeout")
+            return f"TimeoutError: no execution worker became free within {self.timeout:.0f}s"
+
+        try:
+            worker.conn.send((key, shared_path(key), rollups_path(key), code, self.cpu_seconds))
+            if not worker.conn.poll(self.timeout):
+                self._replace(worker)
+                self._count("timeout")
+                return f"TimeoutError: code ran longer than {self.timeout:.0f}s and was stopped"
+            status, output = worker.conn.recv()
+        except (EOFError, OSError):
+            # Killed by the OS (e.g. out of memory inside native code) or crashed
+            exitcode = worker.process.exitcode
+            self._replace(worker)
+            self._count("crashed")
+            return f"WorkerError: the execution process died (exit code {exitcode}), likely over its memory limit"
+
+        if status == "recycle":
+            self._replace(worker)
+            self._count("memory_limit")
+        else:
+            self._idle.put(worker)
+            self._count(status)
+        return output
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.size if self._started else 0,
+                "idle": self._idle.qsize(),
+                "timeout_seconds": self.timeout,
+                "cpu_seconds": self.cpu_seconds,
+                "memory_mb": self.memory_mb,
+                "published": len(_published),
+                **self.counts,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            workers, self._workers = self._workers, []
+            self._started = False
+        for worker in workers:
+            worker.kill()
+        self._idle = queue.Queue()
+
+
+pool = CodeExecutionPool()
+
+
+@atexit.register
+def _shutdown():
+    pool.shutdown()
+    _unpublish_all()
+
+
+# === Agent Tool ===
+class PythonInput(BaseModel):
+    query: str = Field(description="code snippet to run")
+
+
+class PooledPythonTool(BaseTool):
+    """Drop-in for the pandas agent's python_repl_ast tool that runs the code in the execution pool."""
+    name: str = "python_repl_ast"
+    description: str = (
+        "A Python shell. Use this to execute python commands. "
+        "Input should be a valid python command. "
+        "When using this tool, sometimes output is abbreviated - "
+        "make sure it does not look abbreviated before using it in your answer."
+    )
+    args_schema: Type[BaseModel] = PythonInput
+    dataset_key: str
+
+    def _run(self, query: str, run_manager=None) -> str:
+        from langchain_experimental.tools.python.tool import sanitize_input
+
+        # The shared file may have been removed since publish (e.g. /dev/shm cleaned): write it again
+        if not ensure_published(self.dataset_key):
+            return "Error: this dataset is no longer loaded. Ask the question again to reload it."
+        # BaseTool._arun runs this in a thread, so the event loop only waits on the pipe
+        return pool.execute(self.dataset_key, sanitize_input(query))
@@ -0,0 +1,135 @@
+"""
+Child side of app.code_executor. Kept free of LangChain / app imports so spawned
+workers start quickly: only pandas / pyarrow are loaded here.
+"""
+
+import os
+import math
+import ast
+import pickle
+import signal
+import resource
+from collections import OrderedDict
+from contextlib import redirect_stdout
+from io import StringIO
+from typing import Any, Dict, Optional, Tuple
+
+# === Constants ===
+MAX_OUTPUT_CHARS = 20_000  # longer outputs are cut before being sent back to the agent
+ATTACHED_FRAMES = 2  # published datasets a worker keeps mapped
+
+
+class ExecutionLimitExceeded(BaseException):
+    """Raised from the SIGXCPU handler; BaseException so agent code cannot swallow it with `except Exception`."""
+
+
+def _on_cpu_limit(signum, frame):
+    raise ExecutionLimitExceeded("CPU time limit exceeded")
+
+
+def _cpu_used() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _set_cpu_budget(seconds: Optional[int]):
+    """Soft RLIMIT_CPU at `seconds` beyond what this worker used so far (None lifts it)."""
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = hard if seconds is None else math.ceil(_cpu_used()) + seconds
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def _set_memory_limit(memory_mb: int):
+    # RLIMIT_DATA covers the heap and anonymous mappings, but not the read-only
+    # mapping of a published frame, so shared data does not count against a worker
+    if memory_mb <= 0:
+        return
+    limit = memory_mb * 1024 ** 2
+    _, hard = resource.getrlimit(resource.RLIMIT_DATA)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_DATA, (limit, hard))
+
+
+def attach(path: str, rollups_path: str) -> Tuple[Any, Dict[str, Any]]:
+    """Memory-map a published frame: numeric columns are zero-copy views of the shared Arrow buffers."""
+    import pyarrow.feather as feather
+
+    table = feather.read_table(path, memory_map=True)
+    df = table.to_pandas(split_blocks=True)
+    rollups = {}
+    if os.path.exists(rollups_path):
+        with open(rollups_path, "rb") as f:
+            rollups = pickle.load(f)
+    return df, rollups
+
+
+def run_code(code: str, namespace: Dict[str, Any]) -> str:
+    """Same semantics as LangChain's PythonAstREPLTool: exec all statements, eval the last one."""
+    try:
+        tree = ast.parse(code)
+        module = ast.Module(tree.body[:-1], type_ignores=[])
+        exec(ast.unparse(module), {}, namespace)
+        last = ast.unparse(ast.Module(tree.body[-1:], type_ignores=[]))
+        buffer = StringIO()
+        try:
+            with redirect_stdout(buffer):
+                result = eval(last, {}, namespace)
+            output = buffer.getvalue() if result is None else str(result)
+        except MemoryError:
+            raise
+        except Exception:
+            with redirect_stdout(buffer):
+                exec(last, {}, namespace)
+            output = buffer.getvalue()
+    except MemoryError:
+        raise  # the worker reports it and is replaced
+    except Exception as e:
+        output = f"{type(e).__name__}: {e}"
+    if len(output) > MAX_OUTPUT_CHARS:
+        output = output[:MAX_OUTPUT_CHARS] + f"\n... (output truncated at {MAX_OUTPUT_CHARS} characters)"
+    return output
+
+
+def worker_main(conn, memory_mb: int):
+    """
+    Serve (dataset_key, path, rollups_path, code, cpu_seconds) requests from `conn`
+    until it closes. Replies ("ok" | "error" | "recycle", output); "recycle" asks the
+    parent to replace this worker (its heap may be in a bad state after a MemoryError).
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the server's Ctrl-C is handled by the parent
+    signal.signal(signal.SIGXCPU, _on_cpu_limit)
+    _set_memory_limit(memory_mb)
+    frames: "OrderedDict[str, Tuple[Any, Dict[str, Any]]]" = OrderedDict()
+
+    while True:
+        try:
+            key, path, rollups_path, code, cpu_seconds = conn.recv()
+        except (EOFError, OSError):
+            return  # parent went away
+
+        status = "ok"
+        try:
+            if key not in frames:
+                frames[key] = attach(path, rollups_path)
+                while len(frames) > ATTACHED_FRAMES:
+                    frames.popitem(last=False)
+            frames.move_to_end(key)
+            df, rollups = frames[key]
+            _set_cpu_budget(cpu_seconds)
+            try:
+                # A fresh namespace per execution; shallow (copy-on-write) copies keep
+                # in-place changes from leaking into the next request on this worker
+                namespace = {"df": df.copy(deep=False), "rollups": {k: v.copy(deep=False) for k, v in rollups.items()}}
+                output = run_code(code, namespace)
+            finally:
+                _set_cpu_budget(None)
+        except ExecutionLimitExceeded:
+            status, output = "error", f"ExecutionLimitExceeded: code used more than {cpu_seconds}s of CPU time and was stopped"
+        except MemoryError:
+            status, output = "recycle", f"MemoryError: code exceeded the {memory_mb} MB memory limit"
+        except Exception as e:
+            status, output = "error", f"{type(e).__name__}: {e}"
+        conn.send((status, output))
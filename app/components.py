@@ -0,0 +1,76 @@
+import time
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict
+from app.tracing import observe_component
+
+# === Startup / initialization timings ===
+_START = time.time()
+_timings: Dict[str, Dict[str, float]] = {}
+_timings_lock = threading.Lock()
+
+
+@contextmanager
+def timed(component: str):
+    """Record how long importing / building `component` took for the startup report."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe_component(component, elapsed)
+        with _timings_lock:
+            _timings[component] = {
+                "seconds": round(elapsed, 4),
+                "at": round(time.time() - _START, 3),  # seconds since the app started importing
+            }
+        print(f"⏱️ {component} ready in {elapsed:.3f}s")
+
+
+def startup_report() -> Dict[str, Any]:
+    with _timings_lock:
+        components = dict(_timings)
+    # Timings nest (e.g. "llm" is built inside "pandas_agent"), so they are not summed
+    return {
+        "uptime_seconds": round(time.time() - _START, 3),
+        "components": components,
+    }
+
+
+# === Shared clients (built on first use, one per process) ===
+_llm = None
+_embeddings = None
+_clients_lock = threading.Lock()
+
+
+def get_llm():
+    """The ChatOpenAI client shared by the DataFrame, SQL and RAG agents."""
+    global _llm
+    if _llm is None:
+        with _clients_lock:
+            if _llm is None:
+                with timed("llm"):
+                    from langchain_openai import ChatOpenAI
+                    _llm = ChatOpenAI(temperature=0, model_name="gpt-4o-mini")
+    return _llm
+
+
+def get_embeddings():
+    global _embeddings
+    if _embeddings is None:
+        with _clients_lock:
+            if _embeddings is None:
+                with timed("embeddings"):
+                    from langchain_openai import OpenAIEmbeddings
+                    _embeddings = OpenAIEmbeddings()
+    return _embeddings
+
+
+def use_clients(llm=None, embeddings=None):
+    """Replace the shared clients (e.g. local fakes for offline benchmarks); agents built afterwards use them."""
+    global _llm, _embeddings
+    with _clients_lock:
+        if llm is not None:
+            _llm = llm
+        if embeddings is not None:
+            _embeddings = embeddings
@@ -0,0 +1,89 @@
+import asyncio
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Hashable, Tuple
+from fastapi import HTTPException, status
+
+
+class AgentLimiter:
+    """
+    Bounded concurrency for one agent type.
+
+    At most `max_concurrent` runs execute at once; up to `max_queue` further
+    requests wait their turn on the event loop (costing no worker thread).
+    Beyond that, requests are rejected with 429 and the current queue depth.
+    """
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.active = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+
+    def ensure_capacity(self):
+        """Raise 429 if a new request could neither run nor wait."""
+        if self.active >= self.max_concurrent and self.waiting >= self.max_queue:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail={
+                    "message": f"{self.name} agent is busy, please retry shortly.",
+                    "queue_position": self.waiting + 1,
+                    "max_queue": self.max_queue,
+                },
+                headers={"Retry-After": "1"},
+            )
+
+    @asynccontextmanager
+    async def slot(self):
+        self.ensure_capacity()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+        }
+
+
+class KeyedLocks:
+    """
+    One lock per key, for slow builds (agents, indexes) that must run once per key
+    without making lookups of other keys wait. A key's lock is dropped once no
+    thread holds or waits on it.
+    """
+
+    def __init__(self):
+        self._locks: Dict[Hashable, Tuple[threading.Lock, int]] = {}
+        self._guard = threading.Lock()
+
+    @contextmanager
+    def hold(self, key: Hashable):
+        with self._guard:
+            lock, users = self._locks.get(key, (None, 0))
+            lock = lock or threading.Lock()
+            self._locks[key] = (lock, users + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self._guard:
+                lock, users = self._locks[key]
+                if users == 1:
+                    del self._locks[key]
+                else:
+                    self._locks[key] = (lock, users - 1)
@@ -3,6 +3,7 @@ import time
 import hmac
 import hashlib
 import secrets
+from typing import Optional
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -17,30 +18,158 @@ print("OPENAI_API_KEY Setup is Completed..!!!")
 if not SECRET_ID or not SECRET_KEY:
     raise RuntimeError("SECRET_ID and SECRET_KEY must be set in environment variables")
 
-# === Token Cache ===
+# === Dataset Cache ===
+DATASET_CACHE_MAX_BYTES = int(os.getenv("DATASET_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))  # in-memory budget
+DATASET_SPILL_DIR = os.getenv("DATASET_SPILL_DIR", "data/df_cache")
+# On-disk budget of the spill dir; least recently used files go first, datasets a session points at stay
+DATASET_SPILL_MAX_BYTES = int(os.getenv("DATASET_SPILL_MAX_BYTES", str(20 * 1024 ** 3)))
+# Write every new dataset to the spill dir at once, so all worker processes can load it by id
+DATASET_WRITE_THROUGH = os.getenv("DATASET_WRITE_THROUGH", "true").lower() == "true"
+
+# === DataFrame Loading (memory-compact dtypes) ===
+DATAFRAME_OPTIMIZE_DTYPES = os.getenv("DATAFRAME_OPTIMIZE_DTYPES", "true").lower() == "true"
+CATEGORY_MAX_UNIQUE_RATIO = float(os.getenv("CATEGORY_MAX_UNIQUE_RATIO", "0.5"))  # distinct / rows below which strings become categorical
+CATEGORY_MAX_UNIQUE = int(os.getenv("CATEGORY_MAX_UNIQUE", "50000"))
+DATE_DAYFIRST = os.getenv("DATE_DAYFIRST", "true").lower() == "true"  # 12-01-2025 is 12 January
+
+# === Large Datasets (out-of-core: partitioned Parquet on disk, queried with DuckDB) ===
+LARGE_DATASET_DIR = os.getenv("LARGE_DATASET_DIR", "data/large")
+LARGE_DATASET_MIN_BYTES = int(os.getenv("LARGE_DATASET_MIN_BYTES", str(1024 ** 3)))  # uploads above this go out-of-core (storage=auto)
+LARGE_PARTITION_COLUMNS = [c.strip() for c in os.getenv("LARGE_PARTITION_COLUMNS", "Year").split(",") if c.strip()]
+LARGE_FILE_SIZE = os.getenv("LARGE_FILE_SIZE", "256MB")  # Parquet part size when no partition column is present
+LARGE_MEMORY_LIMIT = os.getenv("LARGE_MEMORY_LIMIT", "1GB")  # DuckDB spills to disk beyond this
+LARGE_THREADS = int(os.getenv("LARGE_THREADS", str(os.cpu_count() or 2)))
+LARGE_QUERY_TIMEOUT_SECONDS = float(os.getenv("LARGE_QUERY_TIMEOUT_SECONDS", "60"))
+LARGE_MAX_RESULT_ROWS = int(os.getenv("LARGE_MAX_RESULT_ROWS", "200"))  # rows materialized as pandas per query
+LARGE_AGENT_CACHE_ENTRIES = int(os.getenv("LARGE_AGENT_CACHE_ENTRIES", "4"))
+
+# === Pandas Code Execution ("inprocess": agent code runs in the API process; "process": in a worker pool) ===
+PANDAS_EXECUTION_MODE = os.getenv("PANDAS_EXECUTION_MODE", "inprocess")
+PANDAS_POOL_WORKERS = int(os.getenv("PANDAS_POOL_WORKERS", str(os.cpu_count() or 2)))
+PANDAS_EXEC_TIMEOUT_SECONDS = float(os.getenv("PANDAS_EXEC_TIMEOUT_SECONDS", "30"))  # wall clock, then the worker is killed
+PANDAS_EXEC_CPU_SECONDS = int(os.getenv("PANDAS_EXEC_CPU_SECONDS", "20"))  # CPU time per execution
+PANDAS_EXEC_MEMORY_MB = int(os.getenv("PANDAS_EXEC_MEMORY_MB", "2048"))  # heap per worker (shared frames not counted)
+# Published DataFrames (Arrow IPC, memory-mapped by the workers); /dev/shm keeps them in shared memory
+PANDAS_SHARED_DIR = os.getenv("PANDAS_SHARED_DIR", "/dev/shm/analytics-agent" if os.path.isdir("/dev/shm") else "data/df_shared")
+
+# === SQL Execution Guards (SQLite) ===
+SQL_DEFAULT_DB_PATH = os.getenv("SQL_DEFAULT_DB_PATH", "data/retail_transactions_data.db")  # sessions that never called /update-sql
+SQL_QUERY_TIMEOUT_SECONDS = float(os.getenv("SQL_QUERY_TIMEOUT_SECONDS", "15"))
+SQL_MAX_RESULT_ROWS = int(os.getenv("SQL_MAX_RESULT_ROWS", "200"))
+SQL_MAX_RESULT_BYTES = int(os.getenv("SQL_MAX_RESULT_BYTES", str(64 * 1024)))
+SQL_RESULT_CACHE_ENTRIES = int(os.getenv("SQL_RESULT_CACHE_ENTRIES", "512"))
+SQLITE_MMAP_BYTES = int(os.getenv("SQLITE_MMAP_BYTES", str(256 * 1024 ** 2)))
+SQLITE_CACHE_KIB = int(os.getenv("SQLITE_CACHE_KIB", str(64 * 1024)))
+SQL_WORKLOAD_LOG_PATH = os.getenv("SQL_WORKLOAD_LOG_PATH", "data/sql_workload.db")
+
+# === Rollups (pre-aggregated measures by dimension, comma-separated column names) ===
+ROLLUP_MEASURES = [c.strip() for c in os.getenv("ROLLUP_MEASURES", "Sales (USD),Profit (USD)").split(",") if c.strip()]
+ROLLUP_DIMENSIONS = [
+    c.strip() for c in os.getenv("ROLLUP_DIMENSIONS", "Year,Month,Customer Segment,Product Category").split(",") if c.strip()
+]
+ROLLUP_MAX_DIMENSIONS = int(os.getenv("ROLLUP_MAX_DIMENSIONS", "2"))  # rollups for every 1..N dimension combination
+# SQL rollups live in a sidecar SQLite file per database (attached read-only), never in the database itself
+SQL_ROLLUP_DIR = os.getenv("SQL_ROLLUP_DIR", "data/rollups")
+
+# === Answer Cache ===
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", "data/answer_cache.db")
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", str(24 * 3600)))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "10000"))
+
+# === Embedding Cache (chunk hash -> vector) ===
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "data/embedding_cache.db")
+RAG_INDEX_DIR = os.getenv("RAG_INDEX_DIR", os.path.join("data", "embeddings"))  # FAISS + BM25 index per context text
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "500000"))
+EMBEDDING_CACHE_TTL_SECONDS = int(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))
+RAG_CHAIN_CACHE_ENTRIES = int(os.getenv("RAG_CHAIN_CACHE_ENTRIES", "8"))  # FAISS stores + chains kept in memory
+QUERY_EMBEDDING_CACHE_ENTRIES = int(os.getenv("QUERY_EMBEDDING_CACHE_ENTRIES", "2048"))  # in-memory LRU
+
+# === RAG Retrieval ===
+# "hybrid" (BM25 + vector, fused), "vector", or "lexical" (BM25 only: no embedding call per question)
+RAG_RETRIEVAL_MODE = os.getenv("RAG_RETRIEVAL_MODE", "hybrid")
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "4"))
+RAG_FETCH_K = int(os.getenv("RAG_FETCH_K", "20"))  # candidates per retriever before fusion
+
+# === RAG Corpus (many documents, one persistent index) ===
+CORPUS_DIR = os.getenv("CORPUS_DIR", "data/corpus")
+CORPUS_IVF_THRESHOLD = int(os.getenv("CORPUS_IVF_THRESHOLD", "20000"))  # chunks before switching flat -> IVF
+CORPUS_NPROBE = int(os.getenv("CORPUS_NPROBE", "16"))
+CORPUS_TOP_K = int(os.getenv("CORPUS_TOP_K", "4"))
+
+# === Conversation History ===
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "2000"))  # tokens of chat history sent to an agent
+HISTORY_SUMMARY_TOKENS = int(os.getenv("HISTORY_SUMMARY_TOKENS", "150"))  # summary line for dropped turns
+TOKENIZER_MODEL = os.getenv("TOKENIZER_MODEL", "gpt-4o-mini")
+
+# === Sessions ===
+SESSION_IDLE_TTL_SECONDS = int(os.getenv("SESSION_IDLE_TTL_SECONDS", "1800"))
+
+# === Agent Concurrency (per agent type: running / waiting requests) ===
+AGENT_MAX_CONCURRENCY = {
+    "chat": int(os.getenv("CHAT_MAX_CONCURRENCY", "8")),
+    "sql": int(os.getenv("SQL_MAX_CONCURRENCY", "8")),
+    "context": int(os.getenv("CONTEXT_MAX_CONCURRENCY", "16")),
+}
+AGENT_MAX_QUEUE = {
+    "chat": int(os.getenv("CHAT_MAX_QUEUE", "200")),
+    "sql": int(os.getenv("SQL_MAX_QUEUE", "200")),
+    "context": int(os.getenv("CONTEXT_MAX_QUEUE", "400")),
+}
+
+# === Sessions / Tokens shared by every worker process ===
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", "data/sessions.db")  # session -> active dataset / DB / context
+TOKEN_TTL_SECONDS = int(os.getenv("TOKEN_TTL_SECONDS", "360"))
+# A cached token this close to expiry is not handed out again, so clients refreshing early get a fresh one
+TOKEN_REFRESH_MARGIN_SECONDS = int(os.getenv("TOKEN_REFRESH_MARGIN_SECONDS", "60"))
+
+# === Token Cache (this process's last issued token; any worker can verify any token) ===
 TOKEN_STORE = {
     "token": None,
     "expires_at": 0  # Unix timestamp
 }
+TOKEN_VERSION = "v1"
+
+
+def _sign(payload: str) -> str:
+    msg = f"{SECRET_ID}:{payload}".encode("utf-8")
+    return hmac.new(SECRET_KEY.encode("utf-8"), msg, hashlib.sha256).hexdigest()
+
 
 # === Generate Bearer Token ===
 def generate_bearer_token():
+    """
+    Self-verifying token "v1.<expiry>.<salt>.<hmac>": the expiry is signed with
+    SECRET_KEY, so every worker / replica sharing the secret can validate it without
+    shared state.
+    """
     current_time = time.time()
 
-    # Refresh token if expired or not generated
-    if TOKEN_STORE["token"] is None or current_time > TOKEN_STORE["expires_at"]:
+    # Refresh token if (about to be) expired or not generated
+    if TOKEN_STORE["token"] is None or current_time > TOKEN_STORE["expires_at"] - TOKEN_REFRESH_MARGIN_SECONDS:
         # Generate random salt
         salt = secrets.token_hex(8)  # 16 hex chars
+        expires_at = int(current_time) + TOKEN_TTL_SECONDS
 
-        # Create a message using secret_id, current timestamp, and salt
-        msg = f"{SECRET_ID}:{int(current_time)}:{salt}".encode("utf-8")
-
-        # Use HMAC with SHA256 and secret_key to create token
-        token = hmac.new(SECRET_KEY.encode("utf-8"), msg, hashlib.sha256).hexdigest()
+        payload = f"{TOKEN_VERSION}.{expires_at}.{salt}"
+        token = f"{payload}.{_sign(payload)}"
 
         # Cache token and its expiry
         TOKEN_STORE["token"] = token
-        TOKEN_STORE["expires_at"] = current_time + 360 # valid for 1 hour
+        TOKEN_STORE["expires_at"] = expires_at
         print(TOKEN_STORE["expires_at"])
 
-    return TOKEN_STORE["token"]
\ No newline at end of file
+    return TOKEN_STORE["token"]
+
+
+def verify_bearer_token(token: str) -> Optional[str]:
+    """None if `token` is valid, else the reason it is not ("expired" / "invalid")."""
+    parts = (token or "").split(".")
+    if len(parts) != 4 or parts[0] != TOKEN_VERSION or not parts[1].isdigit():
+        return "invalid"
+    payload, signature = ".".join(parts[:3]), parts[3]
+    if not hmac.compare_digest(_sign(payload), signature):
+        return "invalid"
+    if time.time() >= int(parts[1]):
+        return "expired"
+    return None
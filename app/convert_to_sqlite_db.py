@@ -1,46 +1,255 @@
 import os
-import pandas as pd
+import re
+import glob
+import time
 import sqlite3
-from sqlalchemy import text
-from langchain_community.utilities import SQLDatabase
+import argparse
+import pandas as pd
+from typing import Dict, List, Optional
+from app.rollups import refresh_sql_rollups, drop_embedded_rollups, source_version
 
 # Constants
-CSV_PATH = "../data/retail_transactions_dataset.csv"
-DB_FILE_PATH = "../data/retail_transactions_data.db"
-DB_URI = f"sqlite:///{DB_FILE_PATH}"
-TABLE_NAME = "retail_transactions"
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+CHUNK_ROWS = 50_000
+# Columns with at most this many distinct values (and no more than half the row count) get an index
+INDEX_MAX_DISTINCT = 100
+# Day-first formats are tried first: the bundled datasets use DD-MM-YYYY
+DATE_FORMATS = ("%d-%m-%Y", "%d/%m/%Y", "%Y-%m-%d", "%Y/%m/%d")
+INGEST_LOG_TABLE = "_ingest_log"
+# Replace mode loads into this table next to the live one, then swaps it in
+BUILD_TABLE_PREFIX = "_building_"
+
+
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def table_name_for(csv_path: str) -> str:
+    """data/retail_transactions_dataset.csv -> retail_transactions"""
+    stem = os.path.splitext(os.path.basename(csv_path))[0]
+    stem = re.sub(r"_dataset$", "", stem)
+    return re.sub(r"\W+", "_", stem).strip("_").lower()
+
+
+def db_path_for(csv_path: str) -> str:
+    """data/retail_transactions_dataset.csv -> data/retail_transactions_data.db"""
+    return os.path.join(os.path.dirname(os.path.abspath(csv_path)), f"{table_name_for(csv_path)}_data.db")
+
+
+# === Typing ===
+def detect_date_format(values: pd.Series) -> Optional[str]:
+    """Return the DATE_FORMATS entry every non-null value of a text column parses with, if any."""
+    sample = values.dropna().astype(str)
+    if sample.empty or not sample.str.match(r"^\d{1,4}[-/]\d{1,2}[-/]\d{1,4}$").all():
+        return None
+    for fmt in DATE_FORMATS:
+        if pd.to_datetime(sample, format=fmt, errors="coerce").notna().all():
+            return fmt
+    return None
+
+
+def infer_column_types(chunk: pd.DataFrame) -> Dict[str, str]:
+    """Explicit SQLite column types from the first chunk; date-like text columns become DATE."""
+    types = {}
+    for col, dtype in chunk.dtypes.items():
+        if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+            types[col] = "INTEGER"
+        elif pd.api.types.is_float_dtype(dtype):
+            # Integer columns with gaps come back as float from read_csv
+            non_null = chunk[col].dropna()
+            types[col] = "INTEGER" if len(non_null) and (non_null % 1 == 0).all() else "REAL"
+        elif detect_date_format(chunk[col]):
+            types[col] = "DATE"
+        else:
+            types[col] = "TEXT"
+    return types
+
+
+def coerce_chunk(chunk: pd.DataFrame, column_types: Dict[str, str]) -> List[tuple]:
+    """Convert a chunk to plain Python rows; DATE columns become sortable ISO 'YYYY-MM-DD' strings."""
+    chunk = chunk.copy()
+    for col, sql_type in column_types.items():
+        if sql_type == "DATE":
+            fmt = detect_date_format(chunk[col])
+            parsed = pd.to_datetime(chunk[col], format=fmt, errors="coerce") if fmt else \
+                pd.to_datetime(chunk[col], dayfirst=True, errors="coerce")
+            chunk[col] = parsed.dt.strftime("%Y-%m-%d")
+        elif sql_type == "INTEGER":
+            try:
+                chunk[col] = chunk[col].astype("Int64")
+            except (TypeError, ValueError):
+                pass  # mixed values: let SQLite's type affinity store them as-is
+    chunk = chunk.astype(object).where(chunk.notna(), None)
+    return list(chunk.itertuples(index=False, name=None))
+
+
+# === Storage ===
+def connect_for_load(db_path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -262144")  # 256 MiB while loading
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {INGEST_LOG_TABLE} ("
+        "table_name TEXT NOT NULL, source TEXT NOT NULL, rows_ingested INTEGER NOT NULL, "
+        "updated_at REAL NOT NULL, PRIMARY KEY (table_name, source))"
+    )
+    return conn
+
+
+def existing_column_types(conn: sqlite3.Connection, table: str) -> Dict[str, str]:
+    rows = conn.execute(f"PRAGMA table_info({quote_identifier(table)})").fetchall()
+    return {name: (decl or "TEXT").upper() for _, name, decl, *_ in rows}
+
+
+def log_ingest(conn: sqlite3.Connection, table: str, source: str, rows: int):
+    conn.execute(
+        f"INSERT INTO {INGEST_LOG_TABLE} (table_name, source, rows_ingested, updated_at) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT (table_name, source) DO UPDATE SET rows_ingested = excluded.rows_ingested, "
+        "updated_at = excluded.updated_at",
+        (table, source, rows, time.time()),
+    )
+
+
+def rows_already_ingested(conn: sqlite3.Connection, table: str, source: str) -> int:
+    row = conn.execute(
+        f"SELECT rows_ingested FROM {INGEST_LOG_TABLE} WHERE table_name = ? AND source = ?", (table, source)
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def create_indexes(conn: sqlite3.Connection, table: str, column_types: Dict[str, str]) -> List[str]:
+    """Index DATE columns and low-cardinality columns (segments, categories, months...)."""
+    (row_count,) = conn.execute(f"SELECT COUNT(*) FROM {quote_identifier(table)}").fetchone()
+    indexed = []
+    for col, sql_type in column_types.items():
+        q = quote_identifier(col)
+        if sql_type != "DATE":
+            (distinct,) = conn.execute(f"SELECT COUNT(DISTINCT {q}) FROM {quote_identifier(table)}").fetchone()
+            if not (0 < distinct <= INDEX_MAX_DISTINCT and distinct <= max(row_count // 2, 1)):
+                continue
+        suffix = re.sub(r"\W+", "_", col).strip("_").lower()
+        index_name = quote_identifier(f"idx_{table}_{suffix}")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {quote_identifier(table)} ({q})")
+        indexed.append(col)
+    return indexed
+
+
+# === Ingestion ===
+def ingest_csv(
+    csv_path: str,
+    db_path: Optional[str] = None,
+    table: Optional[str] = None,
+    append: bool = False,
+    chunk_rows: int = CHUNK_ROWS,
+) -> dict:
+    """
+    Stream a CSV into a SQLite table chunk by chunk, one transaction per chunk.
+
+    replace (default): load into a staging table inside the DB, then drop the old table
+             and rename the new one in a single transaction. Other tables are untouched.
+    append: insert only the CSV rows past what was ingested from this file before
+            (tracked in _ingest_log), keeping existing rows, indexes and types.
+    """
+    db_path = db_path or db_path_for(csv_path)
+    table = table or table_name_for(csv_path)
+    source = os.path.abspath(csv_path)
+    start = time.time()
+
+    # Rollups built at this version only miss the rows appended below
+    appended_since = source_version(db_path) if append and os.path.exists(db_path) else None
+    conn = connect_for_load(db_path)
+    try:
+        target = table if append else f"{BUILD_TABLE_PREFIX}{table}"
+        if not append:
+            # Left over from an interrupted load
+            conn.execute(f"DROP TABLE IF EXISTS {quote_identifier(target)}")
+        column_types = existing_column_types(conn, table) if append else {}
+        skip = rows_already_ingested(conn, table, source) if append else 0
+        # Skip data rows already loaded but keep the header row
+        reader = pd.read_csv(csv_path, chunksize=chunk_rows, skiprows=range(1, skip + 1) if skip else None)
+
+        inserted = 0
+        for chunk in reader:
+            if not column_types:
+                column_types = infer_column_types(chunk)
+                columns_sql = ", ".join(f"{quote_identifier(c)} {t}" for c, t in column_types.items())
+                conn.execute(f"CREATE TABLE IF NOT EXISTS {quote_identifier(target)} ({columns_sql})")
+
+            placeholders = ", ".join("?" for _ in chunk.columns)
+            insert_sql = (
+                f"INSERT INTO {quote_identifier(target)} ({', '.join(quote_identifier(c) for c in chunk.columns)}) "
+                f"VALUES ({placeholders})"
+            )
+            rows = coerce_chunk(chunk, {c: column_types.get(c, "TEXT") for c in chunk.columns})
+
+            conn.execute("BEGIN")
+            conn.executemany(insert_sql, rows)
+            inserted += len(rows)
+            if append:
+                log_ingest(conn, table, source, skip + inserted)
+            conn.execute("COMMIT")
+
+        if append:
+            indexed = create_indexes(conn, table, column_types) if column_types else []
+        elif column_types:
+            # Readers see either the old table or the new one, indexes and log included
+            conn.execute("BEGIN")
+            conn.execute(f"DROP TABLE IF EXISTS {quote_identifier(table)}")
+            conn.execute(f"ALTER TABLE {quote_identifier(target)} RENAME TO {quote_identifier(table)}")
+            indexed = create_indexes(conn, table, column_types)
+            conn.execute(f"DELETE FROM {INGEST_LOG_TABLE} WHERE table_name = ?", (table,))
+            log_ingest(conn, table, source, inserted)
+            conn.execute("COMMIT")
+        else:
+            indexed = []
+        # Rollups live in a sidecar file now; ones written here by older versions would shadow them
+        drop_embedded_rollups(conn)
+        conn.execute("ANALYZE")
+    finally:
+        conn.close()
 
-# Check if DB already exists
-if not os.path.exists(DB_FILE_PATH):
-    print("⚠️ DB not found. Creating SQLite DB from CSV...")
+    # Appended rows are folded into the existing rollups; a rebuilt table gets fresh ones
+    rollups = refresh_sql_rollups(db_path, tables=[table], appended_since=appended_since) if column_types else []
 
-    # Load data
-    df = pd.read_csv(CSV_PATH)
+    report = {
+        "csv": csv_path,
+        "db": db_path,
+        "table": table,
+        "mode": "append" if append else "replace",
+        "rows_inserted": inserted,
+        "column_types": column_types,
+        "indexed_columns": indexed,
+        "rollups": rollups,
+        "seconds": round(time.time() - start, 3),
+    }
+    print(f"✅ {report['mode']}: {inserted} row(s) from '{csv_path}' into {db_path}:{table} "
+          f"(indexes on {indexed or 'none'}) in {report['seconds']}s")
+    return report
 
-    # Create SQLite DB
-    conn = sqlite3.connect(DB_FILE_PATH)
-    df.to_sql(TABLE_NAME, conn, index=False, if_exists="replace")
 
-    # # Sample query to verify
-    # cursor = conn.cursor()
-    # cursor.execute(f"SELECT * FROM {TABLE_NAME} LIMIT 5")
-    # rows = cursor.fetchall()
-    # print("Sample rows:", rows)
+def ingest_data_dir(data_dir: str = DATA_DIR, append: bool = False) -> List[dict]:
+    """Ingest every CSV in `data_dir` into its own <name>_data.db."""
+    return [ingest_csv(path, append=append) for path in sorted(glob.glob(os.path.join(data_dir, "*.csv")))]
 
-    conn.close()
-    print(f"✅ SQLite DB created at '{DB_FILE_PATH}'")
 
-else:
-    print("✅ SQLite DB already exists. Connecting...")
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-load CSV files into typed, indexed SQLite databases.")
+    parser.add_argument("csv", nargs="*", help="CSV files to ingest (default: every CSV in data/)")
+    parser.add_argument("--db", help="Target SQLite file (default: <name>_data.db next to the CSV)")
+    parser.add_argument("--table", help="Target table name (default: derived from the CSV file name)")
+    parser.add_argument("--append", action="store_true", help="Append new rows instead of rebuilding the table")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    args = parser.parse_args()
 
-# Connect using LangChain's SQLDatabase
-db = SQLDatabase.from_uri(DB_URI)
+    if not args.csv:
+        ingest_data_dir(append=args.append)
+        return
+    if len(args.csv) > 1 and (args.db or args.table):
+        parser.error("--db/--table can only be used with a single CSV file")
+    for csv_path in args.csv:
+        ingest_csv(csv_path, db_path=args.db, table=args.table, append=args.append, chunk_rows=args.chunk_rows)
 
-# List all tables
-print("Tables:", db.get_usable_table_names())
 
-# Run sample query
-with db._engine.connect() as conn:
-    result = conn.execute(text(f"SELECT * FROM {TABLE_NAME} LIMIT 5"))
-    for row in result:
-        print(row)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+import os
+import re
+import hashlib
+import threading
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Set
+from app.components import timed
+from app.concurrency import KeyedLocks
+
+
+def dataframe_fingerprint(df: pd.DataFrame) -> str:
+    """Content hash of a DataFrame (column names, dtypes and row values)."""
+    h = hashlib.sha256()
+    h.update(repr([(str(c), str(t)) for c, t in df.dtypes.items()]).encode("utf-8"))
+    h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return h.hexdigest()
+
+
+def is_dataset_id(key: Optional[str]) -> bool:
+    """Dataset ids are sha256 hex digests; anything else never reaches a file path."""
+    return bool(re.fullmatch(r"[0-9a-f]{64}", key or ""))
+
+
+def _touch(path: str):
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+
+
+def dataframe_nbytes(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+@dataclass
+class DatasetEntry:
+    key: str
+    df: pd.DataFrame
+    nbytes: int
+    agent: Any = None  # built on first query
+    rollups: Optional[Dict[str, pd.DataFrame]] = None  # pre-aggregations, rebuilt after a spill reload
+
+
+class DatasetRegistry:
+    """
+    Content-addressed registry of loaded DataFrames and their agents.
+
+    Hot datasets stay in memory (LRU order) under a byte budget; each entry's agent
+    is built the first time the dataset is queried. Datasets evicted from memory
+    are spilled to an uncompressed Arrow/Feather file in `spill_dir`, which is
+    memory-mapped back in when the dataset is requested again. The spill dir has its
+    own byte budget (`spill_max_bytes`): the least recently used files are deleted,
+    except those of datasets `pinned()` returns (e.g. ones a session points at).
+    """
+
+    def __init__(self, build_agent: Callable[[DatasetEntry], Any], max_bytes: int, spill_dir: str,
+                 on_evict: Optional[Callable[[DatasetEntry], None]] = None, write_through: bool = False,
+                 spill_max_bytes: Optional[int] = None, pinned: Optional[Callable[[], Set[str]]] = None):
+        self.build_agent = build_agent
+        # Also write new datasets to the spill cache right away, so other worker processes can load them by key
+        self.write_through = write_through
+        self.on_evict = on_evict  # e.g. release what was built for the entry outside the registry
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.spill_max_bytes = spill_max_bytes
+        self.pinned = pinned
+        self._entries: "OrderedDict[str, DatasetEntry]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._builds = KeyedLocks()  # agent builds, one lock per dataset key
+        os.makedirs(spill_dir, exist_ok=True)
+
+    # === Lookup ===
+    def spill_path(self, key: str) -> str:
+        if not is_dataset_id(key):
+            raise ValueError(f"Invalid dataset id: {key!r}")
+        return os.path.join(self.spill_dir, f"{key}.arrow")
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._entries or (is_dataset_id(key) and os.path.exists(self.spill_path(key)))
+
+    def get(self, key: str) -> Optional[DatasetEntry]:
+        """Return the entry for `key`, reloading it from the spill cache if needed."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+            if not is_dataset_id(key):
+                return None
+
+            path = self.spill_path(key)
+            if not os.path.exists(path):
+                return None
+
+            _touch(path)
+            with timed("dataset:spill"):
+                table = feather.read_table(path, memory_map=True)
+                df = table.to_pandas(split_blocks=True)
+            print(f"📂 Reloaded dataset {key[:12]} from spill cache: {path}")
+            return self._insert(key, df)
+
+    # === Registration ===
+    def put(self, df: pd.DataFrame, key: Optional[str] = None, rollups: Optional[Dict[str, pd.DataFrame]] = None) -> DatasetEntry:
+        """Register a DataFrame (or reuse the cached entry with the same content key)."""
+        key = key or dataframe_fingerprint(df)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+            entry = self._insert(key, df, rollups)
+        if self.write_through:
+            self._write_spill(entry)
+        return entry
+
+    def _insert(self, key: str, df: pd.DataFrame, rollups: Optional[Dict[str, pd.DataFrame]] = None) -> DatasetEntry:
+        entry = DatasetEntry(key=key, df=df, nbytes=dataframe_nbytes(df), rollups=rollups)
+        self._entries[key] = entry
+        self._evict()
+        return entry
+
+    def get_agent(self, entry: DatasetEntry):
+        if entry.agent is None:
+            # Not under the registry lock: building (rollups, publishing, the agent) is slow
+            with self._builds.hold(entry.key):
+                if entry.agent is None:
+                    entry.agent = self.build_agent(entry)
+                    with self._lock:
+                        evicted = self._entries.get(entry.key) is not entry
+                    # Evicted while building: release what the build set up (e.g. the shared-memory copy)
+                    if evicted and self.on_evict is not None:
+                        self.on_evict(entry)
+        return entry.agent
+
+    # === Eviction ===
+    def total_bytes(self) -> int:
+        return sum(e.nbytes for e in self._entries.values())
+
+    def _evict(self):
+        # The most recently used entry is never evicted, even if it alone exceeds the budget
+        while len(self._entries) > 1 and self.total_bytes() > self.max_bytes:
+            key, entry = self._entries.popitem(last=False)
+            self._spill(entry)
+            if self.on_evict is not None:
+                self.on_evict(entry)
+
+    def _write_spill(self, entry: DatasetEntry) -> str:
+        path = self.spill_path(entry.key)
+        if os.path.exists(path):
+            _touch(path)
+            return path
+        table = pa.Table.from_pandas(entry.df, preserve_index=False)
+        # Per-process temp name: several workers may write the same dataset at once
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        feather.write_feather(table, tmp_path, compression="uncompressed")
+        os.replace(tmp_path, path)
+        self._prune_spill(keep=entry.key)
+        return path
+
+    def _prune_spill(self, keep: str):
+        """Delete least recently used spill files (mtime = last use) until the dir fits its budget."""
+        if self.spill_max_bytes is None:
+            return
+        files = []
+        for name in os.listdir(self.spill_dir):
+            if name.endswith(".arrow"):
+                try:
+                    stat = os.stat(os.path.join(self.spill_dir, name))
+                except FileNotFoundError:
+                    continue  # removed by another worker
+                files.append((stat.st_mtime, stat.st_size, name[: -len(".arrow")]))
+        total = sum(size for _, size, _ in files)
+        if total <= self.spill_max_bytes:
+            return
+        pinned = (self.pinned() if self.pinned is not None else set()) | {keep}
+        for _, size, key in sorted(files):
+            if total <= self.spill_max_bytes:
+                break
+            if key in pinned:
+                continue
+            try:
+                # Workers that memory-mapped the file keep their mapping
+                os.remove(self.spill_path(key))
+            except FileNotFoundError:
+                pass
+            total -= size
+            print(f"🧹 Removed spilled dataset {key[:12]} ({size} bytes) to stay under {self.spill_max_bytes} bytes")
+
+    def _spill(self, entry: DatasetEntry):
+        path = self._write_spill(entry)
+        print(f"💾 Spilled dataset {entry.key[:12]} ({entry.nbytes} bytes) to: {path}")
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            in_memory = [
+                {"dataset_id": e.key, "in_memory": True, "bytes": e.nbytes, "rows": len(e.df)}
+                for e in reversed(self._entries.values())
+            ]
+            spilled = [
+                {"dataset_id": name[: -len(".arrow")], "in_memory": False}
+                for name in sorted(os.listdir(self.spill_dir))
+                if name.endswith(".arrow") and name[: -len(".arrow")] not in self._entries
+            ]
+        return in_memory + spilled
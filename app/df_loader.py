@@ -0,0 +1,271 @@
+import os
+import hashlib
+import tempfile
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pcsv
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from fastapi.concurrency import run_in_threadpool
+
+# === Constants ===
+SUPPORTED_FORMATS = ("csv", "excel", "parquet", "arrow")
+FORMAT_BY_EXTENSION = {
+    ".csv": "csv",
+    ".xlsx": "excel",
+    ".xls": "excel",
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".arrow": "arrow",
+    ".feather": "arrow",
+    ".ipc": "arrow",
+}
+# Column types are inferred from the first block, so blocks are large
+CSV_BLOCK_BYTES = 16 * 1024 * 1024
+# Upload chunks are buffered up to this size between thread hops to the disk writer
+SPOOL_BUFFER_BYTES = 4 * 1024 * 1024
+PARQUET_BATCH_ROWS = 100_000
+
+
+def detect_format(fmt: Optional[str] = None, filename: Optional[str] = None) -> str:
+    """Resolve the upload format from an explicit value or the file extension."""
+    if fmt:
+        fmt = fmt.lower()
+        if fmt in ("xlsx", "xls"):
+            fmt = "excel"
+        if fmt in ("feather", "ipc"):
+            fmt = "arrow"
+    elif filename:
+        fmt = FORMAT_BY_EXTENSION.get(os.path.splitext(filename)[1].lower())
+
+    if fmt not in SUPPORTED_FORMATS:
+        raise ValueError(f"Unsupported upload format: {fmt or filename}. Expected one of {SUPPORTED_FORMATS}.")
+    return fmt
+
+
+async def spool_upload(chunks: AsyncIterator[bytes], suffix: str = "") -> Tuple[str, int, str]:
+    """
+    Write an incoming byte stream to a temporary file chunk by chunk.
+    The raw payload never lives in memory as a whole; returns (path, size in bytes, sha256 hex).
+    """
+    size = 0
+    digest = hashlib.sha256()
+    # File writes and hashing run in the threadpool, not on the event loop
+    tmp = await run_in_threadpool(tempfile.NamedTemporaryFile, delete=False, suffix=suffix)
+    try:
+        pending: List[bytes] = []
+        buffered = 0
+        async for chunk in chunks:
+            if chunk:
+                pending.append(chunk)
+                buffered += len(chunk)
+                size += len(chunk)
+            if buffered >= SPOOL_BUFFER_BYTES:
+                await run_in_threadpool(_write_chunks, tmp, digest, pending)
+                pending, buffered = [], 0
+        await run_in_threadpool(_write_chunks, tmp, digest, pending)
+    finally:
+        await run_in_threadpool(tmp.close)
+    return tmp.name, size, digest.hexdigest()
+
+
+def _write_chunks(tmp, digest, chunks: List[bytes]):
+    for chunk in chunks:
+        tmp.write(chunk)
+        digest.update(chunk)
+
+
+def _open_csv(path: str, column_types: Optional[Dict[str, pa.DataType]] = None):
+    return pcsv.open_csv(
+        path,
+        read_options=pcsv.ReadOptions(block_size=CSV_BLOCK_BYTES),
+        convert_options=pcsv.ConvertOptions(column_types=column_types or {}, timestamp_parsers=[]),
+    )
+
+
+def _read_csv(path: str) -> pd.DataFrame:
+    """Arrow record batches appended into one Table and converted once (no per-chunk frames to concat)."""
+    try:
+        reader = _open_csv(path)
+        names = reader.schema.names
+        if len(set(names)) != len(names) or not all(names):
+            raise pa.ArrowInvalid("duplicate or empty column names")
+        # Dates stay text like pd.read_csv gives them; optimize_dtypes parses them with the dayfirst rules
+        temporal = {f.name: pa.string() for f in reader.schema if pa.types.is_temporal(f.type)}
+        if temporal:
+            reader = _open_csv(path, temporal)
+        table = pa.Table.from_batches(list(reader), schema=reader.schema)
+    except pa.ArrowInvalid:
+        # Types that change after the first block, pandas-only header handling...: one pandas pass
+        return pd.read_csv(path)
+    return table.to_pandas(self_destruct=True, split_blocks=True)
+
+
+def _read_parquet(path: str) -> pd.DataFrame:
+    parquet_file = pq.ParquetFile(path)
+    batches = list(parquet_file.iter_batches(batch_size=PARQUET_BATCH_ROWS))
+    table = pa.Table.from_batches(batches, schema=parquet_file.schema_arrow)
+    return table.to_pandas(self_destruct=True, split_blocks=True)
+
+
+def _read_arrow(path: str) -> pd.DataFrame:
+    # Accept both the Arrow IPC file format (.arrow/.feather) and the streaming format
+    with pa.memory_map(path, "r") as source:
+        try:
+            reader = ipc.open_file(source)
+            batches = [reader.get_batch(i) for i in range(reader.num_record_batches)]
+        except pa.ArrowInvalid:
+            source.seek(0)
+            reader = ipc.open_stream(source)
+            batches = list(reader)
+        table = pa.Table.from_batches(batches, schema=reader.schema)
+        return table.to_pandas(self_destruct=True, split_blocks=True)
+
+
+def read_dataframe(path: str, fmt: str) -> pd.DataFrame:
+    """Build a DataFrame incrementally (chunks / record batches) from an uploaded file."""
+    fmt = detect_format(fmt)
+    if fmt == "csv":
+        return _read_csv(path)
+    if fmt == "excel":
+        return pd.read_excel(path)
+    if fmt == "parquet":
+        return _read_parquet(path)
+    return _read_arrow(path)
+
+
+# === Memory-compact dtypes ===
+# Day-first (or month-first) dates are parsed once at load instead of in every agent filter
+DATE_PATTERNS = [
+    (r"\d{1,2}-\d{1,2}-\d{4}", "%d-%m-%Y", "%m-%d-%Y"),
+    (r"\d{1,2}/\d{1,2}/\d{4}", "%d/%m/%Y", "%m/%d/%Y"),
+    (r"\d{1,2}\.\d{1,2}\.\d{4}", "%d.%m.%Y", "%m.%d.%Y"),
+    (r"\d{4}-\d{2}-\d{2}", "%Y-%m-%d", "%Y-%m-%d"),
+]
+DATE_SAMPLE_ROWS = 1000
+# Integers are not downcast below int32: agent arithmetic on int8/int16 columns overflows silently
+MIN_INT_DTYPE = "int32"
+
+
+def _is_string(series: pd.Series) -> bool:
+    return pd.api.types.is_string_dtype(series) or pd.api.types.is_object_dtype(series)
+
+
+def _date_format(series: pd.Series, dayfirst: bool) -> Optional[str]:
+    sample = series.dropna().head(DATE_SAMPLE_ROWS).astype(str)
+    if sample.empty:
+        return None
+    for pattern, dayfirst_format, monthfirst_format in DATE_PATTERNS:
+        if sample.str.fullmatch(pattern).all():
+            return dayfirst_format if dayfirst else monthfirst_format
+    return None
+
+
+def _is_low_cardinality(unique: int, rows: int, max_ratio: float, max_unique: int) -> bool:
+    return rows > 0 and unique <= max_unique and unique / rows <= max_ratio
+
+
+def optimize_dtypes(df: pd.DataFrame, max_unique_ratio: Optional[float] = None, max_unique: Optional[int] = None,
+                    dayfirst: Optional[bool] = None) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """
+    Shrink a freshly loaded frame: date-like strings are parsed to datetime64,
+    low-cardinality strings become categoricals, integers (to int32 at the
+    smallest) and, when lossless, floats are downcast. Returns the new frame and a report of memory before / after and of
+    every converted column.
+    """
+    from app.config import CATEGORY_MAX_UNIQUE_RATIO, CATEGORY_MAX_UNIQUE, DATE_DAYFIRST
+
+    max_unique_ratio = CATEGORY_MAX_UNIQUE_RATIO if max_unique_ratio is None else max_unique_ratio
+    max_unique = CATEGORY_MAX_UNIQUE if max_unique is None else max_unique
+    dayfirst = DATE_DAYFIRST if dayfirst is None else dayfirst
+
+    before = int(df.memory_usage(index=True, deep=True).sum())
+    rows = len(df)
+    columns: Dict[str, Any] = {}
+    out: Dict[int, pd.Series] = {}
+    # By position: column names may repeat or not be strings (e.g. /update-df JSON)
+    for i, name in enumerate(df.columns):
+        series = df.iloc[:, i]
+        converted = series
+        if _is_string(series):
+            fmt = _date_format(series, dayfirst)
+            parsed = pd.to_datetime(series, format=fmt, errors="coerce") if fmt else None
+            # Only if every value parsed: a failed row would silently turn into NaT
+            if parsed is not None and parsed.isna().sum() == series.isna().sum():
+                converted = parsed
+            else:
+                try:
+                    if _is_low_cardinality(series.nunique(dropna=True), rows, max_unique_ratio, max_unique):
+                        converted = series.astype("category")
+                except TypeError:
+                    pass  # unhashable objects (lists, dicts) stay as they are
+        elif pd.api.types.is_integer_dtype(series) and isinstance(series.dtype, np.dtype):
+            downcast = pd.to_numeric(series, downcast="integer")
+            if downcast.dtype.itemsize < np.dtype(MIN_INT_DTYPE).itemsize:
+                downcast = series.astype(MIN_INT_DTYPE) if series.dtype.itemsize > 4 else series
+            converted = downcast
+        elif pd.api.types.is_float_dtype(series):
+            downcast = pd.to_numeric(series, downcast="float")
+            # float32 keeps ~7 significant digits: only downcast when no value changes
+            if downcast.dtype != series.dtype and downcast.astype(series.dtype).equals(series):
+                converted = downcast
+        if converted is not series and str(converted.dtype) != str(series.dtype):
+            columns[str(name)] = f"{series.dtype} -> {converted.dtype}"
+            out[i] = converted
+
+    result = df
+    if out:
+        result = df.copy(deep=False)
+        for i, converted in out.items():
+            result.isetitem(i, converted)
+    after = int(result.memory_usage(index=True, deep=True).sum())
+    report = {
+        "bytes_before": before,
+        "bytes_after": after,
+        "saved_pct": round(100 * (before - after) / before, 1) if before else 0.0,
+        "columns": columns,
+    }
+    return result, report
+
+
+def align_categories(base: pd.DataFrame, new_rows: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Give appended rows the base frame's dtypes, widening categoricals to the union of
+    both categories, so pd.concat keeps them categorical instead of falling back to object.
+    """
+    # Columns are paired by position (the k-th column of a name with the k-th in the new rows),
+    # since names may repeat or not be strings
+    new_positions: Dict[Any, List[int]] = {}
+    for j, name in enumerate(new_rows.columns):
+        new_positions.setdefault(name, []).append(j)
+    seen: Dict[Any, int] = {}
+    base_out, new_out = {}, {}
+    for i, name in enumerate(base.columns):
+        k = seen[name] = seen.get(name, -1) + 1
+        positions = new_positions.get(name, [])
+        if k >= len(positions):
+            continue
+        left, right = base.iloc[:, i], new_rows.iloc[:, positions[k]]
+        if isinstance(left.dtype, pd.CategoricalDtype):
+            extra = pd.Index(right.dropna().unique()).difference(left.cat.categories)
+            if len(extra):
+                left = left.cat.add_categories(extra)
+            base_out[i] = left
+            new_out[positions[k]] = right.astype(left.dtype)
+    if base_out:
+        base = base.copy(deep=False)
+        for i, left in base_out.items():
+            base.isetitem(i, left)
+    if new_out:
+        new_rows = new_rows.copy(deep=False)
+        for j, right in new_out.items():
+            new_rows.isetitem(j, right)
+    return base, new_rows
+
+
+def format_memory_report(report: Dict[str, Any]) -> str:
+    mb = 1024 ** 2
+    return (f"{report['bytes_before'] / mb:.2f} MB -> {report['bytes_after'] / mb:.2f} MB "
+            f"({report['saved_pct']}% saved, {len(report['columns'])} columns converted)")
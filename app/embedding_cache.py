@@ -0,0 +1,197 @@
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Any, Dict, List
+from langchain_core.embeddings import Embeddings
+from app.config import (
+    EMBEDDING_CACHE_PATH,
+    EMBEDDING_CACHE_MAX_ENTRIES,
+    EMBEDDING_CACHE_TTL_SECONDS,
+    EMBEDDING_BATCH_SIZE,
+    QUERY_EMBEDDING_CACHE_ENTRIES,
+)
+
+# SQLite limits the number of bound parameters per statement
+LOOKUP_BATCH = 500
+
+
+def embedding_model_name(embeddings: Embeddings) -> str:
+    """Vectors of different models must never be mixed, so the model is part of every key."""
+    return str(getattr(embeddings, "model", None) or getattr(embeddings, "model_name", None) or type(embeddings).__name__)
+
+
+def chunk_hash(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    Persistent chunk-hash -> float32 vector store (SQLite).
+
+    `last_used` is refreshed whenever a vector is part of an index being built, and
+    vectors not used within the TTL (or beyond the entry budget, least recently
+    used first) are evicted.
+    """
+
+    def __init__(self, path: str, max_entries: int, ttl_seconds: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS vectors (
+                chunk_hash TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_vectors_last_used ON vectors (last_used)")
+        self._conn.commit()
+
+    def get_many(self, hashes: List[str]) -> Dict[str, List[float]]:
+        """Cached vectors for `hashes` (missing ones are left out); marks the found ones as used."""
+        found: Dict[str, List[float]] = {}
+        now = time.time()
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            for i in range(0, len(unique), LOOKUP_BATCH):
+                batch = unique[i:i + LOOKUP_BATCH]
+                placeholders = ", ".join("?" for _ in batch)
+                rows = self._conn.execute(
+                    f"SELECT chunk_hash, vector FROM vectors WHERE chunk_hash IN ({placeholders})", batch
+                ).fetchall()
+                found.update({h: np.frombuffer(blob, dtype=np.float32).tolist() for h, blob in rows})
+                self._conn.execute(f"UPDATE vectors SET last_used = ? WHERE chunk_hash IN ({placeholders})", [now, *batch])
+            self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(unique) - len(found)
+        return found
+
+    def put_many(self, model: str, vectors: Dict[str, List[float]]):
+        now = time.time()
+        rows = [
+            (h, model, len(v), np.asarray(v, dtype=np.float32).tobytes(), now)
+            for h, v in vectors.items()
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO vectors (chunk_hash, model, dim, vector, last_used) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+
+    def evict(self) -> int:
+        """Drop vectors unused for longer than the TTL, then the least recently used beyond the budget."""
+        with self._lock:
+            removed = self._conn.execute(
+                "DELETE FROM vectors WHERE last_used < ?", (time.time() - self.ttl_seconds,)
+            ).rowcount
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM vectors").fetchone()
+            if count > self.max_entries:
+                removed += self._conn.execute(
+                    "DELETE FROM vectors WHERE chunk_hash IN "
+                    "(SELECT chunk_hash FROM vectors ORDER BY last_used ASC LIMIT ?)",
+                    (count - self.max_entries,),
+                ).rowcount
+            self._conn.commit()
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            (entries,) = self._conn.execute("SELECT COUNT(*) FROM vectors").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+        }
+
+
+class QueryEmbeddingCache:
+    """In-memory LRU of question embeddings: a repeated question skips the remote embedding call."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def put(self, key: str, vector: List[float]):
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only sends chunks missing from the store to the model, in batches."""
+
+    def __init__(self, embeddings: Embeddings, store: "EmbeddingStore", batch_size: int = EMBEDDING_BATCH_SIZE):
+        self.embeddings = embeddings
+        self.store = store
+        self.batch_size = batch_size
+        self.model = embedding_model_name(embeddings)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [chunk_hash(self.model, t) for t in texts]
+        vectors = self.store.get_many(hashes)
+        missing = list(dict.fromkeys((h, t) for h, t in zip(hashes, texts) if h not in vectors))
+        for i in range(0, len(missing), self.batch_size):
+            batch = missing[i:i + self.batch_size]
+            embedded = dict(zip((h for h, _ in batch), self.embeddings.embed_documents([t for _, t in batch])))
+            self.store.put_many(self.model, embedded)
+            vectors.update(embedded)
+        if missing:
+            print(f"🧮 Embedded {len(missing)} new chunk(s), reused {len(set(hashes)) - len(missing)} cached")
+            self.store.evict()
+        return [vectors[h] for h in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = chunk_hash(self.model, text)
+        vector = query_embedding_cache.get(key)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            query_embedding_cache.put(key, vector)
+        return vector
+
+
+query_embedding_cache = QueryEmbeddingCache(QUERY_EMBEDDING_CACHE_ENTRIES)
+embedding_store = EmbeddingStore(
+    EMBEDDING_CACHE_PATH, max_entries=EMBEDDING_CACHE_MAX_ENTRIES, ttl_seconds=EMBEDDING_CACHE_TTL_SECONDS
+)
@@ -0,0 +1,132 @@
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+from app.config import HISTORY_TOKEN_BUDGET, HISTORY_SUMMARY_TOKENS, TOKENIZER_MODEL
+
+# === Constants ===
+# Per-message overhead of the chat format (role + separators), as counted by OpenAI
+MESSAGE_OVERHEAD_TOKENS = 4
+SUMMARY_PREFIX = "Earlier in this conversation the user asked: "
+SUMMARY_QUESTION_TOKENS = 30  # each dropped question is shortened to this in the summary
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def get_encoding():
+    """tiktoken encoding of the chat model; None (estimate ~4 chars/token) if it cannot be loaded, e.g. offline."""
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                try:
+                    import tiktoken
+                    try:
+                        _encoding = tiktoken.encoding_for_model(TOKENIZER_MODEL)
+                    except KeyError:
+                        _encoding = tiktoken.get_encoding("o200k_base")
+                except Exception as e:
+                    print(f"⚠️ tiktoken encoding unavailable ({type(e).__name__}); estimating token counts")
+                    _encoding = False
+    return _encoding or None
+
+
+def count_tokens(text: str) -> int:
+    encoding = get_encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    encoding = get_encoding()
+    if encoding is None:
+        return text[:max_tokens * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens]) + "…"
+
+
+def as_dict(message) -> Dict[str, str]:
+    """ChatMessage / dict -> {"role", "content"}"""
+    if isinstance(message, dict):
+        return {"role": message.get("role", "user"), "content": str(message.get("content", ""))}
+    return {"role": getattr(message, "role", "user"), "content": str(getattr(message, "content", ""))}
+
+
+def render(messages: List[Dict[str, str]]) -> str:
+    """'User: ...\\nAssistant: ...' (the prompt format every agent receives)."""
+    return "\n".join(f"{m['role'].capitalize()}: {m['content']}" for m in messages)
+
+
+@dataclass
+class Conversation:
+    """A conversation compacted to the token budget, with the counts needed to report the savings."""
+    messages: List[Dict[str, str]]
+    original_tokens: int
+    prompt_tokens: int
+    dropped_turns: int = 0
+    summarized: bool = False
+    text: str = field(init=False)
+
+    def __post_init__(self):
+        self.text = render(self.messages)
+
+    def usage(self) -> Dict[str, Any]:
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "original_tokens": self.original_tokens,
+            "dropped_turns": self.dropped_turns,
+            "summarized": self.summarized,
+        }
+
+
+def _message_tokens(message: Dict[str, str]) -> int:
+    return count_tokens(render([message])) + MESSAGE_OVERHEAD_TOKENS
+
+
+def compact(messages, budget: int = HISTORY_TOKEN_BUDGET, summary_tokens: int = HISTORY_SUMMARY_TOKENS) -> Conversation:
+    """
+    Fit a chat history into `budget` tokens: the latest user turn is kept verbatim
+    (even if it alone exceeds the budget), then earlier turns newest-first while
+    they fit. Turns that do not fit are dropped; their (most recent) user questions
+    are folded into a one-line extractive summary of at most `summary_tokens` tokens.
+    """
+    history = [as_dict(m) for m in messages or [] if as_dict(m)["content"]]
+    costs = [_message_tokens(m) for m in history]
+    original = sum(costs)
+    if original <= budget or not history:
+        return Conversation(history, original, original)
+
+    latest = max((i for i, m in enumerate(history) if m["role"] == "user"), default=len(history) - 1)
+    kept = {latest}
+    used = costs[latest]
+    # Something will be dropped, so leave room for its summary
+    limit = budget - summary_tokens
+    for i in range(len(history) - 1, -1, -1):
+        if i == latest:
+            continue
+        if used + costs[i] > limit:
+            break  # keep the history contiguous: nothing older than a turn that did not fit
+        kept.add(i)
+        used += costs[i]
+
+    dropped = [m for i, m in enumerate(history) if i not in kept]
+    compacted = [m for i, m in enumerate(history) if i in kept]
+    summarized = False
+    room = min(summary_tokens, budget - used - MESSAGE_OVERHEAD_TOKENS) - count_tokens(SUMMARY_PREFIX)
+    questions = []
+    # Most recent dropped questions first, each shortened, until the summary budget is spent
+    for m in reversed(dropped):
+        if m["role"] != "user":
+            continue
+        question = truncate_tokens(" ".join(m["content"].split()), SUMMARY_QUESTION_TOKENS)
+        cost = count_tokens(question) + 1
+        if cost > room:
+            break
+        questions.insert(0, question)
+        room -= cost
+    if questions:
+        compacted.insert(0, {"role": "system", "content": SUMMARY_PREFIX + " | ".join(questions)})
+        summarized = True
+    prompt = sum(_message_tokens(m) for m in compacted)
+    return Conversation(compacted, original, prompt, dropped_turns=len(dropped), summarized=summarized)
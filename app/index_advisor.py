@@ -0,0 +1,304 @@
+import os
+import re
+import time
+import shutil
+import sqlite3
+import hashlib
+import threading
+import statistics
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+from app.config import SQL_WORKLOAD_LOG_PATH
+
+# === Constants ===
+MAX_INDEX_COLUMNS = 6
+BENCHMARK_QUERIES_PER_INDEX = 3
+BENCHMARK_RUNS = 3
+
+_IDENT = r'"((?:[^"]|"")+)"|`([^`]+)`|\[([^\]]+)\]|([A-Za-z_][A-Za-z0-9_]*)'
+_PREDICATE = re.compile(rf"(?:{_IDENT})\s*(==|=|<=|>=|<>|!=|<|>|\bIN\b|\bBETWEEN\b|\bLIKE\b)", re.IGNORECASE)
+_CLAUSES = ("SELECT", "FROM", "WHERE", "GROUP BY", "HAVING", "ORDER BY", "LIMIT")
+
+
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def is_read_statement(sql: str) -> bool:
+    return bool(re.match(r"^\s*(SELECT|WITH)\b", sql, re.IGNORECASE))
+
+
+def connect_query_only(db_path: str) -> sqlite3.Connection:
+    """A read-only connection for replaying logged statements (never the read-write DDL connection)."""
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    conn.execute("PRAGMA query_only = 1")
+    return conn
+
+
+def explain_query_plan(conn: sqlite3.Connection, sql: str) -> str:
+    """EXPLAIN QUERY PLAN details of a read statement, one step per line ('' if not explainable)."""
+    if not is_read_statement(sql):
+        return ""
+    try:
+        return "\n".join(row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall())
+    except sqlite3.Error:
+        return ""
+
+
+# === Workload log ===
+class WorkloadLog:
+    """Successful read statements the agents execute, with runtime and query plan, per database file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS statements (
+                id INTEGER PRIMARY KEY,
+                db_path TEXT NOT NULL,
+                sql TEXT NOT NULL,
+                elapsed_ms REAL NOT NULL,
+                rows INTEGER,
+                status TEXT NOT NULL,
+                plan TEXT,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_statements_db ON statements (db_path, created_at)")
+        self._conn.commit()
+
+    def record(self, db_path: str, sql: str, elapsed: float, rows: Optional[int], status: str, plan: str):
+        # Failed statements and anything but SELECT / WITH must never become an advisor sample_sql
+        if status != "ok" or not is_read_statement(sql):
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO statements (db_path, sql, elapsed_ms, rows, status, plan, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (os.path.abspath(db_path), sql, elapsed * 1000, rows, status, plan, time.time()),
+            )
+            self._conn.commit()
+
+    def statements(self, db_path: str, limit: int = 5000) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT sql, elapsed_ms, rows, status, plan FROM statements WHERE db_path = ? AND status = 'ok' "
+                "ORDER BY created_at DESC LIMIT ?",
+                (os.path.abspath(db_path), limit),
+            ).fetchall()
+        return [dict(zip(("sql", "elapsed_ms", "rows", "status", "plan"), r)) for r in rows]
+
+
+workload_log = WorkloadLog(SQL_WORKLOAD_LOG_PATH)
+
+
+# === SQL shape extraction (lightweight, SQLite-flavoured) ===
+def _strip_literals(sql: str) -> str:
+    return re.sub(r"'(?:[^']|'')*'", "''", sql)
+
+
+def _identifiers(fragment: str) -> List[str]:
+    return [next(g for g in m.groups() if g is not None).replace('""', '"') for m in re.finditer(_IDENT, fragment)]
+
+
+def _split_clauses(sql: str) -> Dict[str, str]:
+    """Top-level clause text by keyword (the last SELECT block wins for nested queries)."""
+    upper = sql.upper()
+    positions = []
+    for keyword in _CLAUSES:
+        pattern = r"\b" + keyword.replace(" ", r"\s+") + r"\b"
+        for m in re.finditer(pattern, upper):
+            positions.append((m.start(), m.end(), keyword))
+    positions.sort()
+    clauses = {}
+    for i, (start, end, keyword) in enumerate(positions):
+        stop = positions[i + 1][0] if i + 1 < len(positions) else len(sql)
+        clauses[keyword] = sql[end:stop]
+    return clauses
+
+
+def statement_shape(sql: str, table_columns: Dict[str, List[str]]) -> List[Dict[str, Any]]:
+    """Per referenced table: equality / range predicate columns, GROUP BY / ORDER BY columns and other columns used."""
+    clauses = _split_clauses(_strip_literals(sql))
+    referenced_tables = [t for t in _identifiers(clauses.get("FROM", "")) if t in table_columns]
+    shapes = []
+    for table in dict.fromkeys(referenced_tables):
+        columns = set(table_columns[table])
+        eq, rng = [], []
+        for m in _PREDICATE.finditer(clauses.get("WHERE", "")):
+            col = next(g for g in m.groups()[:4] if g is not None).replace('""', '"')
+            if col not in columns:
+                continue
+            op = m.group(5).upper()
+            (eq if op in ("=", "==", "IN") else rng).append(col)
+        group_by = [c for c in _identifiers(clauses.get("GROUP BY", "")) if c in columns]
+        order_by = [c for c in _identifiers(clauses.get("ORDER BY", "")) if c in columns]
+        used = [c for part in ("SELECT", "WHERE", "HAVING") for c in _identifiers(clauses.get(part, "")) if c in columns]
+        shapes.append({
+            "table": table,
+            "eq": list(dict.fromkeys(eq)),
+            "range": list(dict.fromkeys(c for c in rng if c not in eq)),
+            "group_by": list(dict.fromkeys(group_by)),
+            "order_by": list(dict.fromkeys(order_by)),
+            "used": list(dict.fromkeys(used)),
+        })
+    return shapes
+
+
+def candidate_index(shape: Dict[str, Any]) -> Optional[Tuple[Tuple[str, ...], bool]]:
+    """Equality columns, then GROUP BY (or the first range) column, then the rest to cover the query."""
+    key = list(shape["eq"])
+    for col in shape["group_by"] or shape["range"][:1] or shape["order_by"]:
+        if col not in key:
+            key.append(col)
+    if not key:
+        return None
+    covering = key + [c for c in shape["used"] if c not in key]
+    if len(covering) <= MAX_INDEX_COLUMNS:
+        return tuple(covering), True
+    return tuple(key[:MAX_INDEX_COLUMNS]), False
+
+
+def _plan_needs_index(plan: str, table: str) -> bool:
+    for line in plan.splitlines():
+        if re.match(rf"SCAN {re.escape(table)}\b", line) and "COVERING INDEX" not in line:
+            return True
+        if "USE TEMP B-TREE" in line:
+            return True
+    return False
+
+
+# === Advisor ===
+def table_columns_of(conn: sqlite3.Connection) -> Dict[str, List[str]]:
+    tables = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+    return {t: [r[1] for r in conn.execute(f"PRAGMA table_info({quote_identifier(t)})")] for t in tables}
+
+
+def existing_index_prefixes(conn: sqlite3.Connection, table: str) -> List[Tuple[str, ...]]:
+    prefixes = []
+    for _, name, *_ in conn.execute(f"PRAGMA index_list({quote_identifier(table)})").fetchall():
+        prefixes.append(tuple(r[2] for r in conn.execute(f"PRAGMA index_info({quote_identifier(name)})")))
+    return prefixes
+
+
+def recommend_indexes(db_path: str, top_n: int = 5) -> List[Dict[str, Any]]:
+    """Aggregate the logged workload of `db_path` into ranked index recommendations."""
+    with sqlite3.connect(f"file:{db_path}?mode=ro", uri=True) as conn:
+        table_columns = table_columns_of(conn)
+        existing = {t: existing_index_prefixes(conn, t) for t in table_columns}
+
+    candidates: Dict[Tuple[str, Tuple[str, ...]], Dict[str, Any]] = {}
+    for stmt in workload_log.statements(db_path):
+        if not is_read_statement(stmt["sql"]):
+            continue  # rows logged before writes were filtered out
+        for shape in statement_shape(stmt["sql"], table_columns):
+            table = shape["table"]
+            if stmt["plan"] and not _plan_needs_index(stmt["plan"], table):
+                continue
+            candidate = candidate_index(shape)
+            if candidate is None:
+                continue
+            columns, covering = candidate
+            if any(prefix[:len(columns)] == columns for prefix in existing[table]):
+                continue
+            entry = candidates.setdefault((table, columns), {
+                "table": table,
+                "columns": list(columns),
+                "covering": covering,
+                "queries": 0,
+                "total_ms": 0.0,
+                "sample_sql": [],
+            })
+            entry["queries"] += 1
+            entry["total_ms"] += stmt["elapsed_ms"]
+            if stmt["sql"] not in entry["sample_sql"] and len(entry["sample_sql"]) < BENCHMARK_QUERIES_PER_INDEX:
+                entry["sample_sql"].append(stmt["sql"])
+
+    ranked = sorted(candidates.values(), key=lambda c: (c["total_ms"], c["queries"]), reverse=True)[:top_n]
+    for rec in ranked:
+        digest = hashlib.md5(repr((rec["table"], rec["columns"])).encode()).hexdigest()[:8]
+        table_slug = re.sub(r"\W+", "_", rec["table"]).lower()
+        rec["index_name"] = f"idx_auto_{table_slug}_{digest}"
+        rec["ddl"] = (
+            f"CREATE INDEX IF NOT EXISTS {quote_identifier(rec['index_name'])} ON {quote_identifier(rec['table'])} "
+            f"({', '.join(quote_identifier(c) for c in rec['columns'])})"
+        )
+        rec["total_ms"] = round(rec["total_ms"], 3)
+    return ranked
+
+
+def _time_queries(conn: sqlite3.Connection, queries: List[str]) -> Dict[str, float]:
+    timings = {}
+    for sql in queries:
+        if not is_read_statement(sql):
+            continue
+        runs = []
+        for _ in range(BENCHMARK_RUNS):
+            start = time.perf_counter()
+            try:
+                conn.execute(sql).fetchall()
+            except sqlite3.Error:
+                break
+            runs.append((time.perf_counter() - start) * 1000)
+        if runs:
+            timings[sql] = round(statistics.median(runs), 3)
+    return timings
+
+
+def with_indexes(db_path: str, recommendations: List[Dict[str, Any]]):
+    """
+    Create the indexes on a copy of `db_path` and swap it in with os.replace. Executors open
+    the file with immutable=1 (no locking, no change detection), so it is never rewritten in
+    place: open connections keep reading the old file, and the new fingerprint makes every
+    worker rebuild its agent on the next request.
+    """
+    if os.path.exists(f"{db_path}-wal"):
+        raise ValueError(f"{db_path} has an open write-ahead log; checkpoint it before applying indexes")
+    building = f"{db_path}.{os.getpid()}.indexing"
+    source = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+    conn = sqlite3.connect(building)
+    try:
+        source.backup(conn)
+        for rec in recommendations:
+            conn.execute(rec["ddl"])
+            print(f"🧭 Created index {rec['index_name']} on {rec['table']}({', '.join(rec['columns'])})")
+        conn.execute("ANALYZE")
+        conn.commit()
+    except Exception:
+        conn.close()
+        os.remove(building)
+        raise
+    finally:
+        source.close()
+    conn.close()
+    shutil.copymode(db_path, building)
+    os.replace(building, db_path)
+
+
+def apply_recommendations(db_path: str, top_n: int = 3) -> List[Dict[str, Any]]:
+    """Create the top recommended (covering) indexes on `db_path` and report query times before / after."""
+    recommendations = recommend_indexes(db_path, top_n=top_n)
+    if not recommendations:
+        return []
+
+    # Sample statements are replayed on query-only connections; only the DDL gets write access
+    conn = connect_query_only(db_path)
+    try:
+        for rec in recommendations:
+            rec["before_ms"] = _time_queries(conn, rec["sample_sql"])
+    finally:
+        conn.close()
+
+    with_indexes(db_path, recommendations)
+
+    conn = connect_query_only(db_path)
+    try:
+        for rec in recommendations:
+            rec["after_ms"] = _time_queries(conn, rec["sample_sql"])
+    finally:
+        conn.close()
+    return recommendations
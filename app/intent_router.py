@@ -0,0 +1,411 @@
+import re
+import math
+import sqlite3
+import threading
+import pandas as pd
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from app.rollups import rollup_plan, rollup_name, measure_columns
+
+# === Constants ===
+# Only columns with at most this many distinct values are matched as filter values ("in 2025", "Corporate")
+MAX_VALUE_DISTINCT = 100
+MAX_ANSWER_ROWS = 50
+VALUE_CACHE_ENTRIES = 32
+
+AGGREGATE_PHRASES = {
+    "sum": ("total", "totals", "sum", "sum of"),
+    "mean": ("average", "avg", "mean"),
+    "count": ("count", "number of", "how many"),
+    "max": ("maximum", "max", "highest", "largest", "biggest"),
+    "min": ("minimum", "min", "lowest", "smallest"),
+}
+AGGREGATE_LABELS = {
+    "sum": "Total", "mean": "Average", "count": "Number of", "distinct": "Number of distinct",
+    "max": "Maximum", "min": "Minimum",
+}
+GROUP_WORDS = {"by", "per", "each", "across"}
+# Words that end a GROUP BY list ("... by Segment in 2025")
+CLAUSE_WORDS = {"in", "for", "where", "with", "during", "from", "on", "at"}
+# Everything else in the question must be one of these, or the router defers to the agent
+FILLER_WORDS = GROUP_WORDS | CLAUSE_WORDS | {
+    "what", "whats", "what's", "which", "is", "are", "was", "were", "the", "of", "show", "me", "give", "list",
+    "tell", "get", "find", "compute", "calculate", "a", "an", "our", "all", "and", "to", "please", "value",
+    "values", "amount", "breakdown", "grouped", "broken", "down", "split", "overall", "orders", "rows",
+    "records", "transactions", "there",
+}
+
+
+@dataclass
+class Intent:
+    """A single aggregate over one measure, optionally grouped and filtered by equality."""
+    agg: str  # an AGGREGATE_PHRASES key, or "distinct" for a count over a non-numeric column
+    measure: Optional[str]  # None only for row counts
+    group_by: List[str] = field(default_factory=list)
+    filters: List[Tuple[str, Any]] = field(default_factory=list)
+
+    @property
+    def columns(self) -> List[str]:
+        return list(dict.fromkeys(self.group_by + [c for c, _ in self.filters]))
+
+    def headline(self) -> str:
+        text = f"{AGGREGATE_LABELS[self.agg]} {self.measure or 'rows'}"
+        if self.group_by:
+            text += f" by {', '.join(self.group_by)}"
+        if self.filters:
+            text += " where " + " and ".join(f"{c} = {v}" for c, v in self.filters)
+        return text
+
+
+def latest_question(messages) -> str:
+    """The last user message of a chat payload (list of ChatMessage / dicts) or a plain string."""
+    if isinstance(messages, str):
+        return messages
+    for message in reversed(list(messages or [])):
+        role = message.get("role") if isinstance(message, dict) else getattr(message, "role", None)
+        content = message.get("content") if isinstance(message, dict) else getattr(message, "content", None)
+        if role in (None, "user") and content:
+            return str(content)
+    return ""
+
+
+# === Parsing ===
+def _column_phrases(columns: Sequence[str]) -> Dict[str, List[str]]:
+    """Lower-case phrase -> columns it may refer to: full name, name without '(unit)', last word."""
+    phrases: Dict[str, List[str]] = {}
+    last_words: Dict[str, List[str]] = {}
+    for col in columns:
+        name = str(col).lower().replace("_", " ").strip()
+        bare = re.sub(r"\s*\([^)]*\)", "", name).strip()
+        for phrase in {name, bare, str(col).lower()}:
+            if phrase:
+                phrases.setdefault(phrase, []).append(col)
+        words = bare.split()
+        if len(words) > 1:
+            last_words.setdefault(words[-1], []).append(col)
+    for word, cols in last_words.items():
+        phrases.setdefault(word, cols)
+    # "categories" -> "category" (plain "s" / "es" plurals are handled by the matcher)
+    for phrase, cols in list(phrases.items()):
+        if phrase.endswith("y"):
+            phrases.setdefault(phrase[:-1] + "ies", cols)
+    return {p: list(dict.fromkeys(cols)) for p, cols in phrases.items()}
+
+
+def parse_intent(question: str, columns: Sequence[str], numeric: Sequence[str],
+                 values: Dict[str, List[Tuple[str, Any]]]) -> Optional[Intent]:
+    """
+    Match `question` against the schema: every word must be an aggregate, a column,
+    a known value of a low-cardinality column or a filler word. Returns None unless
+    exactly one aggregate and (except for row counts) exactly one numeric measure match;
+    a count over a non-numeric column counts its distinct values.
+    """
+    text = question.lower().strip()
+    vocabulary: Dict[str, Tuple[str, Any]] = {}
+    for agg, phrases in AGGREGATE_PHRASES.items():
+        vocabulary.update({p: ("agg", agg) for p in phrases})
+    for phrase, cols in _column_phrases(columns).items():
+        vocabulary.setdefault(phrase, ("col", cols))
+    for phrase, matches in values.items():
+        vocabulary.setdefault(phrase, ("val", matches))
+
+    pattern = "|".join(
+        re.escape(p).replace(r"\ ", r"\s+") for p in sorted(vocabulary, key=len, reverse=True)
+    )
+    items: List[Tuple[str, Any]] = []
+    pos = 0
+    for m in re.finditer(rf"(?<![\w])(?:{pattern})(?:s|es)?(?![\w])", text):
+        items += [("word", w) for w in re.findall(r"[a-z0-9']+", text[pos:m.start()])]
+        items.append(vocabulary[_singular(re.sub(r"\s+", " ", m.group(0)), vocabulary)])
+        pos = m.end()
+    items += [("word", w) for w in re.findall(r"[a-z0-9']+", text[pos:])]
+
+    aggs, measures, group_by, filters = set(), [], [], {}
+    grouping = False
+    for kind, payload in items:
+        if kind == "word":
+            if payload not in FILLER_WORDS:
+                return None
+            if payload in GROUP_WORDS:
+                grouping = True
+            elif payload in CLAUSE_WORDS:
+                grouping = False
+        elif kind == "agg":
+            aggs.add(payload)
+        elif kind == "col":
+            if len(payload) != 1:
+                return None  # ambiguous alias
+            (group_by if grouping else measures).append(payload[0])
+        else:
+            if len(payload) != 1:
+                return None  # value present in several columns
+            col, value = payload[0]
+            if filters.get(col, value) != value:
+                return None  # "in 2024 and 2025" needs IN, leave it to the agent
+            filters[col] = value
+
+    if len(aggs) != 1:
+        return None
+    agg = aggs.pop()
+    measures = list(dict.fromkeys(measures))
+    if len(measures) > 1 or (not measures and agg != "count"):
+        return None
+    measure = measures[0] if measures else None
+    if measure is not None and measure not in numeric:
+        if agg != "count":
+            return None
+        # "how many product categories" asks for distinct values, not non-null rows
+        agg = "distinct"
+    group_by = list(dict.fromkeys(group_by))
+    if measure in group_by:
+        return None
+    return Intent(agg=agg, measure=measure, group_by=group_by, filters=list(filters.items()))
+
+
+def _singular(phrase: str, vocabulary: Dict[str, Any]) -> str:
+    for candidate in (phrase, phrase[:-2], phrase[:-1]):
+        if candidate in vocabulary:
+            return candidate
+    raise KeyError(phrase)
+
+
+# === Known values of low-cardinality columns ===
+_values: "OrderedDict[Any, Dict[str, List[Tuple[str, Any]]]]" = OrderedDict()
+_values_lock = threading.Lock()
+
+
+def _cached_values(key, compute) -> Dict[str, List[Tuple[str, Any]]]:
+    with _values_lock:
+        if key in _values:
+            _values.move_to_end(key)
+            return _values[key]
+    values = compute()
+    with _values_lock:
+        _values[key] = values
+        while len(_values) > VALUE_CACHE_ENTRIES:
+            _values.popitem(last=False)
+    return values
+
+
+def _index_values(pairs) -> Dict[str, List[Tuple[str, Any]]]:
+    index: Dict[str, List[Tuple[str, Any]]] = {}
+    for col, value in pairs:
+        phrase = str(value).strip().lower()
+        if phrase:
+            index.setdefault(phrase, []).append((col, value))
+    return index
+
+
+def frame_values(key: str, df: pd.DataFrame) -> Dict[str, List[Tuple[str, Any]]]:
+    def compute():
+        pairs = []
+        for col in df.columns:
+            if pd.api.types.is_float_dtype(df[col]):
+                continue
+            uniques = df[col].dropna().unique()
+            if len(uniques) <= MAX_VALUE_DISTINCT:
+                pairs += [(col, v.item() if hasattr(v, "item") else v) for v in uniques]
+        return _index_values(pairs)
+    return _cached_values(("frame", key), compute)
+
+
+def sql_values(fingerprint: str, conn: sqlite3.Connection, table: str, columns: Sequence[str]) -> Dict[str, List[Tuple[str, Any]]]:
+    def compute():
+        q_table = _quote(table)
+        counts = conn.execute(
+            f"SELECT {', '.join(f'COUNT(DISTINCT {_quote(c)})' for c in columns)} FROM {q_table}"
+        ).fetchone()
+        pairs = []
+        for col, distinct in zip(columns, counts):
+            if 0 < distinct <= MAX_VALUE_DISTINCT:
+                rows = conn.execute(f"SELECT DISTINCT {_quote(col)} FROM {q_table} WHERE {_quote(col)} IS NOT NULL")
+                pairs += [(col, v) for (v,) in rows if not isinstance(v, float)]
+        return _index_values(pairs)
+    return _cached_values(("sql", fingerprint, table), compute)
+
+
+# === Execution ===
+def _find_rollup(intent: Intent, columns: Sequence[str], numeric: Optional[Sequence[str]],
+                 available: Sequence[str], table: Optional[str] = None) -> Optional[Tuple[str, ...]]:
+    """Smallest rollup whose dimensions cover every grouped / filtered column of the intent."""
+    measures, dim_sets = rollup_plan(columns, numeric)
+    if intent.agg == "distinct" or (intent.measure is not None and intent.measure not in measures):
+        return None
+    needed = set(intent.columns)
+    covering = [dims for dims in dim_sets if needed <= set(dims) and rollup_name(dims, table) in available]
+    return min(covering, key=len) if covering else None
+
+
+def answer_from_frame(question: str, key: str, df: pd.DataFrame,
+                      rollups: Optional[Dict[str, pd.DataFrame]] = None) -> Optional[str]:
+    """Vectorized pandas answer for a template-shaped question, or None to use the agent."""
+    numeric = list(df.select_dtypes("number").columns)
+    intent = parse_intent(question, list(df.columns), numeric, frame_values(key, df))
+    if intent is None:
+        return None
+
+    dims = _find_rollup(intent, list(df.columns), numeric, list(rollups or {}))
+    source = rollups[rollup_name(dims)] if dims else df
+    mask = pd.Series(True, index=source.index)
+    for col, value in intent.filters:
+        mask &= source[col] == value
+    source = source[mask]
+
+    if dims:
+        cols = measure_columns(intent.measure) if intent.measure else {}
+        if intent.agg == "mean":
+            sums = _aggregate(source, intent.group_by, cols["sum"], "sum")
+            counts = _aggregate(source, intent.group_by, cols["count"], "sum")
+            if intent.group_by:
+                result = sums / counts.where(counts > 0)
+            else:
+                result = sums / counts if counts else math.nan
+        elif intent.agg == "count":
+            result = _aggregate(source, intent.group_by, cols["count"] if intent.measure else "row_count", "sum")
+        else:
+            how = {"sum": "sum", "min": "min", "max": "max"}[intent.agg]
+            result = _aggregate(source, intent.group_by, cols[intent.agg], how)
+    elif intent.agg == "count" and intent.measure is None:
+        result = source.groupby(intent.group_by, dropna=False).size() if intent.group_by else len(source)
+    else:
+        how = "nunique" if intent.agg == "distinct" else intent.agg
+        result = _aggregate(source, intent.group_by, intent.measure, how)
+
+    if isinstance(result, pd.Series):
+        rows = [((k if isinstance(k, tuple) else (k,)), v) for k, v in result.sort_index().items()]
+        return format_answer(intent, rows)
+    return format_answer(intent, [((), result)])
+
+
+def _aggregate(frame: pd.DataFrame, group_by: List[str], column: str, how: str):
+    if group_by:
+        return frame.groupby(group_by, dropna=False)[column].agg(how)
+    return frame[column].agg(how)
+
+
+def compile_sql(intent: Intent, table: str, columns: Sequence[str], available: Sequence[str]) -> str:
+    """One SELECT answering the intent, reading a covering rollup table when there is one."""
+    dims = _find_rollup(intent, columns, None, available, table)
+    if dims:
+        source = rollup_name(dims, table)
+        cols = {a: _quote(c) for a, c in measure_columns(intent.measure).items()} if intent.measure else {}
+        value = {
+            "sum": lambda: f"SUM({cols['sum']})",
+            "mean": lambda: f"SUM({cols['sum']}) * 1.0 / NULLIF(SUM({cols['count']}), 0)",
+            "count": lambda: f"SUM({cols['count']})" if intent.measure else "SUM(row_count)",
+            "min": lambda: f"MIN({cols['min']})",
+            "max": lambda: f"MAX({cols['max']})",
+        }[intent.agg]()
+    else:
+        source = table
+        measure = _quote(intent.measure) if intent.measure else "*"
+        if intent.agg == "distinct":
+            measure = f"DISTINCT {measure}"
+        value = {
+            "sum": "SUM", "mean": "AVG", "count": "COUNT", "distinct": "COUNT", "min": "MIN", "max": "MAX",
+        }[intent.agg] + f"({measure})"
+
+    group_sql = ", ".join(_quote(c) for c in intent.group_by)
+    sql = f"SELECT {group_sql + ', ' if group_sql else ''}{value} FROM {_quote(source)}"
+    if intent.filters:
+        sql += " WHERE " + " AND ".join(f"{_quote(c)} = {_literal(v)}" for c, v in intent.filters)
+    if group_sql:
+        sql += f" GROUP BY {group_sql} ORDER BY {group_sql}"
+    return sql
+
+
+def answer_from_sql(question: str, executor, snapshot) -> Optional[str]:
+    """Single-statement SQL answer for a template-shaped question, or None to use the agent."""
+    from app.sql_executor import connect_readonly
+
+    candidates = []
+    conn = connect_readonly(executor.db_path)
+    try:
+        for table in snapshot.tables:
+            if table.startswith("rollup_"):
+                continue
+            columns = snapshot.columns[table]
+            numeric = [
+                name for _, name, decl, *_ in conn.execute(f"PRAGMA table_info({_quote(table)})")
+                if any(t in (decl or "").upper() for t in ("INT", "REAL", "FLOA", "DOUB", "NUM", "DEC"))
+            ]
+            intent = parse_intent(question, columns, numeric, sql_values(executor.fingerprint, conn, table, columns))
+            if intent is not None:
+                candidates.append((table, columns, intent))
+    finally:
+        conn.close()
+    if len(candidates) != 1:
+        return None  # no match, or the question fits several tables
+
+    table, columns, intent = candidates[0]
+    result = executor.execute(compile_sql(intent, table, columns, snapshot.tables + snapshot.rollups))
+    rows = [(tuple(row[:-1]), row[-1]) for row in result.rows]
+    return format_answer(intent, rows, truncated=result.truncated)
+
+
+# === Formatting ===
+def _quote(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _literal(value: Any) -> str:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _number(value: Any) -> str:
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return str(value)
+    if math.isnan(value):
+        return "n/a"
+    return f"{int(value):,}" if value.is_integer() else f"{value:,.2f}"
+
+
+def format_answer(intent: Intent, rows: List[Tuple[tuple, Any]], truncated: bool = False) -> str:
+    if not intent.group_by:
+        value = rows[0][1] if rows else None
+        return f"{intent.headline()}: {_number(value) if value is not None else 'no matching rows'}"
+    if not rows:
+        return f"{intent.headline()}: no matching rows."
+    lines = [f"{intent.headline()}:"]
+    lines += [f"- {' / '.join(str(k) for k in keys)}: {_number(v)}" for keys, v in rows[:MAX_ANSWER_ROWS]]
+    if truncated or len(rows) > MAX_ANSWER_ROWS:
+        lines.append(f"(showing the first {min(len(rows), MAX_ANSWER_ROWS)} groups)")
+    return "\n".join(lines)
+
+
+# === Hit-rate / latency bookkeeping ===
+class RouterStats:
+    """Fast-path vs agent counts and mean latency per agent type."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def record(self, kind: str, fast_path: bool, seconds: float):
+        prefix = "fast_path" if fast_path else "agent"
+        with self._lock:
+            s = self._stats.setdefault(kind, {"fast_path": 0, "agent": 0, "fast_path_seconds": 0.0, "agent_seconds": 0.0})
+            s[prefix] += 1
+            s[f"{prefix}_seconds"] += seconds
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            report = {}
+            for kind, s in self._stats.items():
+                total = s["fast_path"] + s["agent"]
+                report[kind] = {
+                    "fast_path": s["fast_path"],
+                    "agent": s["agent"],
+                    "hit_rate": round(s["fast_path"] / total, 4) if total else 0.0,
+                    "fast_path_avg_ms": round(1000 * s["fast_path_seconds"] / s["fast_path"], 2) if s["fast_path"] else None,
+                    "agent_avg_ms": round(1000 * s["agent_seconds"] / s["agent"], 2) if s["agent"] else None,
+                }
+            return report
+
+
+router_stats = RouterStats()
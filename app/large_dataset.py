@@ -0,0 +1,357 @@
+"""
+Out-of-core mode for the DataFrame agent: an upload is written once as partitioned
+Parquet under LARGE_DATASET_DIR/<dataset_id>/ and every agent question runs as a
+DuckDB query over it (partition pruning, row-group statistics and projection
+pushdown), under a fixed memory limit that spills to disk. Only the capped result
+of each query is materialized as pandas.
+"""
+
+import os
+import json
+import time
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Type
+from pydantic import BaseModel, Field
+from langchain_core.tools import BaseTool
+from app.components import get_llm, timed
+from app.concurrency import KeyedLocks
+from app.tracing import observe_stage
+from app.dataset_registry import is_dataset_id
+from app.config import (
+    LARGE_DATASET_DIR, LARGE_PARTITION_COLUMNS, LARGE_FILE_SIZE, LARGE_MEMORY_LIMIT, LARGE_THREADS,
+    LARGE_QUERY_TIMEOUT_SECONDS, LARGE_MAX_RESULT_ROWS, LARGE_AGENT_CACHE_ENTRIES, DATE_DAYFIRST,
+)
+
+# === Constants ===
+META_FILE = "meta.json"
+TABLE_NAME = "data"
+SAMPLE_ROWS = 3
+MAX_STRING_LENGTH = 300  # per value in results, as for the SQL agent
+
+_db = None
+_db_lock = threading.Lock()
+# Locked-down DuckDB instances that run agent queries, one per dataset (LRU like the agents)
+_query_dbs: "OrderedDict[str, Any]" = OrderedDict()
+_query_dbs_lock = threading.Lock()
+
+
+def _open_db():
+    import duckdb
+
+    spill_dir = os.path.join(LARGE_DATASET_DIR, "_spill")
+    os.makedirs(spill_dir, exist_ok=True)
+    db = duckdb.connect()
+    db.execute(f"SET memory_limit = {_literal(LARGE_MEMORY_LIMIT)}")
+    db.execute(f"SET temp_directory = {_literal(spill_dir)}")
+    db.execute(f"SET threads = {int(LARGE_THREADS)}")
+    # Lets COPY / aggregations stream instead of buffering to keep row order
+    db.execute("SET preserve_insertion_order = false")
+    return db
+
+
+def _connect():
+    """The process-wide DuckDB instance used for ingestion (in-memory catalog; data stays in the Parquet files)."""
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                _db = _open_db()
+    return _db
+
+
+def _query_db(dataset_id: str):
+    """
+    DuckDB instance for the agent's queries over one dataset. Its view `data` is the only
+    way to the files: external access is off except for the dataset's own directory and the
+    configuration is locked, so read_csv('/etc/passwd'), other datasets or ATTACH are refused.
+    """
+    with _query_dbs_lock:
+        db = _query_dbs.get(dataset_id)
+        if db is None:
+            directory = os.path.abspath(dataset_dir(dataset_id))
+            db = _open_db()
+            db.execute(f"SET allowed_directories = [{_literal(directory + os.sep)}]")
+            db.execute(f"CREATE VIEW {TABLE_NAME} AS SELECT * FROM {scan_sql(directory)}")
+            db.execute("SET enable_external_access = false")
+            db.execute("SET lock_configuration = true")
+            _query_dbs[dataset_id] = db
+            while len(_query_dbs) > LARGE_AGENT_CACHE_ENTRIES:
+                _query_dbs.popitem(last=False)  # closed once its last cursor is gone
+        _query_dbs.move_to_end(dataset_id)
+        return db
+
+
+def _literal(value: str) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _ident(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+# === Storage ===
+def dataset_dir(dataset_id: str) -> str:
+    if not is_dataset_id(dataset_id):
+        raise ValueError(f"Invalid dataset id: {dataset_id!r}")
+    return os.path.join(LARGE_DATASET_DIR, dataset_id)
+
+
+def exists(dataset_id: Optional[str]) -> bool:
+    return is_dataset_id(dataset_id) and os.path.exists(os.path.join(dataset_dir(dataset_id), META_FILE))
+
+
+def load_meta(dataset_id: str) -> Dict[str, Any]:
+    with open(os.path.join(dataset_dir(dataset_id), META_FILE), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def scan_sql(directory: str) -> str:
+    # union_by_name: appended parts may carry slightly different column types
+    pattern = os.path.join(directory, "**", "*.parquet")
+    return f"read_parquet({_literal(pattern)}, hive_partitioning = true, union_by_name = true)"
+
+
+def _register_source(cursor, path: str, fmt: str) -> str:
+    """SQL source for an uploaded file; CSV and Parquet are scanned by DuckDB directly, in a streaming fashion."""
+    if fmt == "csv":
+        date_format = "%d-%m-%Y" if DATE_DAYFIRST else "%m-%d-%Y"
+        return f"read_csv({_literal(path)}, dateformat = {_literal(date_format)})"
+    if fmt == "parquet":
+        return f"read_parquet({_literal(path)})"
+    if fmt == "arrow":
+        import pyarrow as pa
+        import pyarrow.ipc as ipc
+
+        source = pa.memory_map(path, "r")
+        try:
+            file_reader = ipc.open_file(source)
+            batches = (file_reader.get_batch(i) for i in range(file_reader.num_record_batches))
+            reader = pa.RecordBatchReader.from_batches(file_reader.schema, batches)
+        except pa.ArrowInvalid:
+            source.seek(0)
+            reader = ipc.open_stream(source)
+        cursor.register("upload", reader)
+        return "upload"
+    # Excel has no streaming reader; it is small enough to go through pandas
+    import pandas as pd
+
+    cursor.register("upload", pd.read_excel(path))
+    return "upload"
+
+
+def _link_parts(source_dir: str, target_dir: str):
+    """Reuse the Parquet parts of `source_dir` in `target_dir` (hard links; copies across filesystems)."""
+    for root, _, files in os.walk(source_dir):
+        for name in files:
+            if not name.endswith(".parquet"):
+                continue
+            src = os.path.join(root, name)
+            dst = os.path.join(target_dir, os.path.relpath(src, source_dir))
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copy2(src, dst)
+
+
+def ingest(path: str, fmt: str, dataset_id: str, base_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Write an uploaded file as partitioned Parquet under `dataset_id` (appended to the
+    parts of `base_id` when given). Partitioned by the LARGE_PARTITION_COLUMNS the data
+    has, otherwise split into LARGE_FILE_SIZE parts. Returns the dataset's metadata.
+    """
+    if exists(dataset_id):
+        return load_meta(dataset_id)
+    target = dataset_dir(dataset_id)
+    tmp_dir = f"{target}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    cursor = _connect().cursor()
+    try:
+        with timed("large_ingest"):
+            source = _register_source(cursor, path, fmt)
+            columns = [row[0] for row in cursor.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()]
+            if base_id:
+                _link_parts(dataset_dir(base_id), tmp_dir)
+                partition_by = load_meta(base_id)["partition_by"]
+            else:
+                partition_by = [c for c in LARGE_PARTITION_COLUMNS if c in columns]
+            options = ["FORMAT PARQUET", "APPEND"]
+            if partition_by:
+                options.append(f"PARTITION_BY ({', '.join(_ident(c) for c in partition_by)})")
+            else:
+                options.append(f"FILE_SIZE_BYTES {_literal(LARGE_FILE_SIZE)}")
+            cursor.execute(f"COPY (SELECT * FROM {source}) TO {_literal(tmp_dir)} ({', '.join(options)})")
+
+            # Row count and schema come from the Parquet footers, not a scan
+            rows = cursor.execute(f"SELECT COUNT(*) FROM {scan_sql(tmp_dir)}").fetchone()[0]
+            schema = cursor.execute(f"DESCRIBE SELECT * FROM {scan_sql(tmp_dir)}").fetchall()
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    finally:
+        cursor.close()
+
+    parts = [os.path.join(root, name) for root, _, files in os.walk(tmp_dir) for name in files if name.endswith(".parquet")]
+    meta = {
+        "dataset_id": dataset_id,
+        "rows": int(rows),
+        "columns": {name: dtype for name, dtype, *_ in schema},
+        "partition_by": partition_by,
+        "files": len(parts),
+        "bytes": sum(os.path.getsize(p) for p in parts),
+        "base_id": base_id,
+        "created_at": time.time(),
+    }
+    with open(os.path.join(tmp_dir, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    if os.path.exists(target):
+        shutil.rmtree(tmp_dir, ignore_errors=True)  # written concurrently by another request
+    else:
+        os.replace(tmp_dir, target)
+    print(f"🗄️ Stored large dataset {dataset_id[:12]}: {meta['rows']} rows in {meta['files']} Parquet files ({meta['bytes']} bytes)")
+    return meta
+
+
+def list_datasets() -> List[Dict[str, Any]]:
+    if not os.path.isdir(LARGE_DATASET_DIR):
+        return []
+    datasets = []
+    for name in sorted(os.listdir(LARGE_DATASET_DIR)):
+        if exists(name):
+            meta = load_meta(name)
+            datasets.append({"dataset_id": name, "in_memory": False, "storage": "large",
+                             "rows": meta["rows"], "bytes": meta["bytes"], "files": meta["files"]})
+    return datasets
+
+
+# === Query Execution ===
+def run_query(dataset_id: str, sql: str, max_rows: int = LARGE_MAX_RESULT_ROWS,
+              timeout_seconds: float = LARGE_QUERY_TIMEOUT_SECONDS) -> str:
+    """
+    Run one SELECT against the dataset (as table `data`) and return at most `max_rows`
+    rows as text, or an error string for the agent. The LIMIT is pushed into the
+    query, so a runaway result is never materialized.
+    """
+    import duckdb
+
+    cursor = _query_db(dataset_id).cursor()
+    timer = threading.Timer(timeout_seconds, cursor.interrupt)
+    start = time.perf_counter()
+    try:
+        statements = cursor.extract_statements(sql)
+        if len(statements) != 1 or statements[0].type != duckdb.StatementType.SELECT:
+            return "Error: only a single read-only SELECT statement is allowed."
+        timer.start()
+        result = cursor.sql(sql.strip().rstrip(";")).limit(max_rows + 1).df()
+    except duckdb.InterruptException:
+        return (f"Error: query exceeded the {timeout_seconds}s time limit and was cancelled. "
+                "Write a more selective query (filters on partition columns, aggregates, LIMIT).")
+    except duckdb.Error as e:
+        return f"Error: {e}"
+    finally:
+        timer.cancel()
+        observe_stage("sql", time.perf_counter() - start, "duckdb")
+        cursor.close()
+
+    if result.empty:
+        return ""
+    truncated = len(result) > max_rows
+    text = result.head(max_rows).to_string(index=False, max_colwidth=MAX_STRING_LENGTH)
+    if truncated:
+        text += (f"\n[Result truncated to the first {max_rows} rows. "
+                 "Aggregate or add a LIMIT / WHERE clause to see specific rows.]")
+    return text
+
+
+# === Agent ===
+class QueryInput(BaseModel):
+    query: str = Field(description="A single DuckDB SQL SELECT statement over the table `data`")
+
+
+class DuckDBQueryTool(BaseTool):
+    name: str = "duckdb_query"
+    description: str = (
+        "Run a DuckDB SQL SELECT against the table `data` (the whole dataset, stored on disk) and get the "
+        "result rows back. Aggregate and filter in SQL; results are capped in size. "
+        "If the query is not correct, an error message will be returned: rewrite it and try again."
+    )
+    args_schema: Type[BaseModel] = QueryInput
+    dataset_id: str
+
+    def _run(self, query: str, run_manager=None) -> str:
+        return run_query(self.dataset_id, query)
+
+
+def build_prompt(dataset_id: str):
+    from langchain_core.messages import SystemMessage
+    from langchain_core.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, MessagesPlaceholder
+
+    meta = load_meta(dataset_id)
+    sample = run_query(dataset_id, f"SELECT * FROM {TABLE_NAME} LIMIT {SAMPLE_ROWS}")
+    columns = "\n".join(f"- {_ident(name)}: {dtype}" for name, dtype in meta["columns"].items())
+    partitions = ""
+    if meta["partition_by"]:
+        partitions = (f"The data is partitioned on disk by {', '.join(meta['partition_by'])}: filtering on "
+                      f"these columns skips whole files, so add such filters whenever the question allows.\n")
+    system = (
+        "You are working with a large tabular dataset that does not fit in memory. Answer questions about it "
+        f"by querying the table `{TABLE_NAME}` with the duckdb_query tool (DuckDB SQL). "
+        "Never select all rows: compute aggregates, rankings and filters in SQL and select only the columns "
+        f"you need. Quote column names with double quotes.\n\n"
+        f"Rows: {meta['rows']}\nColumns:\n{columns}\n{partitions}\n"
+        f"First rows:\n{sample}"
+    )
+    return ChatPromptTemplate.from_messages([
+        SystemMessage(content=system),
+        HumanMessagePromptTemplate.from_template("{input}"),
+        MessagesPlaceholder(variable_name="agent_scratchpad"),
+    ])
+
+
+def build_large_agent(dataset_id: str):
+    from langchain.agents import AgentExecutor, create_openai_functions_agent
+    from langchain.agents.agent import RunnableAgent
+
+    with timed("large_agent"):
+        tools = [DuckDBQueryTool(dataset_id=dataset_id)]
+        # Built like create_sql_agent's OPENAI_FUNCTIONS agent, so .run / streaming behave the same
+        agent = RunnableAgent(
+            runnable=create_openai_functions_agent(get_llm(), tools, build_prompt(dataset_id)),
+            input_keys_arg=["input"],
+            return_keys_arg=["output"],
+        )
+        return AgentExecutor(agent=agent, tools=tools, verbose=True)
+
+
+_agents: "OrderedDict[str, Any]" = OrderedDict()
+_agents_lock = threading.Lock()
+_agent_builds = KeyedLocks()
+
+
+def _cached_agent(dataset_id: str):
+    with _agents_lock:
+        agent = _agents.get(dataset_id)
+        if agent is not None:
+            _agents.move_to_end(dataset_id)
+        return agent
+
+
+def get_agent(dataset_id: str):
+    """Agent over a large dataset, built on first use (a few are kept, LRU)."""
+    agent = _cached_agent(dataset_id)
+    if agent is not None:
+        return agent
+    # Only requests for this same dataset wait on the build
+    with _agent_builds.hold(dataset_id):
+        agent = _cached_agent(dataset_id)
+        if agent is None:
+            agent = build_large_agent(dataset_id)
+            with _agents_lock:
+                _agents[dataset_id] = agent
+                while len(_agents) > LARGE_AGENT_CACHE_ENTRIES:
+                    _agents.popitem(last=False)
+        return agent
@@ -0,0 +1,139 @@
+import os
+import re
+import math
+import pickle
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from app.config import RAG_RETRIEVAL_MODE, RAG_TOP_K, RAG_FETCH_K
+
+# === Constants ===
+BM25_K1 = 1.5
+BM25_B = 0.75
+RRF_K = 60  # reciprocal rank fusion damping: score = sum(1 / (RRF_K + rank))
+BM25_FILE = "bm25.pkl"
+RETRIEVAL_MODES = ("hybrid", "vector", "lexical")
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+# Role prefixes added by combine_messages plus the most common English function words
+STOPWORDS = frozenset(
+    "user assistant system a an the and or of to in on for is are was were be by with what which who "
+    "how does do did this that these those it its as at from me my i you your we our".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """'What does Profit (USD) mean?' -> ['profit', 'usd', 'mean']"""
+    return [t for t in _TOKEN.findall(text.lower()) if t not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    Okapi BM25 inverted index over the chunks of one FAISS store. Positions are the
+    FAISS row numbers, so lexical and vector hits refer to the same docstore ids.
+    """
+
+    def __init__(self, texts: List[str]):
+        self.doc_lengths = []
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        for position, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            self.doc_lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self.postings[term].append((position, tf))
+        self.postings = dict(self.postings)
+        n = len(self.doc_lengths)
+        self.avg_length = (sum(self.doc_lengths) / n) if n else 0.0
+        self.idf = {
+            term: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5)) for term, docs in self.postings.items()
+        }
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Top-k (position, score), best first."""
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for position, tf in self.postings[term]:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[position] / (self.avg_length or 1))
+                scores[position] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:k]
+
+    # === Persistence (next to index.faiss / index.pkl) ===
+    def save(self, index_path: str):
+        tmp_path = os.path.join(index_path, f"{BM25_FILE}.tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, os.path.join(index_path, BM25_FILE))
+
+    @staticmethod
+    def load(index_path: str) -> Optional["BM25Index"]:
+        path = os.path.join(index_path, BM25_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+
+def store_texts(vectorstore) -> List[str]:
+    """Chunk texts of a langchain FAISS store in FAISS row order."""
+    docstore = vectorstore.docstore
+    return [docstore.search(vectorstore.index_to_docstore_id[i]).page_content for i in range(len(vectorstore.index_to_docstore_id))]
+
+
+def load_or_build_bm25(vectorstore, index_path: str) -> BM25Index:
+    """The BM25 index saved with the store; built (and saved) from the docstore for stores that predate it."""
+    bm25 = BM25Index.load(index_path)
+    if bm25 is None or len(bm25.doc_lengths) != len(vectorstore.index_to_docstore_id):
+        bm25 = BM25Index(store_texts(vectorstore))
+        bm25.save(index_path)
+        print(f"🔤 Built BM25 index for: {index_path}")
+    return bm25
+
+
+def reciprocal_rank_fusion(*rankings: List[int], k: int = RRF_K) -> List[Tuple[int, float]]:
+    scores: Dict[int, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, position in enumerate(ranking):
+            scores[position] += 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retriever over a FAISS store and its BM25 index.
+
+    hybrid:  vector and BM25 candidates (fetch_k each) fused by reciprocal rank
+    vector:  FAISS similarity only
+    lexical: BM25 only, no query embedding (lowest latency, exact-term recall)
+    """
+    vectorstore: Any = None
+    bm25: Any = None
+    mode: str = RAG_RETRIEVAL_MODE
+    k: int = RAG_TOP_K
+    fetch_k: int = RAG_FETCH_K
+
+    def _document(self, position: int, score: float) -> Document:
+        doc = self.vectorstore.docstore.search(self.vectorstore.index_to_docstore_id[position])
+        return Document(page_content=doc.page_content, metadata={**doc.metadata, "score": score, "retrieval": self.mode})
+
+    def _vector_ranking(self, query: str, k: int) -> List[Tuple[int, float]]:
+        import numpy as np
+
+        vector = np.asarray([self.vectorstore.embedding_function.embed_query(query)], dtype=np.float32)
+        scores, ids = self.vectorstore.index.search(vector, min(k, self.vectorstore.index.ntotal))
+        return [(int(i), float(s)) for i, s in zip(ids[0], scores[0]) if i != -1]
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        if self.mode == "lexical":
+            # No query term in the document at all: fall back to vector search rather than answer blind
+            hits = self.bm25.search(query, self.k) or self._vector_ranking(query, self.k)
+        elif self.mode == "vector":
+            hits = self._vector_ranking(query, self.k)
+        else:
+            lexical = [p for p, _ in self.bm25.search(query, self.fetch_k)]
+            vector = [p for p, _ in self._vector_ranking(query, self.fetch_k)]
+            hits = reciprocal_rank_fusion(vector, lexical)[:self.k]
+        return [self._document(position, score) for position, score in hits]
@@ -1,46 +1,234 @@
+import hashlib
+import threading
 import pandas as pd
-from langchain_experimental.agents import create_pandas_dataframe_agent
-from langchain.agents import AgentType
-from langchain_openai import ChatOpenAI
+from typing import Optional
+from fastapi.concurrency import run_in_threadpool
+from app.components import get_llm, timed
+from app.config import (
+    DATASET_CACHE_MAX_BYTES, DATASET_SPILL_DIR, DATASET_WRITE_THROUGH, DATASET_SPILL_MAX_BYTES, PANDAS_EXECUTION_MODE,
+    DATAFRAME_OPTIMIZE_DTYPES,
+)
+from app.df_loader import optimize_dtypes, align_categories, format_memory_report
+from app.dataset_registry import DatasetRegistry, DatasetEntry
+from app.session_pool import sessions, DEFAULT_SESSION_ID
+from app.streaming import stream_agent_events
+from app.tracing import agent_run, callbacks
+from app.intent_router import answer_from_frame, latest_question
+from app.rollups import build_frame_rollups, merge_frame_rollups, describe_rollups, rollup_plan
 
-# # Load CSV on server start (default)
+# # Load CSV on first use (default)
 DEFAULT_DATA_PATH = "data/retail_transactions_dataset.csv"
-df = pd.read_csv(DEFAULT_DATA_PATH)
-
-# Initialize LLM
-llm = ChatOpenAI(temperature=0, model_name="gpt-4o-mini")
-
-# Create agent
-pandas_agent = create_pandas_dataframe_agent(
-    llm=llm,
-    df=df,
-    verbose=True,
-    agent_type=AgentType.OPENAI_FUNCTIONS,
-    allow_dangerous_code=True
-)
+
+def build_pandas_agent(entry: DatasetEntry):
+    from langchain_experimental.agents import create_pandas_dataframe_agent
+    from langchain_experimental.agents.agent_toolkits.pandas.prompt import FUNCTIONS_WITH_DF
+    from langchain.agents import AgentType
+
+    rollups = ensure_rollups(entry)
+    measures, _ = rollup_plan(list(entry.df.columns), list(entry.df.select_dtypes("number").columns))
+    hint = describe_rollups([f'rollups["{name}"]' for name in rollups], measures)
+    if PANDAS_EXECUTION_MODE == "process":
+        from app.code_executor import publish, PROCESS_MODE_HINT
+
+        publish(entry.key, entry.df, rollups)
+        hint = "\n".join(filter(None, [hint, PROCESS_MODE_HINT]))
+    with timed("pandas_agent"):
+        agent = create_pandas_dataframe_agent(
+            llm=get_llm(),
+            df=entry.df,
+            verbose=True,
+            agent_type=AgentType.OPENAI_FUNCTIONS,
+            allow_dangerous_code=True,
+            # `suffix` is a format string (df_head), so literal braces must be escaped
+            suffix=FUNCTIONS_WITH_DF + ("\n" + hint.replace("{", "{{").replace("}", "}}") if hint else ""),
+        )
+    if PANDAS_EXECUTION_MODE == "process":
+        from app.code_executor import PooledPythonTool
+
+        # Same tool name and arguments as the function schema the LLM was bound with
+        agent.tools = [PooledPythonTool(dataset_key=entry.key)]
+    else:
+        # The python tool's namespace: `df` plus the precomputed rollup frames
+        agent.tools[0].locals["rollups"] = rollups
+    return agent
+
+def release_dataset(entry: DatasetEntry):
+    """Registry eviction hook: drop the entry's shared-memory copy used by the execution pool."""
+    if PANDAS_EXECUTION_MODE == "process":
+        from app.code_executor import unpublish
+
+        unpublish(entry.key)
+
+def ensure_rollups(entry: DatasetEntry):
+    """Pre-aggregations of the entry's DataFrame, computed once per loaded dataset."""
+    if entry.rollups is None:
+        with timed("rollups"):
+            entry.rollups = build_frame_rollups(entry.df)
+    return entry.rollups
+
+def pinned_datasets():
+    """Datasets whose spill files must stay: the default one and any a live session points at."""
+    return sessions.referenced("dataset_id") | ({_default_dataset_id} if _default_dataset_id else set())
+
+# Loaded datasets and their agents, keyed by content hash and shared by all sessions
+registry = DatasetRegistry(build_pandas_agent, max_bytes=DATASET_CACHE_MAX_BYTES, spill_dir=DATASET_SPILL_DIR,
+                           on_evict=release_dataset, write_through=DATASET_WRITE_THROUGH,
+                           spill_max_bytes=DATASET_SPILL_MAX_BYTES, pinned=pinned_datasets)
+
+_default_dataset_id = None
+_default_lock = threading.Lock()
+
+def get_default_dataset_id() -> str:
+    """Load the default CSV into the registry the first time any session needs it."""
+    global _default_dataset_id
+    if _default_dataset_id is None:
+        with _default_lock:
+            if _default_dataset_id is None:
+                with timed("dataset:default"):
+                    df, _ = prepare_dataframe(pd.read_csv(DEFAULT_DATA_PATH))
+                    entry = registry.put(df)
+                    ensure_rollups(entry)
+                    _default_dataset_id = entry.key
+    return _default_dataset_id
+
+def prepare_dataframe(df: pd.DataFrame):
+    """Load-time dtype optimization (categoricals, downcasts, parsed dates); returns (df, memory report)."""
+    if not DATAFRAME_OPTIMIZE_DTYPES:
+        return df, None
+    df, report = optimize_dtypes(df)
+    print(f"🗜️ DataFrame memory: {format_memory_report(report)}")
+    return df, report
+
+def get_dataset(session_id: str = DEFAULT_SESSION_ID) -> DatasetEntry:
+    """The DataFrame the given session is currently working on."""
+    state = sessions.get(session_id)
+    entry = registry.get(state.dataset_id or get_default_dataset_id())
+    if entry is None:
+        # Dataset vanished from memory and spill cache; fall back to the default one
+        state.dataset_id = None
+        entry = registry.get(get_default_dataset_id())
+    return entry
+
+def get_large_dataset_id(session_id: str = DEFAULT_SESSION_ID) -> Optional[str]:
+    """The session's dataset id if it is stored out-of-core (partitioned Parquet), else None."""
+    from app import large_dataset
+
+    dataset_id = sessions.get(session_id).dataset_id
+    return dataset_id if large_dataset.exists(dataset_id) else None
+
+def get_agent(session_id: str = DEFAULT_SESSION_ID):
+    large_id = get_large_dataset_id(session_id)
+    if large_id is not None:
+        from app import large_dataset
+
+        return large_dataset.get_agent(large_id)
+    return registry.get_agent(get_dataset(session_id))
+
+def get_data_fingerprint(session_id: str = DEFAULT_SESSION_ID) -> str:
+    """Content hash of the session's active dataset (without loading it)."""
+    return sessions.get(session_id).dataset_id or get_default_dataset_id()
 
 # Agent Query Handler
-def query_data_analytics(question: str):
+def fast_answer(question, session_id: str = DEFAULT_SESSION_ID) -> Optional[str]:
+    """Answer template-shaped aggregate questions with a direct groupby (None: needs the agent)."""
+    if get_large_dataset_id(session_id) is not None:
+        return None  # out-of-core data is only read through the agent's queries
+    entry = get_dataset(session_id)
+    return answer_from_frame(latest_question(question), entry.key, entry.df, ensure_rollups(entry))
+
+def query_data_analytics(question: str, session_id: str = DEFAULT_SESSION_ID, use_fast_path: bool = True):
     print("\n[User Query]:", question)
-    response = pandas_agent.run(question)
+    response = fast_answer(question, session_id) if use_fast_path else None
+    if response is None:
+        agent = get_agent(session_id)
+        with agent_run():
+            response = agent.run(question, callbacks=callbacks())
     print("[Agent Response]:", response)
     return response
 
+async def aquery_data_analytics(question: str, session_id: str = DEFAULT_SESSION_ID, use_fast_path: bool = True):
+    print("\n[User Query]:", question)
+    # Dataset loads and agent builds block: keep them off the event loop
+    response = await run_in_threadpool(fast_answer, question, session_id) if use_fast_path else None
+    if response is None:
+        agent = await run_in_threadpool(get_agent, session_id)
+        with agent_run():
+            response = await agent.arun(question, callbacks=callbacks())
+    print("[Agent Response]:", response)
+    return response
+
+async def astream_data_analytics(question, session_id: str = DEFAULT_SESSION_ID, use_fast_path: bool = True):
+    """Yield agent steps and answer tokens as they are produced (see app.streaming)."""
+    print("\n[User Query]:", question)
+    response = await run_in_threadpool(fast_answer, question, session_id) if use_fast_path else None
+    if response is not None:
+        yield {"type": "final", "response": response}
+        return
+    agent = await run_in_threadpool(get_agent, session_id)
+    async for event in stream_agent_events(agent, {"input": question}):
+        yield event
+
 # Allow dynamic replacement of the dataframe
-def update_dataframe(new_df: pd.DataFrame):
-    global df, pandas_agent
-    df = new_df
-    pandas_agent = create_pandas_dataframe_agent(
-        llm=llm,
-        df=df,
-        verbose=True,
-        agent_type=AgentType.OPENAI_FUNCTIONS,
-        allow_dangerous_code=True
-    )
+def update_dataframe(new_df: pd.DataFrame, dataset_id: Optional[str] = None, session_id: str = DEFAULT_SESSION_ID) -> str:
+    """Register `new_df` (reusing a cached agent when its content is known) and make it the session's active data."""
+    entry = registry.put(new_df, dataset_id)
+    ensure_rollups(entry)
+    sessions.get(session_id).dataset_id = entry.key
+    return entry.key
+
+def append_dataframe(new_rows: pd.DataFrame, session_id: str = DEFAULT_SESSION_ID) -> str:
+    """Append rows to the session's dataset; its rollups are updated from the new rows only."""
+    current = get_dataset(session_id)
+    # Categoricals stay categorical only if both sides share the categories
+    base, new_rows = align_categories(current.df, new_rows)
+    combined = pd.concat([base, new_rows], ignore_index=True)
+    current_rollups, delta = ensure_rollups(current), build_frame_rollups(new_rows)
+    # Different columns in the new rows mean different rollups: rebuild them from the combined frame
+    rollups = merge_frame_rollups(current_rollups, delta) if delta.keys() == current_rollups.keys() else None
+    entry = registry.put(combined, rollups=rollups)
+    ensure_rollups(entry)
+    sessions.get(session_id).dataset_id = entry.key
+    return entry.key
+
+def update_large_dataset(path: str, fmt: str, dataset_id: str, session_id: str = DEFAULT_SESSION_ID,
+                         append: bool = False):
+    """Store an uploaded file out-of-core and make it the session's active data; returns its metadata."""
+    from app import large_dataset
+
+    base_id = None
+    if append:
+        base_id = get_large_dataset_id(session_id)
+        if base_id is None:
+            raise ValueError("Rows can only be appended out-of-core to a large dataset; use storage=memory")
+        # The combined content is identified by both parts
+        dataset_id = hashlib.sha256(f"{base_id}:{dataset_id}".encode()).hexdigest()
+    meta = large_dataset.ingest(path, fmt, dataset_id, base_id)
+    sessions.get(session_id).dataset_id = dataset_id
+    return meta
+
+def activate_dataset(dataset_id: str, session_id: str = DEFAULT_SESSION_ID) -> bool:
+    """Switch the session back to a previously loaded dataset. Returns False if it is unknown."""
+    from app import large_dataset
+
+    if large_dataset.exists(dataset_id):
+        sessions.get(session_id).dataset_id = dataset_id
+        return True
+    if registry.get(dataset_id) is None:
+        return False
+    sessions.get(session_id).dataset_id = dataset_id
+    return True
+
+def warmup():
+    """Load the default dataset and build its agent ahead of the first question."""
+    registry.get_agent(registry.get(get_default_dataset_id()))
+    if PANDAS_EXECUTION_MODE == "process":
+        from app.code_executor import pool
+
+        pool.start()
 
 # def main():
 #     # Your code goes here
 #     print("Hello from the main function!")
 #
 # if __name__ == "__main__":
-#     main()
\ No newline at end of file
+#     main()
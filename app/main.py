@@ -1,16 +1,34 @@
 import pandas as pd
-from fastapi import FastAPI, Body, Depends
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Body, Depends, Request, Query, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
+import io
 import time
 import os
-from app.config import SECRET_ID, SECRET_KEY, TOKEN_STORE, generate_bearer_token
+from app.config import SECRET_ID, SECRET_KEY, TOKEN_STORE, AGENT_MAX_CONCURRENCY, AGENT_MAX_QUEUE, PANDAS_EXECUTION_MODE, LARGE_DATASET_MIN_BYTES, generate_bearer_token
 from app.auth import verify_token
 # from app.auth import router as auth_router
-from app.llm_agent import query_data_analytics, update_dataframe
-from app.rag_agent import query_rag, update_rag_doc_context
-from app.sql_agent import query_sql_data, update_sql_database
+from app.answer_cache import answer_cache
+from app.concurrency import AgentLimiter
+from app.session_pool import sessions, get_session_id
+from app.streaming import sse_event
+from app.df_loader import detect_format, spool_upload, read_dataframe
+from app.dataset_registry import is_dataset_id
+from app.components import timed, startup_report
+from app.intent_router import router_stats
+from app.history import compact
+import app.tracing as tracing
+with timed("import:app.llm_agent"):
+    import app.llm_agent as llm_agent
+    from app.llm_agent import aquery_data_analytics, astream_data_analytics, get_data_fingerprint, update_dataframe, append_dataframe, activate_dataset, prepare_dataframe, update_large_dataset, get_large_dataset_id, registry as dataset_registry
+with timed("import:app.rag_agent"):
+    import app.rag_agent as rag_agent
+    from app.rag_agent import aquery_rag, astream_rag, get_context_fingerprint, update_rag_doc_context, activate_context
+with timed("import:app.sql_agent"):
+    import app.sql_agent as sql_agent
+    from app.sql_agent import aquery_sql_data, astream_sql_data, update_sql_database, get_db_uri, db_file_fingerprint, db_path_from_uri, is_registered_db
 import logging
 
 logger = logging.getLogger("uvicorn.error")
@@ -18,6 +36,35 @@ logger = logging.getLogger("uvicorn.error")
 app = FastAPI()
 # app.include_router(auth_router)
 
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Per-request trace (stage timings for /metrics; returned in the answer with ?timings=true or X-Timings: 1)."""
+    requested = request.query_params.get("timings", "").lower() in ("1", "true") or request.headers.get("X-Timings") == "1"
+    tracing.start_trace(request.url.path, requested)
+    start = time.perf_counter()
+    response = await call_next(request)
+    # Route templates (e.g. /corpus/documents/{doc_id}) keep the label set bounded
+    route = request.scope.get("route")
+    path = getattr(route, "path", "unmatched")
+    body = response.body_iterator
+
+    async def timed_body():
+        # call_next returns once the headers are ready; SSE answers are only done when the body is
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            tracing.REQUEST_SECONDS.labels(path, str(response.status_code)).observe(time.perf_counter() - start)
+
+    response.body_iterator = timed_body()
+    return response
+
+# Bounded concurrency + wait queue per agent type
+limiters = {
+    name: AgentLimiter(name, AGENT_MAX_CONCURRENCY[name], AGENT_MAX_QUEUE[name])
+    for name in AGENT_MAX_CONCURRENCY
+}
+
 # === Data Models ===
 class ChatMessage(BaseModel):
     role: str
@@ -28,6 +75,10 @@ class ChatRequest(BaseModel):
 
 class DataFrameUpdateRequest(BaseModel):
     data: str
+    append: bool = False  # add the rows to the session's current dataset instead of replacing it
+
+class DatasetActivateRequest(BaseModel):
+    dataset_id: str
 
 class ContextQuery(BaseModel):
     question: str
@@ -35,63 +86,520 @@ class ContextQuery(BaseModel):
 class ContextData(BaseModel):
     text: str
 
+class ContextActivateRequest(BaseModel):
+    context_hash: str  # md5 of the context text, as returned by /update-context
+
+class CorpusDocument(BaseModel):
+    name: str
+    text: str
+    dataset: Optional[str] = None  # used as a retrieval filter
+    metadata: dict = {}
+
+class CorpusQueryRequest(BaseModel):
+    messages: List[ChatMessage]
+    dataset: Optional[str] = None
+    name: Optional[str] = None
+    doc_id: Optional[str] = None
+    k: Optional[int] = None
+
 class SQLQueryRequest(BaseModel):
     messages: List[ChatMessage]
 
 class SQLUpdateRequest(BaseModel):
     db_uri: str  # Format: "sqlite:///path/to/your.db"
 
+class IndexAdvisorRequest(BaseModel):
+    db_uri: Optional[str] = None  # defaults to the session's current DB
+    top_n: int = 3
+
 class AuthRequest(BaseModel):
     secret_id: str
     secret_key: str
 
+class WarmupRequest(BaseModel):
+    components: List[str] = ["chat", "sql", "context"]
+
 @app.post("/auth/token")
 def auth_token(payload: AuthRequest):
     if payload.secret_id != SECRET_ID or payload.secret_key != SECRET_KEY:
         return JSONResponse(status_code=401, content={"detail": "Invalid credentials"})
 
-    current_time = time.time()
+    # Reuses this worker's token while it is valid; tokens from any worker verify everywhere
+    token = generate_bearer_token()
+    return {"access_token": token, "expires_in": int(TOKEN_STORE["expires_at"] - time.time())}
+
+# === Answer Cache ===
+async def cached_answer(kind: str, source: str, fingerprint: str, messages, run, fast=None, usage=None):
+    """
+    Serve an answer from the persistent cache when the same (normalized) conversation
+    was already answered on the same data; otherwise try the deterministic fast path
+    (`fast`, returns None when the question needs the agent) and then run the agent
+    under its limiter. `usage` (prompt token counts) is reported when the agent runs.
+    """
+    tracing.set_kind(kind)
+    with tracing.stage("cache_lookup"):
+        key = answer_cache.make_key(kind, fingerprint, messages) if fingerprint is not None else None
+        answer = await run_in_threadpool(answer_cache.get, key) if key else None
+    if answer is not None:
+        return with_timings(kind, "cache", {"response": answer, "cached": True, "fast_path": False, "usage": None})
 
-    # If existing token is still valid
-    if TOKEN_STORE["token"] and TOKEN_STORE["expires_at"] > current_time:
-        remaining = int(TOKEN_STORE["expires_at"] - current_time)
-        return {"access_token": TOKEN_STORE["token"], "expires_in": remaining}
+    answer = await fast_answer(kind, fast)
+    if answer is not None:
+        # Cheap to recompute, so fast-path answers are not cached (keeps hit rates measurable)
+        return with_timings(kind, "fast_path", {"response": answer, "cached": False, "fast_path": True, "usage": None})
 
-    # Generate new token
-    token = generate_bearer_token()
-    return {"access_token": token, "expires_in": 360}
+    queued = time.perf_counter()
+    async with limiters[kind].slot():
+        tracing.observe_stage("queue", time.perf_counter() - queued)
+        start = time.perf_counter()
+        answer = await run()
+        router_stats.record(kind, False, time.perf_counter() - start)
+    if key:
+        await run_in_threadpool(answer_cache.set, key, kind, source, fingerprint, answer)
+    return with_timings(kind, "agent", {"response": answer, "cached": False, "fast_path": False, "usage": usage})
+
+def with_timings(kind: str, produced_by: str, payload: dict) -> dict:
+    """Count the answer and attach the request's stage breakdown if it asked for one (?timings=true)."""
+    tracing.count_answer(kind, produced_by)
+    trace = tracing.current_trace()
+    if trace is not None and trace.requested:
+        payload["timings"] = trace.breakdown()
+    return payload
+
+async def fast_answer(kind: str, fast):
+    if fast is None:
+        return None
+    start = time.perf_counter()
+    try:
+        answer = await run_in_threadpool(fast)
+    except Exception:
+        logger.exception(f"Fast path for {kind} failed; falling back to the agent")
+        return None
+    finally:
+        tracing.observe_stage("fast_path", time.perf_counter() - start)
+    if answer is not None:
+        router_stats.record(kind, True, time.perf_counter() - start)
+    return answer
+
+async def streamed_answer(kind: str, source: str, fingerprint: str, messages, events, fast=None, usage=None) -> StreamingResponse:
+    """
+    SSE variant of cached_answer: emits step / observation / token events while the
+    agent runs and a final event with the complete answer.
+    """
+    tracing.set_kind(kind)
+    with tracing.stage("cache_lookup"):
+        key = answer_cache.make_key(kind, fingerprint, messages) if fingerprint is not None else None
+        cached = await run_in_threadpool(answer_cache.get, key) if key else None
+    fast_path = await fast_answer(kind, fast) if cached is None else None
+    if cached is None and fast_path is None:
+        # Reject with a real 429 before the stream starts
+        limiters[kind].ensure_capacity()
+
+    async def body():
+        if cached is not None:
+            yield sse_event("final", with_timings(kind, "cache", {"response": cached, "cached": True, "fast_path": False, "usage": None}))
+            return
+        if fast_path is not None:
+            yield sse_event("final", with_timings(kind, "fast_path", {"response": fast_path, "cached": False, "fast_path": True, "usage": None}))
+            return
+        try:
+            queued = time.perf_counter()
+            async with limiters[kind].slot():
+                tracing.observe_stage("queue", time.perf_counter() - queued)
+                start = time.perf_counter()
+                async for event in events():
+                    event_type = event.pop("type")
+                    if event_type == "final":
+                        router_stats.record(kind, False, time.perf_counter() - start)
+                        event.update(cached=False, fast_path=False, usage=usage)
+                        with_timings(kind, "agent", event)
+                        if key:
+                            await run_in_threadpool(answer_cache.set, key, kind, source, fingerprint, event["response"])
+                    yield sse_event(event_type, event)
+        except Exception as e:
+            logger.exception(f"Streaming {kind} request failed")
+            yield sse_event("error", {"detail": str(e)})
+
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 # === LLM Chat Endpoints ===
 @app.post("/chat", dependencies=[Depends(verify_token)])
-def chat(payload: ChatRequest):
+async def chat(payload: ChatRequest, session_id: str = Depends(get_session_id)):
+    messages = payload.messages
+    # The first call loads the default CSV
+    dataset_id = await run_in_threadpool(get_data_fingerprint, session_id)
+    conversation = compact(messages)
+    return await cached_answer(
+        "chat", dataset_id, dataset_id, conversation.messages,
+        lambda: aquery_data_analytics(conversation.text, session_id, use_fast_path=False),
+        fast=lambda: llm_agent.fast_answer(messages, session_id),
+        usage=conversation.usage(),
+    )
+
+@app.post("/chat/stream", dependencies=[Depends(verify_token)])
+async def chat_stream(payload: ChatRequest, session_id: str = Depends(get_session_id)):
     messages = payload.messages
-    return {"response": query_data_analytics(messages)}
+    # The first call loads the default CSV
+    dataset_id = await run_in_threadpool(get_data_fingerprint, session_id)
+    conversation = compact(messages)
+    return await streamed_answer(
+        "chat", dataset_id, dataset_id, conversation.messages,
+        lambda: astream_data_analytics(conversation.text, session_id, use_fast_path=False),
+        fast=lambda: llm_agent.fast_answer(messages, session_id),
+        usage=conversation.usage(),
+    )
 
 @app.post("/update-df", dependencies=[Depends(verify_token)])
-def update_df(request: DataFrameUpdateRequest):
-    df = pd.read_json(request.data, orient="split")
-    update_dataframe(df)
-    return {"status": "Dataframe data updated successfully."}
+def update_df(request: DataFrameUpdateRequest, session_id: str = Depends(get_session_id)):
+    # Literal JSON must be wrapped: newer pandas treats a plain string as a path.
+    # Dates stay strings here (read_json would guess month-first); prepare_dataframe parses them
+    df = pd.read_json(io.StringIO(request.data), orient="split", convert_dates=False, keep_default_dates=False)
+    if request.append and get_large_dataset_id(session_id) is not None:
+        raise HTTPException(status_code=400, detail="Append rows to an out-of-core dataset with /update-df-stream")
+    df, memory = prepare_dataframe(df)
+    if request.append:
+        dataset_id = append_dataframe(df, session_id)
+    else:
+        dataset_id = update_dataframe(df, session_id=session_id)
+    return {"status": "Dataframe data updated successfully.", "dataset_id": dataset_id, "memory": memory}
+
+@app.post("/update-df-stream", dependencies=[Depends(verify_token)])
+async def update_df_stream(
+    request: Request,
+    fmt: str = Query(None, alias="format"),
+    filename: str = Query(None),
+    append: bool = Query(False),
+    storage: str = Query("auto", description="memory | large (partitioned Parquet + DuckDB) | auto (large above LARGE_DATASET_MIN_BYTES)"),
+    session_id: str = Depends(get_session_id),
+):
+    """
+    Binary upload path: the raw CSV/Excel/Parquet/Arrow IPC bytes are streamed
+    in the request body and spooled to disk, then the frame is built batch by batch
+    (or, out-of-core, written as partitioned Parquet that the agent queries with DuckDB).
+    """
+    if storage not in ("auto", "memory", "large"):
+        raise HTTPException(status_code=400, detail=f"Unknown storage: {storage}. Expected auto, memory or large.")
+    try:
+        fmt = detect_format(fmt, filename)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    tmp_path, size, content_hash = await spool_upload(request.stream())
+    try:
+        # Same bytes as a dataset we already hold: switch to it without parsing
+        if not append and await run_in_threadpool(activate_dataset, content_hash, session_id):
+            return {"status": "Dataframe data updated successfully.", "dataset_id": content_hash, "cached": True}
+        # Appends follow the storage of the dataset they extend
+        if append:
+            large = get_large_dataset_id(session_id) is not None or storage == "large"
+        else:
+            large = storage == "large" or (storage == "auto" and size >= LARGE_DATASET_MIN_BYTES)
+        if large:
+            try:
+                meta = await run_in_threadpool(update_large_dataset, tmp_path, fmt, content_hash, session_id, append)
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=f"Could not store {fmt} upload out-of-core: {e}")
+            logger.info(f"Stored {fmt} upload ({size} bytes) out-of-core: {meta['rows']} rows in {meta['files']} files")
+            return {
+                "status": "Dataframe data updated successfully.",
+                "dataset_id": meta["dataset_id"],
+                "cached": False,
+                "storage": "large",
+                "rows": meta["rows"],
+                "columns": len(meta["columns"]),
+                "bytes_on_disk": meta["bytes"],
+            }
+        try:
+            df = await run_in_threadpool(read_dataframe, tmp_path, fmt)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Could not parse {fmt} upload: {e}")
+        df, memory = await run_in_threadpool(prepare_dataframe, df)
+    finally:
+        os.remove(tmp_path)
+
+    if append:
+        dataset_id = await run_in_threadpool(append_dataframe, df, session_id)
+    else:
+        dataset_id = await run_in_threadpool(update_dataframe, df, content_hash, session_id)
+    logger.info(f"Loaded {fmt} upload ({size} bytes) into DataFrame with shape {df.shape}")
+    return {
+        "status": "Dataframe data updated successfully.",
+        "dataset_id": dataset_id,
+        "cached": False,
+        "storage": "memory",
+        "rows": len(df),
+        "columns": len(df.columns),
+        "memory": memory,
+    }
+
+@app.get("/datasets", dependencies=[Depends(verify_token)])
+def list_datasets():
+    from app.large_dataset import list_datasets as list_large_datasets
+
+    return {"datasets": dataset_registry.list() + list_large_datasets()}
+
+@app.post("/activate-df", dependencies=[Depends(verify_token)])
+def activate_df(request: DatasetActivateRequest, session_id: str = Depends(get_session_id)):
+    if not is_dataset_id(request.dataset_id):
+        raise HTTPException(status_code=400, detail="dataset_id must be a sha256 hex digest")
+    if not activate_dataset(request.dataset_id, session_id):
+        raise HTTPException(status_code=404, detail=f"Unknown dataset: {request.dataset_id}")
+    return {"status": "Dataframe data updated successfully.", "dataset_id": request.dataset_id}
 
 # === RAG Endpoints ===
+def retrieval_mode(mode: Optional[str] = Query(None, description="hybrid | vector | lexical (default: RAG_RETRIEVAL_MODE)")):
+    from app.lexical_index import RETRIEVAL_MODES
+
+    if mode is not None and mode not in RETRIEVAL_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(RETRIEVAL_MODES)}")
+    return mode
+
+def context_fingerprint(session_id: str, mode: Optional[str]):
+    context_hash = get_context_fingerprint(session_id)
+    # Retrieval mode changes which chunks the answer is based on
+    return f"{context_hash}:{mode}" if context_hash and mode else context_hash
+
 @app.post("/context", dependencies=[Depends(verify_token)])
-def context_chat(payload: ChatRequest):
+async def context_chat(payload: ChatRequest, session_id: str = Depends(get_session_id), mode: Optional[str] = Depends(retrieval_mode)):
     messages = payload.messages
     formatted_messages = [{"role": msg.role, "content": msg.content} for msg in messages]
-    return {"response": query_rag(formatted_messages)}
+    context_hash = get_context_fingerprint(session_id)
+    conversation = compact(formatted_messages)
+    return await cached_answer(
+        "context", context_hash, context_fingerprint(session_id, mode), conversation.messages,
+        lambda: aquery_rag(conversation.messages, session_id, mode),
+        usage=conversation.usage(),
+    )
+
+@app.post("/context/stream", dependencies=[Depends(verify_token)])
+async def context_chat_stream(payload: ChatRequest, session_id: str = Depends(get_session_id), mode: Optional[str] = Depends(retrieval_mode)):
+    formatted_messages = [{"role": msg.role, "content": msg.content} for msg in payload.messages]
+    context_hash = get_context_fingerprint(session_id)
+    conversation = compact(formatted_messages)
+    return await streamed_answer(
+        "context", context_hash, context_fingerprint(session_id, mode), conversation.messages,
+        lambda: astream_rag(conversation.messages, session_id, mode),
+        usage=conversation.usage(),
+    )
 
 @app.post("/update-context", dependencies=[Depends(verify_token)])
-def update_context_data(data: ContextData):
-    update_rag_doc_context(data.text)
-    return {"message": "Context data updated successfully."}
+def update_context_data(data: ContextData, session_id: str = Depends(get_session_id)):
+    # Re-sending the active text only costs a hash check
+    changed = update_rag_doc_context(data.text, session_id)
+    return {
+        "message": "Context data updated successfully.",
+        "unchanged": not changed,
+        "context_hash": get_context_fingerprint(session_id),
+    }
+
+@app.post("/activate-context", dependencies=[Depends(verify_token)])
+def activate_context_data(request: ContextActivateRequest, session_id: str = Depends(get_session_id)):
+    # Clients send the hash first and post the full text only on a 404
+    if not activate_context(request.context_hash, session_id):
+        raise HTTPException(status_code=404, detail=f"Unknown context: {request.context_hash}")
+    return {"message": "Context data updated successfully.", "context_hash": request.context_hash}
+
+# === RAG Corpus Endpoints ===
+def corpus_request(payload: CorpusQueryRequest):
+    from app.rag_corpus import corpus, CORPUS_TOP_K
+
+    filters = {"dataset": payload.dataset, "name": payload.name, "doc_id": payload.doc_id}
+    k = payload.k or CORPUS_TOP_K
+    # Same question over the same documents with the same filters -> same answer
+    fingerprint = f"corpus:{corpus.fingerprint()}:{sorted(filters.items())}:{k}"
+    return filters, k, fingerprint
+
+@app.post("/corpus/documents", dependencies=[Depends(verify_token)])
+def corpus_add_document(doc: CorpusDocument):
+    from app.rag_corpus import corpus
+
+    return corpus.add_document(doc.name, doc.text, dataset=doc.dataset, metadata=doc.metadata)
+
+@app.get("/corpus/documents", dependencies=[Depends(verify_token)])
+def corpus_list_documents(dataset: Optional[str] = Query(None)):
+    from app.rag_corpus import corpus
+
+    return {"documents": corpus.list_documents(dataset)}
+
+@app.delete("/corpus/documents/{doc_id}", dependencies=[Depends(verify_token)])
+def corpus_remove_document(doc_id: str):
+    from app.rag_corpus import corpus
+
+    if not corpus.remove_document(doc_id):
+        raise HTTPException(status_code=404, detail=f"Unknown document '{doc_id}'")
+    return {"message": "Document removed.", "doc_id": doc_id}
+
+@app.get("/corpus/stats", dependencies=[Depends(verify_token)])
+def corpus_stats():
+    from app.rag_corpus import corpus
+
+    return corpus.stats()
+
+@app.post("/corpus/query", dependencies=[Depends(verify_token)])
+async def corpus_query(payload: CorpusQueryRequest):
+    from app.rag_corpus import aquery_corpus
+
+    formatted_messages = [{"role": msg.role, "content": msg.content} for msg in payload.messages]
+    filters, k, fingerprint = await run_in_threadpool(corpus_request, payload)
+    conversation = compact(formatted_messages)
+    return await cached_answer(
+        "context", "corpus", fingerprint, conversation.messages,
+        lambda: aquery_corpus(conversation.messages, filters, k),
+        usage=conversation.usage(),
+    )
+
+@app.post("/corpus/query/stream", dependencies=[Depends(verify_token)])
+async def corpus_query_stream(payload: CorpusQueryRequest):
+    from app.rag_corpus import astream_corpus
+
+    formatted_messages = [{"role": msg.role, "content": msg.content} for msg in payload.messages]
+    filters, k, fingerprint = await run_in_threadpool(corpus_request, payload)
+    conversation = compact(formatted_messages)
+    return await streamed_answer(
+        "context", "corpus", fingerprint, conversation.messages,
+        lambda: astream_corpus(conversation.messages, filters, k),
+        usage=conversation.usage(),
+    )
 
 # === SQL Agent Endpoints ===
 @app.post("/sql", dependencies=[Depends(verify_token)])
-def sql_chat(payload: SQLQueryRequest):
+async def sql_chat(payload: SQLQueryRequest, session_id: str = Depends(get_session_id)):
     messages = payload.messages
-    return {"response": query_sql_data(messages)}
+    db_uri = get_db_uri(session_id)
+    fingerprint = await run_in_threadpool(db_file_fingerprint, db_uri)
+    conversation = compact(messages)
+    return await cached_answer(
+        "sql", db_uri, fingerprint, conversation.messages,
+        lambda: aquery_sql_data(conversation.text, session_id, use_fast_path=False),
+        fast=lambda: sql_agent.fast_answer(messages, session_id),
+        usage=conversation.usage(),
+    )
+
+@app.post("/sql/stream", dependencies=[Depends(verify_token)])
+async def sql_chat_stream(payload: SQLQueryRequest, session_id: str = Depends(get_session_id)):
+    messages = payload.messages
+    db_uri = get_db_uri(session_id)
+    fingerprint = await run_in_threadpool(db_file_fingerprint, db_uri)
+    conversation = compact(messages)
+    return await streamed_answer(
+        "sql", db_uri, fingerprint, conversation.messages,
+        lambda: astream_sql_data(conversation.text, session_id, use_fast_path=False),
+        fast=lambda: sql_agent.fast_answer(messages, session_id),
+        usage=conversation.usage(),
+    )
 
 @app.post("/update-sql", dependencies=[Depends(verify_token)])
-def update_sql(request: SQLUpdateRequest):
-    update_sql_database(request.db_uri)
+def update_sql(request: SQLUpdateRequest, session_id: str = Depends(get_session_id)):
+    update_sql_database(request.db_uri, session_id)
+    # The file behind this URI may have been replaced: forget answers computed on older versions
+    answer_cache.invalidate("sql", request.db_uri, keep_fingerprint=db_file_fingerprint(request.db_uri))
     return {"message": f"SQL database updated to: {request.db_uri}"}
+
+@app.get("/agents/status", dependencies=[Depends(verify_token)])
+def agents_status():
+    return {name: limiter.stats() for name, limiter in limiters.items()}
+
+@app.get("/agents/pandas-pool", dependencies=[Depends(verify_token)])
+def pandas_pool_stats():
+    """Worker processes running pandas agent code (PANDAS_EXECUTION_MODE=process) and execution outcomes."""
+    from app.code_executor import pool
+
+    return {"mode": PANDAS_EXECUTION_MODE, **pool.stats()}
+
+@app.get("/router/stats", dependencies=[Depends(verify_token)])
+def fast_path_stats():
+    """How many questions the intent router answered without an agent, and mean latency of each path."""
+    return router_stats.stats()
+
+def registered_db_uri(db_uri: Optional[str], session_id: str) -> str:
+    # The advisor only touches DBs the SQL agent serves, never an arbitrary file path
+    db_uri = db_uri or get_db_uri(session_id)
+    if not is_registered_db(db_uri):
+        raise HTTPException(status_code=404, detail=f"Unknown database: {db_uri}. Switch to it with /update-sql first.")
+    return db_uri
+
+@app.get("/sql/advisor", dependencies=[Depends(verify_token)])
+def sql_index_advice(db_uri: Optional[str] = None, top_n: int = 5, session_id: str = Depends(get_session_id)):
+    """Index recommendations derived from the SQL the agent actually ran against this DB."""
+    from app.index_advisor import recommend_indexes
+
+    db_uri = registered_db_uri(db_uri, session_id)
+    return {"db_uri": db_uri, "recommendations": recommend_indexes(db_path_from_uri(db_uri), top_n=top_n)}
+
+@app.post("/sql/advisor/apply", dependencies=[Depends(verify_token)])
+def apply_sql_index_advice(request: IndexAdvisorRequest, session_id: str = Depends(get_session_id)):
+    """Create the top recommended covering indexes and report before / after query times."""
+    from app.index_advisor import apply_recommendations
+
+    db_uri = registered_db_uri(request.db_uri, session_id)
+    try:
+        applied = apply_recommendations(db_path_from_uri(db_uri), top_n=request.top_n)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"db_uri": db_uri, "applied": applied}
+
+# === Metrics ===
+@app.get("/metrics")
+def metrics():
+    """
+    Prometheus exposition. Intentionally public, like most scrape targets: it carries only
+    aggregate counters and histograms labelled by route template, status, stage and agent type,
+    never request content, session ids or tokens.
+    """
+    from prometheus_client import generate_latest, CONTENT_TYPE_LATEST, CollectorRegistry, multiprocess
+
+    for name, limiter in limiters.items():
+        tracing.AGENT_ACTIVE.labels(name).set(limiter.active)
+        tracing.AGENT_WAITING.labels(name).set(limiter.waiting)
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # uvicorn --workers N: aggregate the metric files every worker writes
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+# === Startup Endpoints ===
+WARMUP_FUNCTIONS = {
+    "chat": llm_agent.warmup,
+    "sql": sql_agent.warmup,
+    "context": rag_agent.warmup,
+}
+
+@app.post("/warmup", dependencies=[Depends(verify_token)])
+def warmup(request: WarmupRequest = Body(WarmupRequest())):
+    """Build LLM clients, default datasets and agents now instead of on the first question."""
+    unknown = [c for c in request.components if c not in WARMUP_FUNCTIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown components: {unknown}")
+    for component in request.components:
+        with timed(f"warmup:{component}"):
+            WARMUP_FUNCTIONS[component]()
+    return startup_report()
+
+@app.get("/startup-report", dependencies=[Depends(verify_token)])
+def get_startup_report():
+    return startup_report()
+
+# === Answer Cache Endpoints ===
+@app.get("/cache/stats", dependencies=[Depends(verify_token)])
+def cache_stats():
+    from app.embedding_cache import embedding_store, query_embedding_cache
+
+    return {**answer_cache.stats(), "embeddings": embedding_store.stats(), "query_embeddings": query_embedding_cache.stats()}
+
+@app.delete("/cache", dependencies=[Depends(verify_token)])
+def clear_cache():
+    return {"deleted": answer_cache.clear()}
+
+# === Session Endpoints ===
+@app.get("/sessions", dependencies=[Depends(verify_token)])
+def sessions_status():
+    return sessions.stats()
+
+@app.delete("/session", dependencies=[Depends(verify_token)])
+def close_session(session_id: str = Depends(get_session_id)):
+    return {"closed": sessions.close(session_id)}
@@ -1,65 +1,191 @@
 import os
+import re
+import pickle
 import hashlib
+import threading
 import pandas as pd
-from typing import List, Dict
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain.chains import RetrievalQA
-from langchain_community.vectorstores import FAISS
-from langchain.text_splitter import CharacterTextSplitter
-from langchain.docstore.document import Document
+from collections import OrderedDict
+from typing import Any, List, Dict, Optional
+from fastapi.concurrency import run_in_threadpool
+from app.components import get_llm, get_embeddings, timed
+from app.concurrency import KeyedLocks
+from app.config import RAG_CHAIN_CACHE_ENTRIES, RAG_INDEX_DIR
+from app.session_pool import sessions, DEFAULT_SESSION_ID
+from app.streaming import stream_agent_events
+from app.tracing import agent_run, callbacks
+from app.history import render
+from app.lexical_index import BM25Index, HybridRetriever, RETRIEVAL_MODES, load_or_build_bm25, store_texts
 
 # Constants
-EMBEDDING_DIR = "data\embeddings"
+EMBEDDING_DIR = RAG_INDEX_DIR
 os.makedirs(EMBEDDING_DIR, exist_ok=True)
 
-# Initialize global components
-llm = ChatOpenAI(temperature=0, model_name="gpt-4o-mini")
-embedding = OpenAIEmbeddings()
-retriever_chain = None
+# Vector stores + retrieval chains keyed by context text hash, shared by all sessions.
+# Recently used ones stay in memory (LRU); evicted ones are reloaded from EMBEDDING_DIR on demand.
+_chains: "OrderedDict[str, Any]" = OrderedDict()
+_chains_lock = threading.Lock()
+_chain_builds = KeyedLocks()
+
+def get_text_hash(text: str) -> str:
+    return hashlib.md5(text.encode()).hexdigest()
 
 def get_embedding_path(text: str) -> str:
     """Create a hash-based path for storing FAISS index based on text content."""
-    text_hash = hashlib.md5(text.encode()).hexdigest()
+    return index_path_for(get_text_hash(text))
+
+def index_path_for(text_hash: str) -> str:
     return os.path.join(EMBEDDING_DIR, f"{text_hash}.faiss")
 
-def create_rag_chain(text: str):
-    global retriever_chain
+def load_vectorstore(index_path: str, embedding):
+    """FAISS.load_local, but with the index file memory-mapped where the index type supports it."""
+    import faiss
+    from langchain_community.vectorstores import FAISS
+
+    index_file = os.path.join(index_path, "index.faiss")
+    try:
+        index = faiss.read_index(index_file, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError:
+        index = faiss.read_index(index_file)
+    with open(os.path.join(index_path, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(embedding, index, docstore, index_to_docstore_id)
+
+def create_rag_chain(text_hash: str, text: Optional[str] = None):
+    from langchain.chains import RetrievalQA
+    from langchain_community.vectorstores import FAISS
+    from langchain.text_splitter import CharacterTextSplitter
+    from langchain.docstore.document import Document
+    from app.embedding_cache import CachedEmbeddings, embedding_store
+
+    index_path = index_path_for(text_hash)
+    # Chunk vectors come from the persistent store, question vectors from the in-memory LRU
+    embedding = CachedEmbeddings(get_embeddings(), embedding_store)
+
+    with timed("rag_index"):
+        if os.path.exists(index_path):
+            # Load existing FAISS index
+            vectorstore = load_vectorstore(index_path, embedding)
+            bm25 = load_or_build_bm25(vectorstore, index_path)
+            print(f"✅ Loaded cached embeddings from: {index_path}")
+        elif text is not None:
+            # Generate and store FAISS index; only chunks not seen before are sent to the embeddings API
+            docs = [Document(page_content=text)]
+            text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+            split_docs = text_splitter.split_documents(docs)
+            vectorstore = FAISS.from_documents(split_docs, embedding)
+            vectorstore.save_local(index_path)
+            bm25 = BM25Index(store_texts(vectorstore))
+            bm25.save(index_path)
+            print(f"💾 Saved new embeddings to: {index_path}")
+        else:
+            return None
 
-    index_path = get_embedding_path(text)
+    retriever = HybridRetriever(vectorstore=vectorstore, bm25=bm25)
+    return RetrievalQA.from_chain_type(llm=get_llm(), chain_type="stuff", retriever=retriever)
 
-    if os.path.exists(index_path):
-        # Load existing FAISS index
-        vectorstore = FAISS.load_local(index_path, embeddings=embedding, allow_dangerous_deserialization=True)
-        print(f"✅ Loaded cached embeddings from: {index_path}")
-    else:
-        # Generate and store FAISS index
-        docs = [Document(page_content=text)]
-        text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-        split_docs = text_splitter.split_documents(docs)
-        vectorstore = FAISS.from_documents(split_docs, embedding)
-        vectorstore.save_local(index_path)
-        print(f"💾 Saved new embeddings to: {index_path}")
+def _cached_chain(text_hash: str):
+    with _chains_lock:
+        chain = _chains.get(text_hash)
+        if chain is not None:
+            _chains.move_to_end(text_hash)
+        return chain
 
-    retriever_chain = RetrievalQA.from_chain_type(llm=llm, chain_type="stuff", retriever=vectorstore.as_retriever())
+def get_chain(text_hash: str, text: Optional[str] = None):
+    """The chain for `text_hash` from the in-memory LRU, else loaded from disk (or built from `text`)."""
+    chain = _cached_chain(text_hash)
+    if chain is not None:
+        return chain
+    # Only requests for this same text wait while its chunks are embedded
+    with _chain_builds.hold(text_hash):
+        chain = _cached_chain(text_hash)
+        if chain is None:
+            chain = create_rag_chain(text_hash, text)
+            if chain is not None:
+                with _chains_lock:
+                    _chains[text_hash] = chain
+                    while len(_chains) > RAG_CHAIN_CACHE_ENTRIES:
+                        _chains.popitem(last=False)
+        return chain
 
-def update_rag_doc_context(text: str):
-    """Update the RAG agent with new textual content."""
-    create_rag_chain(text)
+def update_rag_doc_context(text: str, session_id: str = DEFAULT_SESSION_ID) -> bool:
+    """Point the session's RAG agent at `text`. Returns False (and does nothing else) if it already is."""
+    text_hash = get_text_hash(text)
+    state = sessions.get(session_id)
+    if state.context_hash == text_hash:
+        return False
+    get_chain(text_hash, text)
+    state.context_hash = text_hash
+    return True
 
-def query_rag(messages: List[Dict[str, str]]) -> str:
+def activate_context(text_hash: str, session_id: str = DEFAULT_SESSION_ID) -> bool:
+    """Point the session at an already indexed context by its hash. Returns False if it is unknown."""
+    if not re.fullmatch(r"[0-9a-f]{32}", text_hash or ""):
+        return False
+    state = sessions.get(session_id)
+    if state.context_hash == text_hash:
+        return True
+    if get_chain(text_hash) is None:
+        return False
+    state.context_hash = text_hash
+    return True
+
+def get_context_fingerprint(session_id: str = DEFAULT_SESSION_ID):
+    return sessions.get(session_id).context_hash
+
+def get_retriever_chain(session_id: str = DEFAULT_SESSION_ID, mode: Optional[str] = None):
+    """The session's chain; `mode` (hybrid / vector / lexical) overrides the retrieval mode for one call."""
+    text_hash = sessions.get(session_id).context_hash
+    chain = get_chain(text_hash) if text_hash else None
+    if chain is None or mode is None or mode == chain.retriever.mode:
+        return chain
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode '{mode}' (expected one of {', '.join(RETRIEVAL_MODES)})")
+    # Shallow copies share the FAISS store and BM25 index
+    return chain.model_copy(update={"retriever": chain.retriever.model_copy(update={"mode": mode})})
+
+def query_rag(messages: List[Dict[str, str]], session_id: str = DEFAULT_SESSION_ID, mode: Optional[str] = None) -> str:
     """
-    Accepts a list of messages with roles and content.
-    Concatenates last 5 messages (user + assistant) as context.
+    Accepts a list of messages with roles and content (see app.history.compact).
+    Concatenates them (user + assistant) as context.
     Sends to retriever_chain.run() as a single string query.
     """
+    retriever_chain = get_retriever_chain(session_id, mode)
     if retriever_chain is None:
         return "No context loaded for RAG agent."
 
-    # Build a combined string prompt from roles and content
-    # For example: "User: ... Assistant: ..."
-    combined_query = "\n".join(
-        f"{msg['role'].capitalize()}: {msg['content']}" for msg in messages
-    )
-
     # Send combined string to the retriever_chain
-    return retriever_chain.run(combined_query)
+    with agent_run():
+        return retriever_chain.run(combine_messages(messages), callbacks=callbacks())
+
+async def aquery_rag(messages: List[Dict[str, str]], session_id: str = DEFAULT_SESSION_ID, mode: Optional[str] = None) -> str:
+    """Async variant of query_rag; awaits the chain instead of blocking a worker thread."""
+    # An evicted index is reloaded from disk: keep that off the event loop
+    retriever_chain = await run_in_threadpool(get_retriever_chain, session_id, mode)
+    if retriever_chain is None:
+        return "No context loaded for RAG agent."
+
+    with agent_run():
+        return await retriever_chain.arun(combine_messages(messages), callbacks=callbacks())
+
+async def astream_rag(messages: List[Dict[str, str]], session_id: str = DEFAULT_SESSION_ID, mode: Optional[str] = None):
+    """Streaming variant of query_rag: yields answer tokens, then the final answer."""
+    retriever_chain = await run_in_threadpool(get_retriever_chain, session_id, mode)
+    if retriever_chain is None:
+        yield {"type": "final", "response": "No context loaded for RAG agent."}
+        return
+
+    async for event in stream_agent_events(retriever_chain, {"query": combine_messages(messages)}):
+        yield event
+
+def warmup():
+    """Build the shared LLM and embeddings clients and import the retrieval stack."""
+    from langchain.chains import RetrievalQA  # noqa: F401
+    from langchain_community.vectorstores import FAISS  # noqa: F401
+
+    get_llm()
+    get_embeddings()
+
+def combine_messages(messages: List[Dict[str, str]]) -> str:
+    # Build a combined string prompt from roles and content
+    # For example: "User: ... Assistant: ..." (callers pass history already compacted by app.history)
+    return render(messages)
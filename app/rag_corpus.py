@@ -0,0 +1,393 @@
+import os
+import json
+import fcntl
+import math
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+from fastapi.concurrency import run_in_threadpool
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from app.components import get_embeddings, timed
+from app.config import CORPUS_DIR, CORPUS_IVF_THRESHOLD, CORPUS_NPROBE, CORPUS_TOP_K
+
+# === Constants ===
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 100
+# An IVF index is retrained once the corpus grows this many times past its last training size
+IVF_RETRAIN_GROWTH = 4
+FILTER_FIELDS = ("dataset", "name", "doc_id")
+# Filters matching at most this many chunks are scored exactly from the stored vectors:
+# an IVF search only probes `nprobe` lists and could miss a handful of allowed chunks
+EXACT_FILTER_LIMIT = 5000
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    # Inner product on unit vectors == cosine similarity
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class CorpusIndex:
+    """
+    Multi-document RAG corpus: one persistent FAISS index over the chunks of every
+    document plus a SQLite catalogue (documents, chunk text, metadata, vectors).
+
+    Small corpora use an exact flat index; past `ivf_threshold` chunks the index is
+    rebuilt as IVF (nlist ~ 4*sqrt(n), searched with `nprobe` lists), so retrieval
+    cost stays roughly flat as documents are added. Both index types support
+    removal by id, so documents are added and removed incrementally. Metadata
+    filters are applied inside the FAISS search through an id selector.
+    """
+
+    def __init__(self, directory: str, ivf_threshold: int = CORPUS_IVF_THRESHOLD, nprobe: int = CORPUS_NPROBE):
+        self.directory = directory
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+        self.index_path = os.path.join(directory, "index.faiss")
+        self._index = None
+        self._index_version = None  # index file version the in-memory index matches
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(directory, "corpus.db"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                doc_id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                dataset TEXT,
+                metadata TEXT NOT NULL,
+                chunks INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_documents_dataset ON documents (dataset);
+            CREATE TABLE IF NOT EXISTS chunks (
+                id INTEGER PRIMARY KEY,
+                doc_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                vector BLOB NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_chunks_doc ON chunks (doc_id);
+            CREATE TABLE IF NOT EXISTS corpus_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+            """
+        )
+        self._conn.commit()
+
+    # === Index lifecycle ===
+    def _meta(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM corpus_meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, key: str, value: Any):
+        self._conn.execute(
+            "INSERT INTO corpus_meta (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+            (key, str(value)),
+        )
+
+    def _chunk_count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def _disk_version(self) -> Optional[tuple]:
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    @contextmanager
+    def _exclusive(self):
+        """Serialize writers across worker processes (the in-process lock only covers threads)."""
+        with self._lock, open(os.path.join(self.directory, "corpus.lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def index(self):
+        """
+        The FAISS index, loaded on first use and rebuilt from the catalogue if out of sync.
+        Reloaded when another worker process has written a newer index file.
+        """
+        import faiss
+
+        with self._lock:
+            if self._index is not None and self._disk_version() != self._index_version:
+                self._index = None
+            if self._index is None:
+                if os.path.exists(self.index_path):
+                    with timed("corpus_index"):
+                        self._index_version = self._disk_version()
+                        self._index = faiss.read_index(self.index_path)
+                if self._index is None or self._index.ntotal != self._chunk_count():
+                    # Missing index or a crash between catalogue and index writes: rebuild from stored vectors
+                    self._rebuild()
+            return self._index
+
+    def _rebuild(self):
+        import faiss
+
+        rows = self._conn.execute("SELECT id, vector FROM chunks ORDER BY id").fetchall()
+        dim = int(self._meta("dim", "0"))
+        if not rows and not dim:
+            self._index = None
+            return
+        ids = np.array([r[0] for r in rows], dtype="int64")
+        vectors = np.vstack([np.frombuffer(r[1], dtype=np.float32) for r in rows]) if rows else np.zeros((0, dim), "float32")
+
+        with timed("corpus_rebuild"):
+            if len(rows) >= self.ivf_threshold:
+                nlist = max(1, int(4 * math.sqrt(len(rows))))
+                index = faiss.IndexIVFFlat(faiss.IndexFlatIP(dim), dim, nlist, faiss.METRIC_INNER_PRODUCT)
+                index.train(vectors)
+                self._set_meta("trained_size", len(rows))
+            else:
+                index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+                self._set_meta("trained_size", 0)
+            if len(rows):
+                index.add_with_ids(vectors, ids)
+        self._index = index
+        self._persist()
+        print(f"🗂️ Corpus index rebuilt: {type(index).__name__} with {len(rows)} chunk(s)")
+
+    def _maybe_restructure(self):
+        """Switch flat -> IVF past the threshold; retrain IVF when the corpus has grown a lot."""
+        import faiss
+
+        n = self._index.ntotal if self._index is not None else 0
+        trained = int(self._meta("trained_size", "0"))
+        is_ivf = isinstance(self._index, faiss.IndexIVF)
+        if (not is_ivf and n >= self.ivf_threshold) or (is_ivf and n > IVF_RETRAIN_GROWTH * trained):
+            self._rebuild()
+
+    def _persist(self):
+        import faiss
+
+        self._conn.commit()
+        if self._index is None:
+            return
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        faiss.write_index(self._index, tmp_path)
+        os.replace(tmp_path, self.index_path)
+        self._index_version = self._disk_version()
+
+    # === Documents ===
+    def add_document(self, name: str, text: str, dataset: Optional[str] = None,
+                     metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Chunk, embed (through the chunk embedding cache) and index one document. Idempotent per content."""
+        from langchain.text_splitter import CharacterTextSplitter
+        from app.embedding_cache import CachedEmbeddings, embedding_store
+
+        doc_id = hashlib.md5(f"{name}\0{dataset or ''}\0{text}".encode("utf-8")).hexdigest()
+        with self._lock:
+            existing = self.get_document(doc_id)
+            if existing is not None:
+                return {**existing, "added": False}
+
+        chunks = CharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP).split_text(text)
+        vectors = _normalize(np.asarray(
+            CachedEmbeddings(get_embeddings(), embedding_store).embed_documents(chunks), dtype=np.float32
+        )) if chunks else np.zeros((0, 0), "float32")
+
+        with self._exclusive():
+            existing = self.get_document(doc_id)  # added by another worker meanwhile
+            if existing is not None:
+                return {**existing, "added": False}
+            index = self.index()
+            if index is None and len(chunks):
+                self._set_meta("dim", vectors.shape[1])
+            self._conn.execute(
+                "INSERT INTO documents (doc_id, name, dataset, metadata, chunks, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (doc_id, name, dataset, json.dumps(metadata or {}), len(chunks), time.time()),
+            )
+            self._conn.executemany(
+                "INSERT INTO chunks (doc_id, position, text, vector) VALUES (?, ?, ?, ?)",
+                [(doc_id, i, chunk, vectors[i].tobytes()) for i, chunk in enumerate(chunks)],
+            )
+            ids = np.array([r[0] for r in self._conn.execute(
+                "SELECT id FROM chunks WHERE doc_id = ? ORDER BY position", (doc_id,)
+            )], dtype="int64")
+            if index is None:
+                self._rebuild()  # first document: creates the index from the rows just written
+            else:
+                if len(ids):
+                    index.add_with_ids(vectors, ids)
+                self._persist()
+                self._maybe_restructure()
+        print(f"📚 Added '{name}' to the corpus ({len(chunks)} chunk(s))")
+        return {**self.get_document(doc_id), "added": True}
+
+    def remove_document(self, doc_id: str) -> bool:
+        with self._exclusive():
+            if self.get_document(doc_id) is None:
+                return False
+            ids = np.array([r[0] for r in self._conn.execute("SELECT id FROM chunks WHERE doc_id = ?", (doc_id,))], dtype="int64")
+            index = self.index()
+            self._conn.execute("DELETE FROM chunks WHERE doc_id = ?", (doc_id,))
+            self._conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+            if index is not None and len(ids):
+                index.remove_ids(ids)
+            self._persist()
+        print(f"🗑️ Removed document {doc_id} from the corpus ({len(ids)} chunk(s))")
+        return True
+
+    def get_document(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn.execute(
+            "SELECT doc_id, name, dataset, metadata, chunks, created_at FROM documents WHERE doc_id = ?", (doc_id,)
+        ).fetchone()
+        return self._document_dict(row) if row else None
+
+    def list_documents(self, dataset: Optional[str] = None) -> List[Dict[str, Any]]:
+        sql = "SELECT doc_id, name, dataset, metadata, chunks, created_at FROM documents"
+        params = ()
+        if dataset is not None:
+            sql, params = sql + " WHERE dataset = ?", (dataset,)
+        with self._lock:
+            return [self._document_dict(r) for r in self._conn.execute(sql + " ORDER BY created_at", params)]
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM documents LIMIT 1").fetchone() is None
+
+    @staticmethod
+    def _document_dict(row) -> Dict[str, Any]:
+        doc_id, name, dataset, metadata, chunks, created_at = row
+        return {"doc_id": doc_id, "name": name, "dataset": dataset, "metadata": json.loads(metadata),
+                "chunks": chunks, "created_at": created_at}
+
+    # === Search ===
+    def _allowed_ids(self, filters: Dict[str, Any]) -> Optional[np.ndarray]:
+        conditions = [(f"d.{field} = ?", filters[field]) for field in FILTER_FIELDS if filters.get(field) is not None]
+        if not conditions:
+            return None
+        where = " AND ".join(c for c, _ in conditions)
+        rows = self._conn.execute(
+            f"SELECT c.id FROM chunks c JOIN documents d ON d.doc_id = c.doc_id WHERE {where}",
+            [v for _, v in conditions],
+        ).fetchall()
+        return np.array([r[0] for r in rows], dtype="int64")
+
+    def search(self, query: str, k: int = CORPUS_TOP_K, filters: Optional[Dict[str, Any]] = None) -> List[Document]:
+        """Top-k chunks for `query`, optionally restricted to documents matching `filters` (dataset, name, doc_id)."""
+        import faiss
+
+        from app.embedding_cache import CachedEmbeddings, embedding_store
+
+        vector = _normalize(np.asarray(
+            [CachedEmbeddings(get_embeddings(), embedding_store).embed_query(query)], dtype=np.float32
+        ))
+        with self._lock:
+            index = self.index()
+            if index is None or index.ntotal == 0:
+                return []
+            allowed = self._allowed_ids(filters or {})
+            if allowed is not None and not len(allowed):
+                return []
+            is_ivf = isinstance(index, faiss.IndexIVF)
+            if allowed is not None and is_ivf and len(allowed) <= EXACT_FILTER_LIMIT:
+                hits = self._exact_search(vector[0], allowed, k)
+            else:
+                selector = faiss.IDSelectorBatch(allowed) if allowed is not None else None
+                if is_ivf:
+                    params = faiss.SearchParametersIVF(sel=selector, nprobe=self.nprobe) if selector else \
+                        faiss.SearchParametersIVF(nprobe=self.nprobe)
+                else:
+                    params = faiss.SearchParameters(sel=selector) if selector else None
+                scores, ids = index.search(vector, k, params=params)
+                hits = [(int(i), float(s)) for i, s in zip(ids[0], scores[0]) if i != -1]
+            if not hits:
+                return []
+            placeholders = ", ".join("?" for _ in hits)
+            rows = {r[0]: r[1:] for r in self._conn.execute(
+                f"SELECT c.id, c.text, c.position, d.doc_id, d.name, d.dataset, d.metadata "
+                f"FROM chunks c JOIN documents d ON d.doc_id = c.doc_id WHERE c.id IN ({placeholders})",
+                [i for i, _ in hits],
+            )}
+        documents = []
+        for chunk_id, score in hits:
+            text, position, doc_id, name, dataset, metadata = rows[chunk_id]
+            documents.append(Document(page_content=text, metadata={
+                **json.loads(metadata), "doc_id": doc_id, "name": name, "dataset": dataset,
+                "chunk": position, "score": score,
+            }))
+        return documents
+
+    def _exact_search(self, vector: np.ndarray, allowed: np.ndarray, k: int) -> List[tuple]:
+        ids, scores = [], []
+        for i in range(0, len(allowed), 500):
+            batch = [int(x) for x in allowed[i:i + 500]]
+            placeholders = ", ".join("?" for _ in batch)
+            for chunk_id, blob in self._conn.execute(f"SELECT id, vector FROM chunks WHERE id IN ({placeholders})", batch):
+                ids.append(chunk_id)
+                scores.append(float(np.frombuffer(blob, dtype=np.float32) @ vector))
+        order = np.argsort(scores)[::-1][:k]
+        return [(ids[i], scores[i]) for i in order]
+
+    def fingerprint(self) -> str:
+        """Changes whenever a document is added or removed (answer cache key)."""
+        with self._lock:
+            doc_ids = [r[0] for r in self._conn.execute("SELECT doc_id FROM documents ORDER BY doc_id")]
+        return hashlib.md5(",".join(doc_ids).encode()).hexdigest()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            index = self.index()
+            (documents,) = self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()
+            return {
+                "documents": documents,
+                "chunks": index.ntotal if index is not None else 0,
+                "index_type": type(index).__name__ if index is not None else None,
+                "ivf_threshold": self.ivf_threshold,
+                "nprobe": self.nprobe,
+            }
+
+
+class CorpusRetriever(BaseRetriever):
+    """LangChain retriever over the shared corpus with fixed metadata filters."""
+    corpus: Any = None
+    k: int = CORPUS_TOP_K
+    filters: Dict[str, Any] = {}
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        return self.corpus.search(query, k=self.k, filters=self.filters)
+
+
+corpus = CorpusIndex(CORPUS_DIR)
+
+
+def build_corpus_chain(filters: Optional[Dict[str, Any]] = None, k: int = CORPUS_TOP_K):
+    from langchain.chains import RetrievalQA
+    from app.components import get_llm
+
+    retriever = CorpusRetriever(corpus=corpus, k=k, filters=filters or {})
+    return RetrievalQA.from_chain_type(llm=get_llm(), chain_type="stuff", retriever=retriever)
+
+
+async def aquery_corpus(messages: List[Dict[str, str]], filters: Optional[Dict[str, Any]] = None,
+                        k: int = CORPUS_TOP_K) -> str:
+    from app.rag_agent import combine_messages
+
+    if await run_in_threadpool(corpus.is_empty):
+        return "No documents in the RAG corpus."
+    from app.tracing import agent_run, callbacks
+
+    with agent_run():
+        return await build_corpus_chain(filters, k).arun(combine_messages(messages), callbacks=callbacks())
+
+
+async def astream_corpus(messages: List[Dict[str, str]], filters: Optional[Dict[str, Any]] = None,
+                         k: int = CORPUS_TOP_K):
+    from app.rag_agent import combine_messages
+    from app.streaming import stream_agent_events
+
+    if await run_in_threadpool(corpus.is_empty):
+        yield {"type": "final", "response": "No documents in the RAG corpus."}
+        return
+    async for event in stream_agent_events(build_corpus_chain(filters, k), {"query": combine_messages(messages)}):
+        yield event
@@ -0,0 +1,293 @@
+import os
+import re
+import time
+import json
+import hashlib
+import sqlite3
+import itertools
+import pandas as pd
+from typing import Dict, List, Optional, Sequence, Tuple
+from urllib.parse import quote
+from app.config import ROLLUP_MEASURES, ROLLUP_DIMENSIONS, ROLLUP_MAX_DIMENSIONS, SQL_ROLLUP_DIR
+
+# === Constants ===
+ROLLUP_PREFIX = "rollup_"
+ROLLUP_META_TABLE = "_rollup_meta"  # "_" keeps it out of the SQL agent's schema
+ROLLUP_SCHEMA = "rollups"  # name the sidecar file is attached under by the SQL executor
+SOURCE_SCHEMA = "source"  # name the database is attached under (read-only) while rollups are built
+AGGREGATES = ("sum", "count", "min", "max", "avg")
+
+
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def slug(name: str) -> str:
+    """'Sales (USD)' -> 'sales_usd'"""
+    return re.sub(r"\W+", "_", name).strip("_").lower()
+
+
+def rollup_plan(columns: Sequence[str], numeric: Optional[Sequence[str]] = None) -> Tuple[List[str], List[Tuple[str, ...]]]:
+    """Measures present in `columns` and every 1..ROLLUP_MAX_DIMENSIONS combination of the dimensions present."""
+    measures = [m for m in ROLLUP_MEASURES if m in columns and (numeric is None or m in numeric)]
+    dims = [d for d in ROLLUP_DIMENSIONS if d in columns and d not in measures]
+    if not measures or not dims:
+        return [], []
+    dim_sets = [combo for n in range(1, ROLLUP_MAX_DIMENSIONS + 1) for combo in itertools.combinations(dims, n)]
+    return measures, dim_sets
+
+
+def rollup_name(dims: Sequence[str], table: Optional[str] = None) -> str:
+    source = f"{slug(table)}_" if table else ""
+    return f"{ROLLUP_PREFIX}{source}by_{'_'.join(slug(d) for d in dims)}"
+
+
+def measure_columns(measure: str) -> Dict[str, str]:
+    return {agg: f"{slug(measure)}_{agg}" for agg in AGGREGATES}
+
+
+def describe_rollups(names: Sequence[str], measures: Sequence[str]) -> str:
+    """Prompt text telling an agent what the rollups contain and when to use them."""
+    if not names:
+        return ""
+    columns = ", ".join(f"{m} -> {', '.join(measure_columns(m).values())}" for m in measures)
+    return (
+        f"Precomputed rollups (one row per group, plus row_count) are available: {', '.join(names)}. "
+        f"Measure columns: {columns}. For totals, averages, counts, minima or maxima of these measures "
+        f"grouped by the dimensions in a rollup's name (optionally filtered on them), read the rollup "
+        f"instead of aggregating the raw rows."
+    )
+
+
+# === DataFrame rollups ===
+def build_frame_rollups(df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """Group `df` once per dimension set; the result is keyed by rollup name."""
+    numeric = [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c])]
+    measures, dim_sets = rollup_plan(list(df.columns), numeric)
+    rollups = {}
+    for dims in dim_sets:
+        named = {}
+        for m in measures:
+            cols = measure_columns(m)
+            named.update({cols[agg]: (m, agg) for agg in ("sum", "count", "min", "max")})
+        frame = df.groupby(list(dims), dropna=False, sort=True, observed=True).agg(**named)
+        frame["row_count"] = df.groupby(list(dims), dropna=False, sort=True, observed=True).size()
+        rollups[rollup_name(dims)] = _with_averages(frame.reset_index(), measures)
+    return rollups
+
+
+def merge_frame_rollups(current: Dict[str, pd.DataFrame], delta: Dict[str, pd.DataFrame]) -> Dict[str, pd.DataFrame]:
+    """Combine the rollups of existing rows with those of appended rows (re-aggregates groups, not rows)."""
+    merged = {}
+    for name, new in delta.items():
+        old = current.get(name)
+        if old is None:
+            merged[name] = new
+            continue
+        dims = [c for c in ROLLUP_DIMENSIONS if c in new.columns]
+        measures = [m for m in ROLLUP_MEASURES if measure_columns(m)["sum"] in new.columns]
+        how = {"row_count": "sum"}
+        for m in measures:
+            cols = measure_columns(m)
+            how.update({cols["sum"]: "sum", cols["count"]: "sum", cols["min"]: "min", cols["max"]: "max"})
+        combined = pd.concat([old, new], ignore_index=True)
+        frame = combined.groupby(dims, dropna=False, sort=True).agg(how).reset_index()
+        merged[name] = _with_averages(frame, measures)[list(new.columns)]
+    return merged
+
+
+def _with_averages(frame: pd.DataFrame, measures: Sequence[str]) -> pd.DataFrame:
+    for m in measures:
+        cols = measure_columns(m)
+        frame[cols["avg"]] = frame[cols["sum"]] / frame[cols["count"]].where(frame[cols["count"]] > 0)
+    return frame
+
+
+# === SQLite rollup tables (sidecar file per database) ===
+def sidecar_path(db_path: str) -> str:
+    """data/rollups/<db name>_<hash of its absolute path>.db"""
+    db_path = os.path.abspath(db_path)
+    digest = hashlib.md5(db_path.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(SQL_ROLLUP_DIR, f"{slug(os.path.splitext(os.path.basename(db_path))[0])}_{digest}.db")
+
+
+def readonly_uri(path: str) -> str:
+    return f"file:{quote(os.path.abspath(path))}?mode=ro"
+
+
+def source_version(db_path: str) -> str:
+    """mtime + size of the database file and its WAL: any committed write changes it, reading never does."""
+    parts = []
+    for path in (db_path, f"{db_path}-wal"):
+        if os.path.exists(path):
+            stat = os.stat(path)
+            parts.append(f"{stat.st_mtime_ns}:{stat.st_size}")
+    return "/".join(parts)
+
+
+def _ensure_meta(conn: sqlite3.Connection):
+    columns = [r[1] for r in conn.execute(f"PRAGMA main.table_info({ROLLUP_META_TABLE})")]
+    if columns and "source_version" not in columns:
+        conn.execute(f"DROP TABLE main.{ROLLUP_META_TABLE}")  # older layout: every rollup is rebuilt once
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS main.{ROLLUP_META_TABLE} ("
+        "rollup_table TEXT PRIMARY KEY, source_table TEXT NOT NULL, definition TEXT NOT NULL, "
+        "last_rowid INTEGER NOT NULL, row_count INTEGER NOT NULL, source_version TEXT NOT NULL, "
+        "updated_at REAL NOT NULL)"
+    )
+
+
+def _rollup_meta(conn: sqlite3.Connection, name: str) -> Optional[Tuple[str, int, str]]:
+    if not conn.execute("SELECT 1 FROM main.sqlite_master WHERE type = 'table' AND name = ?", (ROLLUP_META_TABLE,)).fetchone():
+        return None
+    try:
+        return conn.execute(
+            f"SELECT definition, last_rowid, source_version FROM main.{ROLLUP_META_TABLE} WHERE rollup_table = ?",
+            (name,),
+        ).fetchone()
+    except sqlite3.OperationalError:
+        return None  # older layout
+
+
+def _group_select(source: str, dims: Sequence[str], measures: Sequence[str], merge: bool) -> str:
+    """SELECT producing rollup rows from raw rows (merge=False) or from partial rollup rows (merge=True)."""
+    dim_sql = ", ".join(quote_identifier(d) for d in dims)
+    select = [dim_sql]
+    for m in measures:
+        cols = measure_columns(m)
+        if merge:
+            s, c, mn, mx = (quote_identifier(cols[a]) for a in ("sum", "count", "min", "max"))
+            exprs = [f"SUM({s})", f"SUM({c})", f"MIN({mn})", f"MAX({mx})", f"SUM({s}) * 1.0 / NULLIF(SUM({c}), 0)"]
+        else:
+            q = quote_identifier(m)
+            exprs = [f"SUM({q})", f"COUNT({q})", f"MIN({q})", f"MAX({q})", f"AVG({q})"]
+        select += [f"{e} AS {quote_identifier(cols[a])}" for e, a in zip(exprs, AGGREGATES)]
+    select.append("SUM(row_count) AS row_count" if merge else "COUNT(*) AS row_count")
+    return f"SELECT {', '.join(select)} FROM {source} GROUP BY {dim_sql}"
+
+
+def _replace_rollup(conn: sqlite3.Connection, name: str, select_sql: str, dims: Sequence[str], params=()):
+    building = f"{name}__building"
+    conn.execute(f"DROP TABLE IF EXISTS main.{quote_identifier(building)}")
+    conn.execute(f"CREATE TABLE main.{quote_identifier(building)} AS {select_sql}", params)
+    conn.execute(f"DROP TABLE IF EXISTS main.{quote_identifier(name)}")
+    conn.execute(f"ALTER TABLE main.{quote_identifier(building)} RENAME TO {quote_identifier(name)}")
+    conn.execute(
+        f"CREATE INDEX main.{quote_identifier(f'idx_{name}')} ON {quote_identifier(name)} "
+        f"({', '.join(quote_identifier(d) for d in dims)})"
+    )
+
+
+def refresh_table_rollups(conn: sqlite3.Connection, table: str, version: str,
+                          appended_since: Optional[str] = None, schema: str = SOURCE_SCHEMA) -> List[str]:
+    """
+    Bring the rollup tables of `table` (in the attached `schema`) up to date; rollup
+    tables and their metadata are written to the main database of `conn`. `version`
+    (source_version of the file) unchanged since the last refresh: nothing to do. When the
+    caller only appended rows since `appended_since` and the rollups were built at exactly
+    that version, the rows past the old max(rowid) are folded into the existing groups.
+    Any other change (UPDATE, DELETE, a rebuilt table, a new definition) is a full rebuild:
+    a few GROUP BYs, no per-row work in Python. Returns the rollup names.
+    """
+    columns = [r[1] for r in conn.execute(f"PRAGMA {schema}.table_info({quote_identifier(table)})")]
+    measures, dim_sets = rollup_plan(columns)
+    if not dim_sets:
+        return []
+    source = f"{schema}.{quote_identifier(table)}"
+    state = None
+
+    names = []
+    for dims in dim_sets:
+        name = rollup_name(dims, table)
+        names.append(name)
+        definition = json.dumps({"dimensions": list(dims), "measures": measures})
+        meta = _rollup_meta(conn, name)
+        exists = conn.execute("SELECT 1 FROM main.sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone()
+        current = bool(meta and exists and meta[0] == definition)
+        if current and meta[2] == version:
+            continue
+        append_only = current and appended_since is not None and meta[2] == appended_since
+        if state is None:
+            # max(rowid) is a b-tree lookup and COUNT(*) a scan in C
+            state = conn.execute(f"SELECT COALESCE(MAX(rowid), 0), COUNT(*) FROM {source}").fetchone()
+        max_rowid, row_count = state
+
+        _ensure_meta(conn)
+        conn.execute("BEGIN")
+        if append_only:
+            # Incremental: aggregate only the appended rows, then merge them with the existing groups
+            delta = _group_select(f"{source} WHERE rowid > ?", dims, measures, merge=False)
+            combined = f"({delta} UNION ALL SELECT * FROM main.{quote_identifier(name)})"
+            _replace_rollup(conn, name, _group_select(combined, dims, measures, merge=True), dims, (meta[1],))
+            mode = "updated"
+        else:
+            _replace_rollup(conn, name, _group_select(source, dims, measures, merge=False), dims)
+            mode = "built"
+        conn.execute(
+            f"INSERT INTO main.{ROLLUP_META_TABLE} "
+            "(rollup_table, source_table, definition, last_rowid, row_count, source_version, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (rollup_table) DO UPDATE SET definition = excluded.definition, "
+            "last_rowid = excluded.last_rowid, row_count = excluded.row_count, "
+            "source_version = excluded.source_version, updated_at = excluded.updated_at",
+            (name, table, definition, max_rowid, row_count, version, time.time()),
+        )
+        conn.execute("COMMIT")
+        print(f"📊 Rollup {name} {mode} ({row_count} source rows)")
+    return names
+
+
+def refresh_sql_rollups(db_path: str, tables: Optional[Sequence[str]] = None,
+                        appended_since: Optional[str] = None) -> List[str]:
+    """
+    Refresh the rollups of every base table (or only `tables`) of a SQLite file in its
+    sidecar file. The database itself is attached read-only and never written to.
+    `appended_since`: the source_version before the caller appended rows to `tables`
+    (and changed nothing else), which allows an incremental refresh.
+    Returns the names of the refreshed rollup tables.
+    """
+    version = source_version(db_path)
+    path = sidecar_path(db_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # A URI connection, so the database can be attached with ?mode=ro
+    conn = sqlite3.connect(f"file:{quote(os.path.abspath(path))}", uri=True, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")  # executors of other workers keep reading while it is refreshed
+        conn.execute(f"ATTACH DATABASE ? AS {SOURCE_SCHEMA}", (readonly_uri(db_path),))
+        if tables is None:
+            tables = [
+                r[0] for r in conn.execute(
+                    f"SELECT name FROM {SOURCE_SCHEMA}.sqlite_master WHERE type = 'table' "
+                    "AND name NOT LIKE 'sqlite_%' AND name NOT LIKE '\\_%' ESCAPE '\\' AND name NOT LIKE ?",
+                    (f"{ROLLUP_PREFIX}%",),
+                )
+            ]
+            prune = True
+        else:
+            prune = False
+        names = []
+        for table in tables:
+            names += refresh_table_rollups(conn, table, version, appended_since)
+        if prune:
+            # Rollups of tables (or dimension sets) that no longer exist
+            stale = [
+                r[0] for r in conn.execute(
+                    "SELECT name FROM main.sqlite_master WHERE type = 'table' AND name LIKE ?", (f"{ROLLUP_PREFIX}%",)
+                ) if r[0] not in names
+            ]
+            for name in stale:
+                conn.execute(f"DROP TABLE main.{quote_identifier(name)}")
+                conn.execute(f"DELETE FROM main.{ROLLUP_META_TABLE} WHERE rollup_table = ?", (name,))
+        return names
+    finally:
+        conn.close()
+
+
+def drop_embedded_rollups(conn: sqlite3.Connection) -> List[str]:
+    """Remove rollup tables older versions wrote into the database itself (they would shadow the sidecar's)."""
+    names = [
+        r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE ?", (f"{ROLLUP_PREFIX}%",))
+    ]
+    for name in names:
+        conn.execute(f"DROP TABLE {quote_identifier(name)}")
+    conn.execute(f"DROP TABLE IF EXISTS {ROLLUP_META_TABLE}")
+    return names
@@ -0,0 +1,151 @@
+import os
+import time
+import sqlite3
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Optional, Set
+from fastapi import Header
+from app.config import SESSION_IDLE_TTL_SECONDS, SESSION_STORE_PATH
+
+DEFAULT_SESSION_ID = "default"
+SWEEP_INTERVAL_SECONDS = 60
+# last_used is written back at most this often per session (a read does not need a write)
+TOUCH_INTERVAL_SECONDS = 10
+SHARED_FIELDS = ("dataset_id", "db_uri", "context_hash")
+
+
+@dataclass
+class SessionState:
+    """
+    Per-session pointers to the data each agent works on.
+    The heavy objects (DataFrames, SQL agents, FAISS indexes and chains) live in
+    shared caches inside the agent modules and are looked up by these keys.
+    Assigning a pointer writes it through to the shared session store, so every
+    worker process sees it on its next lookup.
+    """
+    dataset_id: Optional[str] = None
+    db_uri: Optional[str] = None
+    context_hash: Optional[str] = None
+    last_used: float = field(default_factory=time.time)
+    session_id: str = field(default=DEFAULT_SESSION_ID, repr=False)
+    _pool: Any = field(default=None, repr=False, compare=False)
+
+    def __setattr__(self, name: str, value: Any):
+        super().__setattr__(name, value)
+        pool = self.__dict__.get("_pool")
+        if pool is not None and name in SHARED_FIELDS:
+            pool.save(self.session_id, name, value)
+
+
+class SessionPool:
+    """
+    Session-id -> SessionState map with idle eviction after `ttl_seconds`.
+
+    Backed by a SQLite file (WAL) instead of process memory, so `uvicorn --workers N`
+    or several replicas on one host share sessions: the data a session uploaded through
+    one worker is found by all of them (datasets through the spill cache, DB files and
+    RAG indexes by path / hash).
+    """
+
+    def __init__(self, ttl_seconds: int, path: str = SESSION_STORE_PATH):
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self._lock = threading.RLock()
+        self._last_sweep = time.time()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                dataset_id TEXT,
+                db_uri TEXT,
+                context_hash TEXT,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_last_used ON sessions (last_used)")
+        self._conn.commit()
+
+    def get(self, session_id: str = DEFAULT_SESSION_ID) -> SessionState:
+        now = time.time()
+        with self._lock:
+            self._maybe_sweep()
+            row = self._conn.execute(
+                "SELECT dataset_id, db_uri, context_hash, last_used FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO sessions (session_id, last_used) VALUES (?, ?)", (session_id, now)
+                )
+                self._conn.commit()
+                row = (None, None, None, now)
+            elif now - row[3] >= TOUCH_INTERVAL_SECONDS:
+                self._conn.execute("UPDATE sessions SET last_used = ? WHERE session_id = ?", (now, session_id))
+                self._conn.commit()
+        return SessionState(*row[:3], last_used=now, session_id=session_id, _pool=self)
+
+    def save(self, session_id: str, name: str, value: Optional[str]):
+        if name not in SHARED_FIELDS:
+            raise ValueError(f"Unknown session field: {name}")
+        with self._lock:
+            self._conn.execute(
+                f"INSERT INTO sessions (session_id, {name}, last_used) VALUES (?, ?, ?) "
+                f"ON CONFLICT (session_id) DO UPDATE SET {name} = excluded.{name}, last_used = excluded.last_used",
+                (session_id, value, time.time()),
+            )
+            self._conn.commit()
+
+    def close(self, session_id: str) -> bool:
+        with self._lock:
+            deleted = self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,)).rowcount
+            self._conn.commit()
+        return deleted > 0
+
+    def referenced(self, attr: str) -> Set[str]:
+        """All values of `attr` (e.g. "db_uri") still held by a live session."""
+        if attr not in SHARED_FIELDS:
+            raise ValueError(f"Unknown session field: {attr}")
+        with self._lock:
+            rows = self._conn.execute(f"SELECT DISTINCT {attr} FROM sessions WHERE {attr} IS NOT NULL").fetchall()
+        return {r[0] for r in rows}
+
+    def evict_idle(self) -> int:
+        with self._lock:
+            cutoff = time.time() - self.ttl_seconds
+            idle = self._conn.execute(
+                "DELETE FROM sessions WHERE last_used < ? AND session_id != ?", (cutoff, DEFAULT_SESSION_ID)
+            ).rowcount
+            self._conn.commit()
+            self._last_sweep = time.time()
+        if idle:
+            print(f"🧹 Evicted {idle} idle session(s)")
+        return idle
+
+    def _maybe_sweep(self):
+        if time.time() - self._last_sweep >= SWEEP_INTERVAL_SECONDS:
+            self.evict_idle()
+
+    def stats(self) -> dict:
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        return {
+            "sessions": count,
+            "ttl_seconds": self.ttl_seconds,
+            "datasets": len(self.referenced("dataset_id")),
+            "databases": len(self.referenced("db_uri")),
+            "contexts": len(self.referenced("context_hash")),
+            "store": self.path,
+        }
+
+
+sessions = SessionPool(ttl_seconds=SESSION_IDLE_TTL_SECONDS)
+
+
+def get_session_id(x_session_id: Optional[str] = Header(None)) -> str:
+    """FastAPI dependency: the caller's session id from the X-Session-ID header."""
+    return x_session_id or DEFAULT_SESSION_ID
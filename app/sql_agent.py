@@ -1,50 +1,164 @@
 import os
-from langchain_community.agent_toolkits.sql.base import create_sql_agent
-from langchain_community.agent_toolkits.sql.base import SQLDatabaseToolkit
-from langchain_community.utilities import SQLDatabase
-from langchain_openai import ChatOpenAI
-from langchain.agents import AgentType
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+from fastapi.concurrency import run_in_threadpool
+from app.components import get_llm, timed
+from app.concurrency import KeyedLocks
+from app.session_pool import sessions, DEFAULT_SESSION_ID
+from app.streaming import stream_agent_events
+from app.tracing import agent_run, callbacks
+from app.config import SQL_DEFAULT_DB_PATH
 
 # === Constants ===
-DEFAULT_DB_PATH = "data/retail_transactions_data.db"
+DEFAULT_DB_PATH = SQL_DEFAULT_DB_PATH
 DEFAULT_DB_URI = f"sqlite:///{DEFAULT_DB_PATH}"
 
-# === Initialize LLM ===
-llm = ChatOpenAI(temperature=0, model_name="gpt-4o-mini")
+# === Shared DB connections + agents, keyed by DB URI (built on first use) ===
+# Each entry is (file fingerprint, db, agent, executor, schema snapshot); a rewritten DB file gets a fresh agent + schema
+_agents: Dict[str, Tuple[str, object, object, object, object]] = {}
+_agents_lock = threading.Lock()
+_agent_builds = KeyedLocks()
 
-# === Create initial SQL DB connection ===
-db = SQLDatabase.from_uri(DEFAULT_DB_URI)
+def db_path_from_uri(db_uri: str) -> str:
+    return db_uri[len("sqlite:///"):]
 
-# === Build agent ===
-sql_agent = create_sql_agent(
-    llm=llm,
-    toolkit=SQLDatabaseToolkit(db=db, llm=llm),
-    verbose=True,
-    agent_type=AgentType.OPENAI_FUNCTIONS
-)
+def db_file_fingerprint(db_uri: str) -> str:
+    """Path + mtime + size of a sqlite:/// database file; changes whenever the file is rewritten."""
+    path = db_path_from_uri(db_uri)
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}:{stat.st_mtime_ns}:{stat.st_size}"
+
+def build_sql_agent(db_uri: str, fingerprint: str):
+    from langchain_community.agent_toolkits.sql.base import create_sql_agent
+    from langchain_community.utilities import SQLDatabase
+    from langchain.agents import AgentType
+    from app.sql_executor import SQLiteExecutor
+    from app.sql_schema import CachedSchemaToolkit, build_sql_prompt, get_schema_snapshot
+
+    with timed("sql_agent"):
+        llm = get_llm()
+        # Read-only, tuned connections with query deadlines, result budgets and a result cache
+        executor = SQLiteExecutor(db_path_from_uri(db_uri), fingerprint)
+        db = SQLDatabase(executor.engine)
+        # Schema, sample rows and column stats are computed once per DB file version
+        snapshot = get_schema_snapshot(db, db_path_from_uri(db_uri))
+        toolkit = CachedSchemaToolkit(db=db, llm=llm, snapshot=snapshot, executor=executor)
+        agent = create_sql_agent(
+            llm=llm,
+            toolkit=toolkit,
+            prompt=build_sql_prompt(snapshot, dialect=toolkit.dialect),
+            verbose=True,
+            agent_type=AgentType.OPENAI_FUNCTIONS
+        )
+    return db, agent, executor, snapshot
+
+def refresh_rollups(db_uri: str) -> List[str]:
+    """Bring the rollup sidecar of `db_uri` up to date (the DB file itself is only read)."""
+    from app.rollups import refresh_sql_rollups
+
+    try:
+        with timed("sql_rollups"):
+            return refresh_sql_rollups(db_path_from_uri(db_uri))
+    except (sqlite3.Error, OSError) as e:
+        # e.g. an unwritable SQL_ROLLUP_DIR: the agent still works, just without rollups
+        print(f"⚠️ Could not refresh rollups of {db_uri}: {e}")
+        return []
+
+def get_sql_agent(db_uri: str):
+    return get_sql_entry(db_uri)[2]
+
+def get_sql_entry(db_uri: str):
+    """Return (fingerprint, db, agent, executor, snapshot) for `db_uri`, (re)building it when the DB file is new or changed."""
+    fingerprint = db_file_fingerprint(db_uri)
+    with _agents_lock:
+        cached = _agents.get(db_uri)
+    if cached is not None and cached[0] == fingerprint:
+        return cached
+    # Only requests for this same DB wait on the build; other DBs keep being served
+    with _agent_builds.hold(db_uri):
+        with _agents_lock:
+            cached = _agents.get(db_uri)
+        if cached is not None and cached[0] == fingerprint:
+            return cached
+        # New or changed file: bring its rollup sidecar up to date before the schema is cached
+        refresh_rollups(db_uri)
+        entry = (fingerprint, *build_sql_agent(db_uri, fingerprint))
+        with _agents_lock:
+            _agents[db_uri] = entry
+            _prune_agents(keep=db_uri)
+        return entry
+
+def _prune_agents(keep: str):
+    # Drop connections no live session points at any more
+    in_use = sessions.referenced("db_uri") | {DEFAULT_DB_URI, keep}
+    for uri in [u for u in _agents if u not in in_use]:
+        del _agents[uri]
+
+def session_agent(session_id: str = DEFAULT_SESSION_ID):
+    return get_sql_agent(get_db_uri(session_id))
+
+def is_registered_db(db_uri: str) -> bool:
+    """True for the default DB and DBs a session switched to with /update-sql."""
+    with _agents_lock:
+        loaded = db_uri in _agents
+    return db_uri == DEFAULT_DB_URI or loaded or db_uri in sessions.referenced("db_uri")
+
+def get_db_uri(session_id: str = DEFAULT_SESSION_ID) -> str:
+    return sessions.get(session_id).db_uri or DEFAULT_DB_URI
 
 # === SQL Agent Query Handler ===
-def query_sql_data(question: str):
+def fast_answer(question, session_id: str = DEFAULT_SESSION_ID) -> Optional[str]:
+    """Answer template-shaped aggregate questions with one SQL statement (None: needs the agent)."""
+    from app.intent_router import answer_from_sql, latest_question
+
+    _, _, _, executor, snapshot = get_sql_entry(get_db_uri(session_id))
+    return answer_from_sql(latest_question(question), executor, snapshot)
+
+def query_sql_data(question: str, session_id: str = DEFAULT_SESSION_ID, use_fast_path: bool = True):
     print("\n[User Query]:", question)
-    response = sql_agent.run(question)
+    response = fast_answer(question, session_id) if use_fast_path else None
+    if response is None:
+        agent = session_agent(session_id)
+        with agent_run():
+            response = agent.run(question, callbacks=callbacks())
     print("[SQL Agent Response]:", response)
     return response
 
+async def aquery_sql_data(question: str, session_id: str = DEFAULT_SESSION_ID, use_fast_path: bool = True):
+    print("\n[User Query]:", question)
+    # Fingerprinting, rollup refreshes and agent builds block: keep them off the event loop
+    response = await run_in_threadpool(fast_answer, question, session_id) if use_fast_path else None
+    if response is None:
+        agent = await run_in_threadpool(session_agent, session_id)
+        with agent_run():
+            response = await agent.arun(question, callbacks=callbacks())
+    print("[SQL Agent Response]:", response)
+    return response
+
+async def astream_sql_data(question, session_id: str = DEFAULT_SESSION_ID, use_fast_path: bool = True):
+    """Yield agent steps (incl. generated SQL) and answer tokens as they are produced."""
+    print("\n[User Query]:", question)
+    response = await run_in_threadpool(fast_answer, question, session_id) if use_fast_path else None
+    if response is not None:
+        yield {"type": "final", "response": response}
+        return
+    agent = await run_in_threadpool(session_agent, session_id)
+    async for event in stream_agent_events(agent, {"input": question}):
+        yield event
+
 # === Replace DB dynamically ===
-def update_sql_database(new_db_uri: str):
-    global db, sql_agent
+def update_sql_database(new_db_uri: str, session_id: str = DEFAULT_SESSION_ID):
     if not new_db_uri.startswith("sqlite:///"):
         raise ValueError("Only sqlite:/// URIs are supported in this example.")
 
     print(f"🔄 Switching to new DB: {new_db_uri}")
-    db = SQLDatabase.from_uri(new_db_uri)
-
-    sql_agent = create_sql_agent(
-        llm=llm,
-        toolkit=SQLDatabaseToolkit(db=db, llm=llm),
-        verbose=True,
-        agent_type=AgentType.OPENAI_FUNCTIONS
-    )
+    get_sql_agent(new_db_uri)
+    sessions.get(session_id).db_uri = new_db_uri
+
+def warmup():
+    """Open the default DB and build its agent ahead of the first question."""
+    get_sql_agent(DEFAULT_DB_URI)
 
 # === Optional: Direct Test ===
 # def main():
@@ -0,0 +1,183 @@
+import os
+import re
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, List, Optional, Tuple
+from urllib.parse import quote
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+from langchain_community.tools.sql_database.tool import QuerySQLDatabaseTool
+from langchain_community.utilities.sql_database import truncate_word
+from app.index_advisor import workload_log, explain_query_plan
+from app.rollups import ROLLUP_SCHEMA, sidecar_path, readonly_uri
+from app.tracing import observe_stage
+from app.config import (
+    SQL_QUERY_TIMEOUT_SECONDS,
+    SQL_MAX_RESULT_ROWS,
+    SQL_MAX_RESULT_BYTES,
+    SQL_RESULT_CACHE_ENTRIES,
+    SQLITE_MMAP_BYTES,
+    SQLITE_CACHE_KIB,
+)
+
+# Same per-value truncation SQLDatabase.run applies
+MAX_STRING_LENGTH = 300
+# The progress handler fires every N SQLite VM instructions to check the deadline
+PROGRESS_HANDLER_STEPS = 10_000
+FETCH_BATCH_ROWS = 500
+
+
+def connect_readonly(db_path: str) -> sqlite3.Connection:
+    """
+    Open a SQLite file read-only + immutable with mmap / page-cache pragmas applied.
+    Its rollup sidecar, if built, is attached read-only: rollup tables resolve by name.
+    """
+    uri = f"file:{quote(os.path.abspath(db_path))}?mode=ro&immutable=1"
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    rollups = sidecar_path(db_path)
+    if os.path.exists(rollups):
+        conn.execute(f"ATTACH DATABASE ? AS {ROLLUP_SCHEMA}", (readonly_uri(rollups),))
+    conn.execute(f"PRAGMA mmap_size = {int(SQLITE_MMAP_BYTES)}")
+    conn.execute(f"PRAGMA cache_size = -{int(SQLITE_CACHE_KIB)}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA query_only = 1")
+    return conn
+
+
+def normalize_sql(sql: str) -> str:
+    return re.sub(r"\s+", " ", sql.strip().rstrip(";")).strip()
+
+
+@dataclass
+class QueryResult:
+    columns: List[str]
+    rows: List[Tuple[Any, ...]]
+    truncated: bool
+    elapsed: float
+    cached: bool = False
+
+
+class QueryTimeoutError(Exception):
+    pass
+
+
+# Results of identical SQL text, per DB file fingerprint (shared by all executors)
+_result_cache: "OrderedDict[Tuple[str, str], QueryResult]" = OrderedDict()
+_result_cache_lock = threading.Lock()
+
+
+class SQLiteExecutor:
+    """
+    Guarded execution layer for one version of a SQLite file: read-only connections,
+    a per-query deadline, row / byte budgets on results and a result cache keyed by
+    (file fingerprint, SQL text).
+    """
+
+    def __init__(self, db_path: str, fingerprint: str,
+                 timeout_seconds: float = SQL_QUERY_TIMEOUT_SECONDS,
+                 max_rows: int = SQL_MAX_RESULT_ROWS,
+                 max_bytes: int = SQL_MAX_RESULT_BYTES):
+        self.db_path = db_path
+        self.fingerprint = fingerprint
+        self.timeout_seconds = timeout_seconds
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        # The same read-only connections back LangChain's SQLDatabase (schema introspection)
+        self.engine = create_engine(
+            "sqlite://",
+            creator=lambda: connect_readonly(db_path),
+            poolclass=QueuePool,
+            pool_size=4,
+            max_overflow=4,
+        )
+
+    def execute(self, sql: str) -> QueryResult:
+        key = (self.fingerprint, normalize_sql(sql))
+        with _result_cache_lock:
+            cached = _result_cache.get(key)
+            if cached is not None:
+                _result_cache.move_to_end(key)
+                return QueryResult(cached.columns, cached.rows, cached.truncated, 0.0, cached=True)
+
+        result = self._execute(sql)
+
+        with _result_cache_lock:
+            _result_cache[key] = result
+            while len(_result_cache) > SQL_RESULT_CACHE_ENTRIES:
+                _result_cache.popitem(last=False)
+        return result
+
+    def _execute(self, sql: str) -> QueryResult:
+        start = time.monotonic()
+        deadline = start + self.timeout_seconds
+        columns, rows, truncated, status = [], [], False, "error"
+        with self.engine.connect() as sa_conn:
+            raw = sa_conn.connection.dbapi_connection
+            # Returning True from the handler makes SQLite abort the running statement
+            raw.set_progress_handler(lambda: time.monotonic() > deadline, PROGRESS_HANDLER_STEPS)
+            cursor = raw.cursor()
+            try:
+                cursor.execute(sql)
+                columns = [d[0] for d in cursor.description or []]
+                size = 0
+                while not truncated:
+                    batch = cursor.fetchmany(FETCH_BATCH_ROWS)
+                    if not batch:
+                        break
+                    for row in batch:
+                        size += len(repr(row))
+                        if len(rows) >= self.max_rows or size > self.max_bytes:
+                            truncated = True
+                            if not rows:
+                                # A first row over the byte budget is kept with its values shortened
+                                rows.append(tuple(truncate_word(v, length=MAX_STRING_LENGTH) for v in row))
+                            break
+                        rows.append(row)
+                status = "ok"
+            except sqlite3.OperationalError as e:
+                if time.monotonic() > deadline:
+                    status = "timeout"
+                    raise QueryTimeoutError(
+                        f"query exceeded the {self.timeout_seconds}s time limit and was cancelled"
+                    ) from e
+                raise
+            finally:
+                elapsed = time.monotonic() - start
+                observe_stage("sql", elapsed)
+                cursor.close()
+                raw.set_progress_handler(None, 0)
+                # Workload log for the index advisor: statement, runtime and plan
+                workload_log.record(self.db_path, sql, elapsed, len(rows), status, explain_query_plan(raw, sql))
+        return QueryResult(columns, rows, truncated, elapsed)
+
+    def run(self, sql: str) -> str:
+        """Execute `sql` and format the result the way SQLDatabase.run does, or return an error string."""
+        try:
+            result = self.execute(sql)
+        except QueryTimeoutError as e:
+            return f"Error: {e}. Write a more selective query (filters, aggregates, LIMIT)."
+        except Exception as e:
+            return f"Error: {e}"
+
+        if not result.rows:
+            return "[Result truncated: no rows fit the size limit.]" if result.truncated else ""
+        text = str([
+            tuple(truncate_word(v, length=MAX_STRING_LENGTH) for v in row) for row in result.rows
+        ])
+        if result.truncated:
+            text += (
+                f"\n[Result truncated to the first {len(result.rows)} rows. "
+                "Aggregate or add a LIMIT / WHERE clause to see specific rows.]"
+            )
+        return text
+
+
+class GuardedQuerySQLDatabaseTool(QuerySQLDatabaseTool):
+    """sql_db_query that goes through a SQLiteExecutor instead of SQLDatabase.run."""
+    executor: Any = None
+
+    def _run(self, query: str, run_manager: Optional[Any] = None) -> str:
+        return self.executor.run(query)
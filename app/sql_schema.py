@@ -0,0 +1,200 @@
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import text
+from langchain_core.messages import AIMessage, SystemMessage
+from langchain_core.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, MessagesPlaceholder
+from langchain_community.agent_toolkits.sql.prompt import SQL_PREFIX
+from langchain_community.agent_toolkits.sql.toolkit import SQLDatabaseToolkit
+from langchain_community.tools.sql_database.tool import InfoSQLDatabaseTool, ListSQLDatabaseTool, QuerySQLDatabaseTool
+from app.config import ROLLUP_MEASURES
+from app.rollups import ROLLUP_PREFIX, ROLLUP_SCHEMA, describe_rollups
+
+# === Constants ===
+# Above this size only table/column names go into the prompt; details are served by the cached schema tool
+MAX_SCHEMA_PROMPT_CHARS = 12_000
+# Columns with at most this many distinct values get their value list (with counts) in the stats
+TOP_VALUES_MAX_DISTINCT = 12
+MAX_RANGE_VALUE_CHARS = 32
+
+
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+@dataclass
+class SchemaSnapshot:
+    """Precomputed schema, sample rows and column statistics of one SQLite file version."""
+    db_path: str
+    mtime_ns: int
+    tables: List[str]
+    table_info: Dict[str, str] = field(default_factory=dict)
+    columns: Dict[str, List[str]] = field(default_factory=dict)
+    # Sidecar rollup tables: described in one line by describe_rollups, never inlined with the schema
+    rollups: List[str] = field(default_factory=list)
+
+    def info_for(self, table_names: List[str]) -> str:
+        unknown = [t for t in table_names if t not in self.table_info]
+        if unknown:
+            return f"Error: table_names {set(unknown)} not found in database"
+        return "\n\n".join(self.table_info[t] for t in table_names)
+
+    def full_text(self) -> str:
+        return self.info_for(self.tables)
+
+    @property
+    def fits_prompt(self) -> bool:
+        return len(self.full_text()) <= MAX_SCHEMA_PROMPT_CHARS
+
+    def prompt_text(self) -> str:
+        if self.fits_prompt:
+            return self.full_text()
+        return "\n".join(
+            f"{table}({', '.join(self.columns[table])})" for table in self.tables
+        )
+
+
+_snapshots: Dict[Tuple[str, int], SchemaSnapshot] = {}
+_snapshots_lock = threading.Lock()
+
+
+def get_schema_snapshot(db, db_path: str) -> SchemaSnapshot:
+    """Return the cached snapshot for (db_path, mtime), introspecting the DB only on a miss."""
+    key = (os.path.abspath(db_path), os.stat(db_path).st_mtime_ns)
+    with _snapshots_lock:
+        snapshot = _snapshots.get(key)
+        if snapshot is None:
+            # Older versions of the same file are never needed again
+            for stale in [k for k in _snapshots if k[0] == key[0]]:
+                del _snapshots[stale]
+            snapshot = _snapshots[key] = build_schema_snapshot(db, *key)
+        return snapshot
+
+
+def attached_rollup_tables(db) -> Dict[str, Tuple[str, List[str]]]:
+    """Rollup tables of the attached sidecar file: name -> (CREATE statement, columns)."""
+    with db._engine.connect() as conn:
+        if ROLLUP_SCHEMA not in [r[1] for r in conn.execute(text("PRAGMA database_list"))]:
+            return {}
+        rows = conn.execute(text(
+            f"SELECT name, sql FROM {ROLLUP_SCHEMA}.sqlite_master WHERE type = 'table' AND name LIKE :prefix"
+        ), {"prefix": f"{ROLLUP_PREFIX}%"}).fetchall()
+        return {
+            name: (sql, [r[1] for r in conn.execute(text(f"PRAGMA {ROLLUP_SCHEMA}.table_info({quote_identifier(name)})"))])
+            for name, sql in rows
+        }
+
+
+def build_schema_snapshot(db, db_path: str, mtime_ns: int) -> SchemaSnapshot:
+    # Tables starting with "_" are bookkeeping (e.g. the ingestion log) and are hidden from the agent
+    tables = sorted(t for t in db.get_usable_table_names() if not t.startswith("_"))
+    # The inspector only sees the main database; rollups come from the attached sidecar
+    rollups = {name: info for name, info in attached_rollup_tables(db).items() if name not in tables}
+    snapshot = SchemaSnapshot(db_path=db_path, mtime_ns=mtime_ns, tables=tables, rollups=sorted(rollups))
+    for table in tables:
+        columns = [c["name"] for c in db._inspector.get_columns(table)]
+        snapshot.columns[table] = columns
+        # CREATE TABLE statement + sample rows, exactly as the stock sql_db_schema tool would return
+        info = db.get_table_info_no_throw([table])
+        snapshot.table_info[table] = f"{info}\n{column_statistics(db, table, columns)}"
+    for name, (create_sql, columns) in rollups.items():
+        # Only served by sql_db_schema on request, so no statistics scan
+        snapshot.columns[name] = columns
+        snapshot.table_info[name] = f"\n{create_sql}\n"
+    print(f"📐 Cached schema for {len(tables)} table(s) and {len(rollups)} rollup(s) of {db_path}")
+    return snapshot
+
+
+def column_statistics(db, table: str, columns: List[str]) -> str:
+    """Row count, distinct / null counts, min / max and small value lists for each column."""
+    if not columns:
+        return ""
+    select = ["COUNT(*)"]
+    for col in columns:
+        q = quote_identifier(col)
+        select += [f"COUNT(DISTINCT {q})", f"SUM({q} IS NULL)", f"MIN({q})", f"MAX({q})"]
+
+    with db._engine.connect() as conn:
+        row = conn.execute(text(f"SELECT {', '.join(select)} FROM {quote_identifier(table)}")).fetchone()
+        row_count = row[0]
+        lines = [f"/*\nColumn statistics for {table} ({row_count} rows):"]
+        for i, col in enumerate(columns):
+            distinct, nulls, min_value, max_value = row[1 + 4 * i: 5 + 4 * i]
+            line = f"{col}: {distinct} distinct, {nulls or 0} null"
+            if 0 < distinct <= TOP_VALUES_MAX_DISTINCT:
+                q = quote_identifier(col)
+                values = conn.execute(text(
+                    f"SELECT {q}, COUNT(*) FROM {quote_identifier(table)} "
+                    f"WHERE {q} IS NOT NULL GROUP BY {q} ORDER BY COUNT(*) DESC"
+                )).fetchall()
+                line += "; values: " + ", ".join(f"{v} ({n})" for v, n in values)
+            elif distinct and len(str(min_value)) <= MAX_RANGE_VALUE_CHARS and len(str(max_value)) <= MAX_RANGE_VALUE_CHARS:
+                # Ranges of numbers / dates / codes are useful; ranges of free text are just noise
+                line += f"; min {min_value}, max {max_value}"
+            lines.append(line)
+    lines.append("*/")
+    return "\n".join(lines)
+
+
+# === Agent wiring ===
+class CachedInfoSQLDatabaseTool(InfoSQLDatabaseTool):
+    """sql_db_schema served from the precomputed snapshot (no DB round trips)."""
+    snapshot: Any = None
+
+    def _run(self, table_names: str, run_manager: Optional[Any] = None) -> str:
+        return self.snapshot.info_for([t.strip() for t in table_names.split(",")])
+
+
+class CachedListSQLDatabaseTool(ListSQLDatabaseTool):
+    snapshot: Any = None
+
+    def _run(self, tool_input: str = "", run_manager: Optional[Any] = None) -> str:
+        return ", ".join(self.snapshot.tables + self.snapshot.rollups)
+
+
+class CachedSchemaToolkit(SQLDatabaseToolkit):
+    """
+    SQLDatabaseToolkit whose schema tools answer from a SchemaSnapshot. When the whole
+    schema is already in the prompt, the list/schema tools are dropped altogether.
+    With an `executor`, sql_db_query runs through the guarded SQLite execution layer.
+    """
+    snapshot: Any = None
+    executor: Any = None
+
+    def get_tools(self):
+        from app.sql_executor import GuardedQuerySQLDatabaseTool
+
+        tools = []
+        for tool in super().get_tools():
+            if self.executor is not None and isinstance(tool, QuerySQLDatabaseTool):
+                tool = GuardedQuerySQLDatabaseTool(db=self.db, description=tool.description, executor=self.executor)
+            elif isinstance(tool, (InfoSQLDatabaseTool, ListSQLDatabaseTool)):
+                if self.snapshot.fits_prompt:
+                    continue
+                cached_cls = CachedInfoSQLDatabaseTool if isinstance(tool, InfoSQLDatabaseTool) else CachedListSQLDatabaseTool
+                tool = cached_cls(db=self.db, description=tool.description, snapshot=self.snapshot)
+            tools.append(tool)
+        return tools
+
+
+def build_sql_prompt(snapshot: SchemaSnapshot, dialect: str, top_k: int = 10) -> ChatPromptTemplate:
+    """OPENAI_FUNCTIONS prompt with the schema inlined, so the agent skips the discovery steps."""
+    if snapshot.fits_prompt:
+        schema_intro = "The database schema, sample rows and column statistics are:"
+        ai_prefill = "I already have the schema and sample rows of every table, so I can write the query directly."
+    else:
+        schema_intro = "The database tables and their columns are:"
+        ai_prefill = "I have the tables and columns above. I should query the schema of the most relevant tables only if I need sample rows."
+
+    system = f"{SQL_PREFIX.format(dialect=dialect, top_k=top_k)}\n{schema_intro}\n\n{snapshot.prompt_text()}"
+    rollup_tables = snapshot.rollups + [t for t in snapshot.tables if t.startswith(ROLLUP_PREFIX)]
+    if rollup_tables:
+        measures = [m for m in ROLLUP_MEASURES if any(m in cols for cols in snapshot.columns.values())]
+        system += "\n\n" + describe_rollups(rollup_tables, measures)
+    return ChatPromptTemplate.from_messages([
+        SystemMessage(content=system),
+        HumanMessagePromptTemplate.from_template("{input}"),
+        AIMessage(content=ai_prefill),
+        MessagesPlaceholder(variable_name="agent_scratchpad"),
+    ])
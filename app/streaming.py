@@ -0,0 +1,43 @@
+import json
+from typing import Any, AsyncIterator, Dict
+from app.tracing import agent_run, callbacks
+
+# Tool observations can be whole DataFrame dumps / result sets; only a preview is streamed
+MAX_OBSERVATION_CHARS = 2000
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Format one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+async def stream_agent_events(runnable, inputs: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Run an agent / chain with astream_events and yield simplified events:
+      step        - the agent decided to call a tool (tool name + input)
+      observation - the tool's output (truncated)
+      token       - a chunk of LLM output text as it is generated
+      final       - the complete answer, always emitted last
+    """
+    final = None
+    with agent_run():
+        # Same timing / token callbacks as the non-streaming agent runs
+        async for event in runnable.astream_events(inputs, version="v2", config={"callbacks": callbacks()}):
+            kind = event["event"]
+            if kind == "on_tool_start":
+                yield {"type": "step", "tool": event["name"], "input": event["data"].get("input")}
+            elif kind == "on_tool_end":
+                output = str(event["data"].get("output"))
+                yield {"type": "observation", "tool": event["name"], "output": output[:MAX_OBSERVATION_CHARS]}
+            elif kind == "on_chat_model_stream":
+                text = event["data"]["chunk"].content
+                if text:
+                    yield {"type": "token", "text": text}
+            elif kind == "on_chain_end" and not event.get("parent_ids"):
+                output = event["data"].get("output")
+                if isinstance(output, dict):
+                    output = output.get("output", output.get("result"))
+                final = output
+
+    yield {"type": "final", "response": "" if final is None else str(final)}
+
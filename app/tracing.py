@@ -0,0 +1,239 @@
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+from langchain_core.callbacks import BaseCallbackHandler
+from prometheus_client import Counter, Gauge, Histogram
+
+# === Metrics (exposed on /metrics) ===
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+REQUEST_SECONDS = Histogram(
+    "api_request_seconds", "HTTP request latency (until the last body chunk, so streams count in full)",
+    ["path", "status"], buckets=LATENCY_BUCKETS,
+)
+ANSWERS = Counter("api_answers_total", "Answers by how they were produced", ["kind", "source"])
+STAGE_SECONDS = Histogram(
+    "agent_stage_seconds",
+    "Time per stage: llm, tool, sql, retrieval, queue, agent, fast_path, and load stages (dataset / index / agent builds)",
+    ["kind", "stage"], buckets=LATENCY_BUCKETS,
+)
+TOOL_SECONDS = Histogram("agent_tool_seconds", "Time per agent tool call", ["kind", "tool"], buckets=LATENCY_BUCKETS)
+LLM_TOKENS = Counter("llm_tokens_total", "LLM tokens by type", ["kind", "type"])
+AGENT_ACTIVE = Gauge("agent_active_requests", "Agent runs in progress", ["kind"], multiprocess_mode="livesum")
+AGENT_WAITING = Gauge("agent_waiting_requests", "Requests queued for an agent slot", ["kind"], multiprocess_mode="livesum")
+AGENT_ITERATIONS = Histogram(
+    "agent_iterations", "Tool-calling iterations per agent run", ["kind"], buckets=(0, 1, 2, 3, 4, 5, 7, 10, 15, 20)
+)
+CODE_EXECUTIONS = Counter(
+    "pandas_code_executions_total", "Agent code runs in the process pool by outcome (ok, error, timeout, memory_limit, crashed)",
+    ["outcome"],
+)
+
+# Load stages recorded by app.components.timed (bounded names; "import:*" stays out of the metrics)
+LOAD_STAGES = {
+    "dataset:default": "dataset_load",
+    "dataset:spill": "dataset_load",
+    "large_ingest": "dataset_load",
+    "rollups": "rollups",
+    "pandas_agent": "agent_build",
+    "sql_agent": "agent_build",
+    "large_agent": "agent_build",
+    "sql_rollups": "rollups",
+    "rag_index": "index_load",
+    "corpus_index": "index_load",
+    "corpus_rebuild": "index_build",
+    "llm": "client_build",
+    "embeddings": "client_build",
+}
+
+
+# First path segment -> agent kind, so loads before the agent runs are attributed to it
+PATH_KINDS = {"chat": "chat", "update-df": "chat", "update-df-stream": "chat", "activate-df": "chat",
+              "sql": "sql", "update-sql": "sql",
+              "context": "context", "update-context": "context", "activate-context": "context", "corpus": "context"}
+
+
+class RequestTrace:
+    """Stages, tokens and iterations of one API request (the optional timing breakdown)."""
+
+    def __init__(self, path: str, requested: bool = False):
+        self.path = path
+        self.kind = PATH_KINDS.get(path.strip("/").split("/")[0], "none")
+        self.requested = requested
+        self.start = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+        self.tokens = {"prompt": 0, "completion": 0}
+        self.llm_calls = 0
+        self.iterations = 0
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float, name: Optional[str] = None):
+        with self._lock:
+            self.spans.append({"stage": stage, "name": name, "ms": round(seconds * 1000, 2)})
+
+    def breakdown(self) -> Dict[str, Any]:
+        with self._lock:
+            totals: Dict[str, float] = {}
+            for span in self.spans:
+                totals[span["stage"]] = round(totals.get(span["stage"], 0.0) + span["ms"], 2)
+            return {
+                "total_ms": round((time.perf_counter() - self.start) * 1000, 2),
+                "stages_ms": totals,
+                "spans": list(self.spans),
+                "llm_calls": self.llm_calls,
+                "tokens": dict(self.tokens),
+                "iterations": self.iterations,
+            }
+
+
+_current: ContextVar[Optional[RequestTrace]] = ContextVar("request_trace", default=None)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current.get()
+
+
+def start_trace(path: str, requested: bool = False) -> RequestTrace:
+    trace = RequestTrace(path, requested)
+    _current.set(trace)
+    return trace
+
+
+def set_kind(kind: str):
+    trace = _current.get()
+    if trace is not None:
+        trace.kind = kind
+
+
+def observe_stage(stage: str, seconds: float, name: Optional[str] = None):
+    """Record a stage duration in the metrics and, inside a request, in its trace."""
+    trace = _current.get()
+    STAGE_SECONDS.labels(trace.kind if trace else "none", stage).observe(seconds)
+    if trace is not None:
+        trace.add(stage, seconds, name)
+
+
+def observe_component(component: str, seconds: float):
+    """Called by app.components.timed for every load / build it times."""
+    stage = LOAD_STAGES.get(component)
+    if stage is not None:
+        observe_stage(stage, seconds, component)
+
+
+@contextmanager
+def stage(name: str, label: Optional[str] = None):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - start, label)
+
+
+def count_answer(kind: str, source: str):
+    ANSWERS.labels(kind, source).inc()
+
+
+# === LangChain callbacks ===
+class TracingCallbackHandler(BaseCallbackHandler):
+    """Times LLM calls, tool calls and retrievals of one agent run and counts tokens and iterations."""
+
+    def __init__(self, trace: RequestTrace):
+        self.trace = trace
+        self._starts: Dict[UUID, tuple] = {}
+        self._lock = threading.Lock()
+
+    def _begin(self, run_id: UUID, stage_name: str, name: Optional[str] = None):
+        with self._lock:
+            self._starts[run_id] = (stage_name, name, time.perf_counter())
+
+    def _end(self, run_id: UUID) -> Optional[tuple]:
+        with self._lock:
+            started = self._starts.pop(run_id, None)
+        if started is None:
+            return None
+        stage_name, name, start = started
+        seconds = time.perf_counter() - start
+        STAGE_SECONDS.labels(self.trace.kind, stage_name).observe(seconds)
+        if stage_name == "tool":
+            TOOL_SECONDS.labels(self.trace.kind, name or "unknown").observe(seconds)
+        self.trace.add(stage_name, seconds, name)
+        return stage_name, name, seconds
+
+    # LLM
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs: Any):
+        self._begin(run_id, "llm")
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, **kwargs: Any):
+        self._begin(run_id, "llm")
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs: Any):
+        self._end(run_id)
+        prompt, completion = _token_usage(response)
+        with self._lock:
+            self.trace.llm_calls += 1
+            self.trace.tokens["prompt"] += prompt
+            self.trace.tokens["completion"] += completion
+        if prompt:
+            LLM_TOKENS.labels(self.trace.kind, "prompt").inc(prompt)
+        if completion:
+            LLM_TOKENS.labels(self.trace.kind, "completion").inc(completion)
+
+    def on_llm_error(self, error, *, run_id: UUID, **kwargs: Any):
+        self._end(run_id)
+
+    # Tools
+    def on_tool_start(self, serialized, input_str, *, run_id: UUID, **kwargs: Any):
+        self._begin(run_id, "tool", (serialized or {}).get("name") or kwargs.get("name"))
+
+    def on_tool_end(self, output, *, run_id: UUID, **kwargs: Any):
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id: UUID, **kwargs: Any):
+        self._end(run_id)
+
+    def on_agent_action(self, action, *, run_id: UUID, **kwargs: Any):
+        with self._lock:
+            self.trace.iterations += 1
+
+    # Retrieval
+    def on_retriever_start(self, serialized, query, *, run_id: UUID, **kwargs: Any):
+        self._begin(run_id, "retrieval")
+
+    def on_retriever_end(self, documents, *, run_id: UUID, **kwargs: Any):
+        self._end(run_id)
+
+    def on_retriever_error(self, error, *, run_id: UUID, **kwargs: Any):
+        self._end(run_id)
+
+
+def _token_usage(response) -> tuple:
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if usage:
+        return usage.get("prompt_tokens", 0) or 0, usage.get("completion_tokens", 0) or 0
+    prompt = completion = 0
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+            prompt += metadata.get("input_tokens", 0)
+            completion += metadata.get("output_tokens", 0)
+    return prompt, completion
+
+
+def callbacks() -> List[BaseCallbackHandler]:
+    """Callbacks for an agent run inside the current request ([] outside a request)."""
+    trace = _current.get()
+    return [TracingCallbackHandler(trace)] if trace is not None else []
+
+
+@contextmanager
+def agent_run():
+    """Wrap one agent execution: its total time, and its iteration count once it finishes."""
+    trace = _current.get()
+    before = trace.iterations if trace else 0
+    with stage("agent"):
+        yield
+    if trace is not None:
+        AGENT_ITERATIONS.labels(trace.kind).observe(trace.iterations - before)
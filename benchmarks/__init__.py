@@ -0,0 +1 @@
+"""Offline load tests: fake LLM / embeddings clients, synthetic data scaling and a concurrent load driver."""
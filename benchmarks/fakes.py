@@ -0,0 +1,97 @@
+import json
+import time
+import asyncio
+import hashlib
+from typing import Any, Dict, List, Optional
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, FunctionMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+# === Constants ===
+# Tool round trips the fake model makes before answering, so agents do real work on the data
+PANDAS_PROBE = "df.select_dtypes('number').sum()"
+SQL_PROBE = 'SELECT COUNT(*) FROM "{table}"'
+DUCKDB_PROBE = "SELECT COUNT(*) AS row_count FROM data"
+CHARS_PER_TOKEN = 4
+
+
+class BenchmarkChatModel(BaseChatModel):
+    """
+    Deterministic stand-in for ChatOpenAI. Each call sleeps `latency_ms` plus
+    `ms_per_1k_prompt_tokens` for the prompt size (so history compaction shows up
+    in the numbers). With `use_tools`, the pandas agent runs one python probe (a row
+    count for out-of-core datasets) and the SQL agent lists tables and counts rows,
+    before the final answer.
+    """
+    latency_ms: float = 300.0
+    ms_per_1k_prompt_tokens: float = 20.0
+    use_tools: bool = True
+
+    @property
+    def _llm_type(self) -> str:
+        return "benchmark-fake"
+
+    def _delay(self, messages: List[BaseMessage]) -> float:
+        prompt_tokens = sum(len(str(m.content)) for m in messages) / CHARS_PER_TOKEN
+        return (self.latency_ms + self.ms_per_1k_prompt_tokens * prompt_tokens / 1000) / 1000
+
+    def _reply(self, messages: List[BaseMessage], functions: Optional[List[Dict[str, Any]]]) -> AIMessage:
+        names = {f["name"] for f in functions or []}
+        results = [m for m in messages if isinstance(m, (FunctionMessage, ToolMessage))]
+        called = {getattr(m, "name", None) for m in results}
+
+        if self.use_tools:
+            if "python_repl_ast" in names and "python_repl_ast" not in called:
+                return _function_call("python_repl_ast", {"query": PANDAS_PROBE})
+            if "duckdb_query" in names and "duckdb_query" not in called:
+                return _function_call("duckdb_query", {"query": DUCKDB_PROBE})
+            if "sql_db_list_tables" in names and "sql_db_list_tables" not in called:
+                return _function_call("sql_db_list_tables", {"tool_input": ""})
+            if "sql_db_query" in names and "sql_db_query" not in called:
+                tables = next((str(m.content) for m in results if m.name == "sql_db_list_tables"), "")
+                table = tables.split(",")[0].strip()
+                if table:
+                    return _function_call("sql_db_query", {"query": SQL_PROBE.format(table=table)})
+
+        last = str(results[-1].content)[:200] if results else ""
+        digest = hashlib.md5(str(messages[-1].content).encode()).hexdigest()[:8]
+        return AIMessage(content=f"Benchmark answer {digest} after {len(results)} tool call(s). {last}".strip())
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self._delay(messages))
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages, kwargs.get("functions")))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self._delay(messages))
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages, kwargs.get("functions")))])
+
+
+def _function_call(name: str, arguments: Dict[str, Any]) -> AIMessage:
+    return AIMessage(content="", additional_kwargs={"function_call": {"name": name, "arguments": json.dumps(arguments)}})
+
+
+class BenchmarkEmbeddings(DeterministicFakeEmbedding):
+    """Deterministic stand-in for OpenAIEmbeddings: `latency_ms` per API call plus `ms_per_text` per input."""
+    latency_ms: float = 50.0
+    ms_per_text: float = 1.0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep((self.latency_ms + self.ms_per_text * len(texts)) / 1000)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep((self.latency_ms + self.ms_per_text) / 1000)
+        return super().embed_query(text)
+
+
+def install(llm_latency_ms: float = 300.0, embedding_latency_ms: float = 50.0, use_tools: bool = True,
+            embedding_size: int = 1536):
+    """Swap the app's shared ChatOpenAI / OpenAIEmbeddings clients for the fakes (before any agent is built)."""
+    from app.components import use_clients
+
+    use_clients(
+        llm=BenchmarkChatModel(latency_ms=llm_latency_ms, use_tools=use_tools),
+        embeddings=BenchmarkEmbeddings(size=embedding_size, latency_ms=embedding_latency_ms),
+    )
+    print(f"🧪 Fake LLM ({llm_latency_ms:.0f} ms) and embeddings ({embedding_latency_ms:.0f} ms) installed")
@@ -0,0 +1,309 @@
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import resource
+import subprocess
+import numpy as np
+import pandas as pd
+from typing import Any, Callable, Dict, List, Optional
+
+# === Constants ===
+TOKEN_REFRESH_SECONDS = 300  # tokens are valid for 360 s
+SERVER_START_TIMEOUT = 120
+REGRESSION_THRESHOLD = 0.10  # flag p95 / throughput changes beyond 10% against a baseline
+SCENARIOS = ("chat", "sql", "context", "update-df", "update-df-stream", "update-context", "update-sql")
+
+# Agent-shaped questions (deliberately not fast-path templates); a per-request suffix defeats the answer cache
+CHAT_QUESTIONS = [
+    "Which product category has the best profit margin, and why might that be?",
+    "Summarize how sales evolved over the months in the data.",
+    "Compare the customer segments by average order value.",
+]
+SQL_QUESTIONS = [
+    "How many orders are there per customer segment?",
+    "Which month had the highest total profit?",
+    "What share of orders made a loss?",
+]
+CONTEXT_QUESTIONS = [
+    "What does the Profit (USD) column mean?",
+    "Which columns describe the customer?",
+    "How is the Review column populated?",
+]
+
+
+# === Server ===
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port: int, llm_latency_ms: float, embedding_latency_ms: float, keep_state: bool = False) -> subprocess.Popen:
+    """`python -m benchmarks.serve` in a child process, so its memory is measured on its own."""
+    command = [sys.executable, "-m", "benchmarks.serve", "--port", str(port),
+               "--llm-latency-ms", str(llm_latency_ms), "--embedding-latency-ms", str(embedding_latency_ms)]
+    return subprocess.Popen(command + (["--keep-state"] if keep_state else []), stdout=subprocess.DEVNULL)
+
+
+def process_memory_mb(pid: int) -> Dict[str, Optional[float]]:
+    """Current (VmRSS) and peak (VmHWM) resident memory of `pid` from /proc (Linux)."""
+    memory = {"rss_mb": None, "peak_rss_mb": None}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    key = "rss_mb" if line.startswith("VmRSS") else "peak_rss_mb"
+                    memory[key] = round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return memory
+
+
+def children_peak_rss_mb() -> float:
+    # Fallback once the server exited; ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+# === Client ===
+class BenchClient:
+    """httpx client with a bearer token that is refreshed before it expires."""
+
+    def __init__(self, base_url: str, concurrency: int):
+        import httpx
+
+        self.http = httpx.AsyncClient(
+            base_url=base_url, timeout=httpx.Timeout(600.0),
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+        )
+        self._token = None
+        self._token_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def token(self) -> str:
+        from app.config import SECRET_ID, SECRET_KEY
+
+        async with self._lock:
+            if self._token is None or time.time() - self._token_at > TOKEN_REFRESH_SECONDS:
+                r = await self.http.post("/auth/token", json={"secret_id": SECRET_ID, "secret_key": SECRET_KEY})
+                r.raise_for_status()
+                self._token, self._token_at = r.json()["access_token"], time.time()
+            return self._token
+
+    async def request(self, method: str, path: str, session: str, **kwargs):
+        headers = {"Authorization": f"Bearer {await self.token()}", "X-Session-ID": session, **kwargs.pop("headers", {})}
+        return await self.http.request(method, path, headers=headers, **kwargs)
+
+    async def wait_ready(self, server: Optional[subprocess.Popen] = None, timeout: float = SERVER_START_TIMEOUT):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if server is not None and server.poll() is not None:
+                raise RuntimeError(f"Benchmark server exited with code {server.returncode}")
+            try:
+                await self.token()
+                return
+            except Exception:
+                await asyncio.sleep(0.5)
+        raise RuntimeError(f"Server not ready after {timeout:.0f}s")
+
+
+# === Scenarios ===
+def build_requests(args, sample: Optional[pd.DataFrame], context_text: str) -> Dict[str, Callable[[int], Dict[str, Any]]]:
+    """Scenario -> function(i) returning the i-th request (method, path, kwargs)."""
+    def suffix(i):
+        return "" if args.repeat else f" (request {i})"
+
+    def chat(path, questions):
+        return lambda i: {"method": "POST", "path": path, "json": {
+            "messages": [{"role": "user", "content": questions[i % len(questions)] + suffix(i)}]
+        }}
+
+    def frame(i) -> pd.DataFrame:
+        # A different slice per request, so content hashing cannot short-circuit the load
+        return sample.sample(n=args.update_rows, replace=len(sample) < args.update_rows, random_state=i)
+
+    return {
+        "chat": chat("/chat", CHAT_QUESTIONS),
+        "sql": chat("/sql", SQL_QUESTIONS),
+        "context": chat("/context", CONTEXT_QUESTIONS),
+        "update-df": lambda i: {"method": "POST", "path": "/update-df", "json": {
+            "data": frame(i).to_json(orient="split")
+        }},
+        "update-df-stream": lambda i: {"method": "POST", "path": "/update-df-stream", "params": {"format": "csv"},
+                                       "content": frame(i).to_csv(index=False).encode()},
+        "update-context": lambda i: {"method": "POST", "path": "/update-context", "json": {
+            "text": context_text + f"\n\nRevision {i}"
+        }},
+        "update-sql": lambda i: {"method": "POST", "path": "/update-sql", "json": {"db_uri": args.db_uri}},
+    }
+
+
+async def run_scenario(client: BenchClient, name: str, make_request, total: int, concurrency: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    queue: asyncio.Queue = asyncio.Queue()
+    for i in range(total):
+        queue.put_nowait(i)
+
+    async def worker(w: int):
+        session = f"bench-{name}-{w}"
+        while True:
+            try:
+                i = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            spec = make_request(i)
+            start = time.perf_counter()
+            try:
+                r = await client.request(spec.pop("method"), spec.pop("path"), session, **spec)
+                status = str(r.status_code) if r.status_code >= 400 else None
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append((time.perf_counter() - start) * 1000)
+            if status:
+                errors[status] = errors.get(status, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(w) for w in range(concurrency)))
+    wall = time.perf_counter() - start
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if latencies else (0, 0, 0)
+    return {
+        "scenario": name,
+        "requests": total,
+        "concurrency": concurrency,
+        "errors": sum(errors.values()),
+        "error_codes": errors,
+        "throughput_rps": round(total / wall, 2) if wall else 0.0,
+        "p50_ms": round(float(p50), 1),
+        "p95_ms": round(float(p95), 1),
+        "p99_ms": round(float(p99), 1),
+        "wall_seconds": round(wall, 2),
+    }
+
+
+async def file_chunks(path: str, chunk_size: int = 1 << 20):
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
+async def setup(client: BenchClient, args, context_text: str, sessions: List[str]):
+    """Point every benchmark session at the scaled dataset / DB / context before measuring."""
+    dataset_id = None
+    if args.csv:
+        # Upload (and parse) once, then switch the other sessions to the cached dataset by id
+        r = await client.request("POST", "/update-df-stream", sessions[0], params={"format": "csv"}, content=file_chunks(args.csv))
+        r.raise_for_status()
+        dataset_id = r.json()["dataset_id"]
+    for session in sessions:
+        if dataset_id:
+            (await client.request("POST", "/activate-df", session, json={"dataset_id": dataset_id})).raise_for_status()
+        if args.db_uri:
+            (await client.request("POST", "/update-sql", session, json={"db_uri": args.db_uri})).raise_for_status()
+        (await client.request("POST", "/update-context", session, json={"text": context_text})).raise_for_status()
+
+
+# === Reporting ===
+def print_report(results: List[Dict[str, Any]], memory: Dict[str, Any]):
+    from tabulate import tabulate
+
+    columns = ["scenario", "requests", "concurrency", "errors", "throughput_rps", "p50_ms", "p95_ms", "p99_ms", "rss_mb"]
+    print(tabulate([[r.get(c) for c in columns] for r in results], headers=columns))
+    print(f"\n🧠 Server peak RSS: {memory.get('peak_rss_mb')} MB")
+
+
+def compare(results: List[Dict[str, Any]], baseline_path: str) -> List[str]:
+    """Scenarios whose p95 grew, or throughput dropped, by more than REGRESSION_THRESHOLD."""
+    with open(baseline_path) as f:
+        baseline = {r["scenario"]: r for r in json.load(f)["results"]}
+    regressions = []
+    for r in results:
+        base = baseline.get(r["scenario"])
+        if not base:
+            continue
+        if base["p95_ms"] and r["p95_ms"] > base["p95_ms"] * (1 + REGRESSION_THRESHOLD):
+            regressions.append(f"{r['scenario']}: p95 {base['p95_ms']} -> {r['p95_ms']} ms")
+        if base["throughput_rps"] and r["throughput_rps"] < base["throughput_rps"] * (1 - REGRESSION_THRESHOLD):
+            regressions.append(f"{r['scenario']}: throughput {base['throughput_rps']} -> {r['throughput_rps']} rps")
+    return regressions
+
+
+async def run(args) -> int:
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        port = free_port()
+        server = start_server(port, args.llm_latency_ms, args.embedding_latency_ms, args.keep_state)
+        base_url = f"http://127.0.0.1:{port}"
+
+    with open(args.context_file, encoding="utf-8") as f:
+        context_text = f.read()
+    sample = pd.read_csv(args.update_source, nrows=max(args.update_rows * 10, 1000)) \
+        if {"update-df", "update-df-stream"} & set(args.scenarios) else None
+    requests = build_requests(args, sample, context_text)
+
+    client = BenchClient(base_url, args.concurrency)
+    results = []
+    try:
+        await client.wait_ready(server)
+        await setup(client, args, context_text, [f"bench-{name}-{w}" for name in args.scenarios for w in range(args.concurrency)])
+        for name in args.scenarios:
+            result = await run_scenario(client, name, requests[name], args.requests, args.concurrency)
+            if server:
+                result["rss_mb"] = process_memory_mb(server.pid)["rss_mb"]
+            results.append(result)
+            print(f"⏱️ {name}: p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, {result['throughput_rps']} rps")
+    finally:
+        await client.http.aclose()
+        memory = process_memory_mb(server.pid) if server else {}
+        if server:
+            server.terminate()
+            server.wait()
+            memory["peak_rss_mb"] = memory.get("peak_rss_mb") or children_peak_rss_mb()
+
+    print_report(results, memory)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"args": {k: v for k, v in vars(args).items()}, "memory": memory, "results": results}, f, indent=2)
+        print(f"💾 Results written to {args.output}")
+    if args.baseline:
+        regressions = compare(results, args.baseline)
+        for line in regressions:
+            print(f"❌ Regression: {line}")
+        if regressions and args.fail_on_regression:
+            return 1
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Drive the API at a given concurrency and report p50/p95/p99 latency, throughput and peak RSS."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--base-url", help="benchmark a running server (default: start one with fake LLM / embeddings)")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=["chat", "sql", "context"])
+    parser.add_argument("--requests", type=int, default=100, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--csv", help="dataset uploaded before the run (e.g. a file from benchmarks.scale_data)")
+    parser.add_argument("--db", help="SQLite file the SQL scenarios use (e.g. from benchmarks.scale_data --sqlite)")
+    parser.add_argument("--context-file", default="data/retail_transactions_description.txt")
+    parser.add_argument("--update-source", default="data/retail_transactions_dataset.csv", help="rows for the update scenarios")
+    parser.add_argument("--update-rows", type=int, default=1000, help="rows per update request")
+    parser.add_argument("--repeat", action="store_true", help="repeat identical questions (measures answer cache hits)")
+    parser.add_argument("--keep-state", action="store_true", help="reuse the spawned server's caches from earlier runs")
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0)
+    parser.add_argument("--embedding-latency-ms", type=float, default=50.0)
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args(argv)
+    args.db_uri = f"sqlite:///{os.path.abspath(args.db)}" if args.db else None
+    if "update-sql" in args.scenarios and not args.db_uri:
+        parser.error("--db is required for the update-sql scenario")
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
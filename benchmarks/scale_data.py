@@ -0,0 +1,106 @@
+import os
+import re
+import argparse
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional
+
+# === Constants ===
+OUTPUT_DIR = os.path.join("data", "bench")
+CHUNK_ROWS = 500_000  # rows generated (and held in memory) at a time
+
+# Source CSV, id column (renumbered so rows stay unique) and numeric columns jittered by +-JITTER
+DATASETS: Dict[str, Dict] = {
+    "retail": {
+        "path": "data/retail_transactions_dataset.csv",
+        "id_column": "Order ID",
+        "id_format": "ORD-{}",
+        "jitter": ["Sales (USD)", "Profit (USD)"],
+    },
+    "birthday": {
+        "path": "data/birthday_dataset.csv",
+        "id_column": "ID",
+        "id_format": None,
+        "jitter": [],
+    },
+}
+JITTER = 0.1
+
+
+def parse_rows(value: str) -> int:
+    """'1m' -> 1000000, '50M' -> 50000000, '250k' -> 250000"""
+    m = re.fullmatch(r"(\d+(?:\.\d+)?)([kKmM]?)", value.strip())
+    if not m:
+        raise argparse.ArgumentTypeError(f"Invalid row count '{value}'")
+    scale = {"": 1, "k": 1_000, "m": 1_000_000}[m.group(2).lower()]
+    return int(float(m.group(1)) * scale)
+
+
+def rows_label(rows: int) -> str:
+    if rows % 1_000_000 == 0:
+        return f"{rows // 1_000_000}m"
+    if rows % 1_000 == 0:
+        return f"{rows // 1_000}k"
+    return str(rows)
+
+
+def scaled_path(name: str, rows: int, output_dir: str = OUTPUT_DIR) -> str:
+    # "<stem>_dataset.csv" keeps app.convert_to_sqlite_db's table naming: retail_transactions_1m
+    stem = re.sub(r"_dataset$", "", os.path.splitext(os.path.basename(DATASETS[name]["path"]))[0])
+    return os.path.join(output_dir, f"{stem}_{rows_label(rows)}_dataset.csv")
+
+
+def scale_dataset(name: str, rows: int, output_dir: str = OUTPUT_DIR, seed: int = 42,
+                  chunk_rows: int = CHUNK_ROWS) -> str:
+    """
+    Write a `rows`-row synthetic version of a bundled dataset: source rows are sampled
+    with replacement chunk by chunk (memory stays bounded at any size), ids are
+    renumbered and measures jittered so aggregates are not trivially repeated.
+    """
+    spec = DATASETS[name]
+    source = pd.read_csv(spec["path"])
+    rng = np.random.default_rng(seed)
+    os.makedirs(output_dir, exist_ok=True)
+    path = scaled_path(name, rows, output_dir)
+    tmp_path = f"{path}.tmp"
+
+    written = 0
+    with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+        while written < rows:
+            n = min(chunk_rows, rows - written)
+            chunk = source.iloc[rng.integers(0, len(source), size=n)].reset_index(drop=True)
+            ids = np.arange(written + 1, written + n + 1)
+            chunk[spec["id_column"]] = [spec["id_format"].format(i) for i in ids] if spec["id_format"] else ids
+            for column in spec["jitter"]:
+                values = chunk[column] * rng.uniform(1 - JITTER, 1 + JITTER, size=n)
+                chunk[column] = values.round().astype(source[column].dtype) if pd.api.types.is_integer_dtype(source[column]) else values.round(2)
+            chunk.to_csv(f, header=written == 0, index=False)
+            written += n
+            print(f"📝 {name}: {written:,}/{rows:,} rows")
+    os.replace(tmp_path, path)
+    return path
+
+
+def main(argv: Optional[List[str]] = None):
+    """Scale the bundled datasets to benchmark sizes (CSV, optionally also SQLite)."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--rows", type=parse_rows, nargs="+", default=[1_000_000], help="e.g. 1m 10m 50m")
+    parser.add_argument("--dataset", choices=[*DATASETS, "all"], default="all")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--sqlite", action="store_true", help="also ingest each CSV into <name>_data.db")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    names = list(DATASETS) if args.dataset == "all" else [args.dataset]
+    for rows in args.rows:
+        for name in names:
+            path = scale_dataset(name, rows, args.output_dir, seed=args.seed)
+            print(f"✅ {path}")
+            if args.sqlite:
+                from app.convert_to_sqlite_db import ingest_csv
+
+                ingest_csv(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import os
+import shutil
+import argparse
+
+# Everything the fakes produce (answers, vectors, indexes, logs) stays out of the real caches
+BENCH_STATE_DIR = os.path.join("data", "bench", "state")
+BENCH_PATHS = {
+    "ANSWER_CACHE_PATH": "answer_cache.db",
+    "EMBEDDING_CACHE_PATH": "embedding_cache.db",
+    "RAG_INDEX_DIR": "embeddings",
+    "CORPUS_DIR": "corpus",
+    "SQL_WORKLOAD_LOG_PATH": "sql_workload.db",
+    "DATASET_SPILL_DIR": "df_cache",
+    "SESSION_STORE_PATH": "sessions.db",
+    "LARGE_DATASET_DIR": "large",
+    "PANDAS_SHARED_DIR": "df_shared",
+    "SQL_ROLLUP_DIR": "rollups",
+    "SQL_DEFAULT_DB_PATH": "retail_transactions_data.db",
+}
+# Served from a copy, so index advice applied during a run never touches the tracked DB
+DEFAULT_DB_SOURCE = os.path.join("data", "retail_transactions_data.db")
+
+
+def main():
+    """Run the API with the fake LLM / embeddings clients (no OpenAI calls, no credits)."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0)
+    parser.add_argument("--embedding-latency-ms", type=float, default=50.0)
+    parser.add_argument("--no-tools", action="store_true", help="answer immediately instead of running one tool round trip")
+    parser.add_argument("--keep-state", action="store_true", help="keep caches of earlier benchmark runs (warm-cache numbers)")
+    args = parser.parse_args()
+
+    # Before app.config is imported; a fresh state per run keeps runs comparable
+    if not args.keep_state:
+        shutil.rmtree(BENCH_STATE_DIR, ignore_errors=True)
+    os.makedirs(BENCH_STATE_DIR, exist_ok=True)
+    for key, name in BENCH_PATHS.items():
+        os.environ.setdefault(key, os.path.join(BENCH_STATE_DIR, name))
+    default_db = os.environ["SQL_DEFAULT_DB_PATH"]
+    if not os.path.exists(default_db):
+        shutil.copy2(DEFAULT_DB_SOURCE, default_db)
+
+    from benchmarks.fakes import install
+
+    install(args.llm_latency_ms, args.embedding_latency_ms, use_tools=not args.no_tools)
+
+    import uvicorn
+    from app.main import app
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+from app.answer_cache import AnswerCache
+from app.history import compact
+
+
+def _conversation(first_question):
+    messages = [{"role": "user", "content": first_question}, {"role": "assistant", "content": "Done."}]
+    for i in range(4):
+        messages += [{"role": "user", "content": f"And for region {i}?"}, {"role": "assistant", "content": f"Answer {i}."}]
+    return messages + [{"role": "user", "content": "What about the total?"}]
+
+
+def test_key_covers_history_the_agent_sees():
+    a = compact(_conversation("Show sales for 2024"))
+    b = compact(_conversation("Show returns for 2025"))
+    assert AnswerCache.make_key("chat", "fp", a.messages) != AnswerCache.make_key("chat", "fp", b.messages)
+
+
+def test_key_ignores_history_dropped_from_the_prompt():
+    a = compact(_conversation("Show sales for 2024"), budget=60, summary_tokens=0)
+    b = compact(_conversation("Show returns for 2025"), budget=60, summary_tokens=0)
+    assert a.dropped_turns and a.messages == b.messages
+    assert AnswerCache.make_key("chat", "fp", a.messages) == AnswerCache.make_key("chat", "fp", b.messages)
@@ -0,0 +1,43 @@
+import os
+import pandas as pd
+import pytest
+from app import code_executor
+
+KEY = "c" * 64
+
+
+@pytest.fixture
+def shared_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(code_executor, "PANDAS_SHARED_DIR", str(tmp_path))
+    monkeypatch.setattr(code_executor, "_published", {})
+    return tmp_path
+
+
+def _frame():
+    return pd.DataFrame({"Year": [2024, 2025], "Sales": [1.5, 2.5]})
+
+
+def test_unpublish_keeps_file_held_by_another_process(shared_dir):
+    path = code_executor.publish(KEY, _frame(), {"by_year": _frame()})
+    # Another live API process (our parent) holds the same key
+    open(os.path.join(code_executor._holders_dir(KEY), str(os.getppid())), "a").close()
+    code_executor.unpublish(KEY)
+    assert os.path.exists(path) and os.path.exists(code_executor.rollups_path(KEY))
+
+
+def test_unpublish_removes_file_when_other_holders_are_dead(shared_dir):
+    path = code_executor.publish(KEY, _frame())
+    open(os.path.join(code_executor._holders_dir(KEY), "999999999"), "a").close()
+    code_executor.unpublish(KEY)
+    assert not os.path.exists(path)
+    assert not os.path.exists(code_executor._holders_dir(KEY))
+    assert not [name for name in os.listdir(shared_dir) if name.endswith(".tmp")]
+
+
+def test_ensure_published_rewrites_removed_file(shared_dir):
+    path = code_executor.publish(KEY, _frame())
+    os.remove(path)
+    assert code_executor.ensure_published(KEY)
+    assert os.path.exists(path)
+    code_executor.unpublish(KEY)
+    assert not code_executor.ensure_published(KEY)
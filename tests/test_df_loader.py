@@ -0,0 +1,33 @@
+import pandas as pd
+import pytest
+from app.df_loader import optimize_dtypes, align_categories
+
+
+def _frame(columns):
+    rows = [["north", 2024, "01-02-2024"], ["south", 2025, "03-04-2025"]] * 50
+    return pd.DataFrame(rows, columns=columns)
+
+
+@pytest.mark.parametrize("columns", [["Region", "Region", "Date"], [0, 1, 2]])
+def test_optimize_dtypes_handles_duplicate_and_non_string_names(columns):
+    df = _frame(columns)
+    result, report = optimize_dtypes(df, max_unique_ratio=0.5, max_unique=10, dayfirst=True)
+    assert list(result.columns) == columns
+    assert isinstance(result.iloc[:, 0].dtype, pd.CategoricalDtype)
+    assert result.iloc[:, 1].dtype == "int32"
+    assert pd.api.types.is_datetime64_any_dtype(result.iloc[:, 2])
+    # The input frame is left as it was
+    assert not isinstance(df.iloc[:, 0].dtype, pd.CategoricalDtype)
+    assert report["columns"]
+
+
+@pytest.mark.parametrize("columns", [["Region", "Region", "Date"], [0, 1, 2]])
+def test_align_categories_handles_duplicate_and_non_string_names(columns):
+    base, _ = optimize_dtypes(_frame(columns), max_unique_ratio=0.5, max_unique=10, dayfirst=True)
+    new_rows = pd.DataFrame([["east", 2026, "05-06-2026"]], columns=columns)
+    base, new_rows = align_categories(base, new_rows)
+    assert list(base.iloc[:, 0].cat.categories) == ["north", "south", "east"]
+    assert new_rows.iloc[:, 0].dtype == base.iloc[:, 0].dtype
+    combined = pd.concat([base, new_rows], ignore_index=True)
+    assert isinstance(combined.iloc[:, 0].dtype, pd.CategoricalDtype)
+    assert len(combined) == 101
@@ -0,0 +1,46 @@
+import os
+import pandas as pd
+import pytest
+from app import large_dataset
+
+DATASET_ID = "a" * 64
+OTHER_ID = "b" * 64
+
+
+@pytest.fixture
+def datasets(tmp_path, monkeypatch):
+    monkeypatch.setattr(large_dataset, "LARGE_DATASET_DIR", str(tmp_path / "large"))
+    monkeypatch.setattr(large_dataset, "_query_dbs", large_dataset.OrderedDict())
+    for dataset_id, year in ((DATASET_ID, 2024), (OTHER_ID, 2025)):
+        csv = tmp_path / f"{year}.csv"
+        pd.DataFrame({"Year": [year, year], "Sales": [1.5, 2.5]}).to_csv(csv, index=False)
+        large_dataset.ingest(str(csv), "csv", dataset_id)
+    secret = tmp_path / "secret.txt"
+    secret.write_text("top secret\n")
+    return tmp_path, secret
+
+
+def test_query_reads_own_dataset(datasets):
+    assert "4" in large_dataset.run_query(DATASET_ID, "SELECT SUM(Sales) AS total FROM data")
+
+
+@pytest.mark.parametrize("reader", ["read_csv", "read_text"])
+def test_file_readers_outside_dataset_are_refused(datasets, reader):
+    _, secret = datasets
+    for path in (str(secret), "/etc/passwd"):
+        result = large_dataset.run_query(DATASET_ID, f"SELECT * FROM {reader}('{path}') LIMIT 2")
+        assert result.startswith("Error:")
+        assert "top secret" not in result and "root:" not in result
+
+
+def test_other_datasets_are_refused(datasets):
+    other = os.path.join(large_dataset.dataset_dir(OTHER_ID), "**", "*.parquet")
+    result = large_dataset.run_query(DATASET_ID, f"SELECT * FROM read_parquet('{os.path.abspath(other)}')")
+    assert result.startswith("Error:")
+
+
+def test_configuration_cannot_be_unlocked(datasets):
+    result = large_dataset.run_query(DATASET_ID, "SELECT current_setting('enable_external_access') AS v")
+    assert "False" in result or "false" in result
+    large_dataset.run_query(DATASET_ID, "SET enable_external_access = true")
+    assert large_dataset.run_query(DATASET_ID, "SELECT * FROM read_text('/etc/passwd')").startswith("Error:")
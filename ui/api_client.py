@@ -0,0 +1,199 @@
+"""
+HTTP client the Streamlit UI uses to talk to the API. Kept free of Streamlit imports:
+one instance lives in each browser session's st.session_state.
+"""
+
+import json
+import time
+import hashlib
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# === Constants ===
+# Refresh this many seconds before the token expires (below the server's TOKEN_REFRESH_MARGIN_SECONDS,
+# so the refresh gets a new token rather than the cached one)
+TOKEN_REFRESH_BUFFER = 30
+# The server forgets idle sessions (SESSION_IDLE_TTL_SECONDS, 30 min by default): after this long
+# without a request, what we pushed is confirmed again instead of trusted
+SESSION_RESYNC_SECONDS = 900
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+HASH_CHUNK_SIZE = 4 * 1024 * 1024
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 600  # agent answers and large uploads can take minutes
+
+
+class ApiError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(f"API Error: {status_code} - {detail}")
+        self.status_code = status_code
+        self.detail = detail
+
+
+def file_digest(file, algorithm: str = "sha256") -> str:
+    """Hash a file-like object in chunks (the same digest /update-df-stream computes for the upload)."""
+    digest = hashlib.new(algorithm)
+    file.seek(0)
+    while True:
+        chunk = file.read(HASH_CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def text_digest(text: str) -> str:
+    """The id the API gives a context text (app.rag_agent.get_text_hash)."""
+    return hashlib.md5(text.encode()).hexdigest()
+
+
+def iter_file_chunks(file, chunk_size=UPLOAD_CHUNK_SIZE):
+    file.seek(0)
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+class ApiClient:
+    """
+    One keep-alive connection pool per UI session, a bearer token refreshed before it
+    expires, and hash-first updates: a dataset / context / DB the server already has
+    for this session is not sent again, and one it has from elsewhere is switched to by
+    id instead of uploading the payload.
+    """
+
+    def __init__(self, base_url: str, session_id: str):
+        self.base_url = base_url.rstrip("/")
+        self.session_id = session_id
+        self.http = requests.Session()
+        # Retry only failed connects (nothing reached the server, so POSTs are safe to resend)
+        retry = Retry(total=2, connect=2, read=0, status=0, other=0, backoff_factor=0.3)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=retry)
+        self.http.mount("http://", adapter)
+        self.http.mount("https://", adapter)
+        self.http.headers["X-Session-ID"] = session_id
+        self.credentials = None
+        self.token = None
+        self.token_expiry = 0.0
+        # kind ("dataset" / "context" / "db") -> what the server session currently points at
+        self.synced = {}
+        self.last_request_at = 0.0
+        self.request_count = 0
+
+    # === Token Handling ===
+    def login(self, secret_id: str, secret_key: str):
+        self.credentials = (secret_id, secret_key)
+        self.refresh_token()
+
+    def refresh_token(self):
+        if self.credentials is None:
+            raise ApiError(401, "Not logged in")
+        secret_id, secret_key = self.credentials
+        res = self._send("POST", "auth/token", json={"secret_id": secret_id, "secret_key": secret_key})
+        token_info = res.json()
+        self.token = token_info["access_token"]
+        self.token_expiry = time.time() + token_info.get("expires_in", 3600)
+
+    def ensure_token(self):
+        if self.token is None or time.time() >= self.token_expiry - TOKEN_REFRESH_BUFFER:
+            self.refresh_token()
+
+    @property
+    def logged_in(self) -> bool:
+        return self.credentials is not None
+
+    # === Requests ===
+    def _send(self, method: str, endpoint: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+        res = self.http.request(method, f"{self.base_url}/{endpoint}", **kwargs)
+        self.request_count += 1
+        if res.status_code != 200:
+            detail = res.text
+            res.close()
+            raise ApiError(res.status_code, detail)
+        return res
+
+    def request(self, method: str, endpoint: str, data=None, **kwargs) -> requests.Response:
+        """
+        Authenticated request; on a 401 (e.g. a token issued before a server restart with
+        a new key) the token is refreshed and the request sent once more. `data` may be a
+        callable returning the body, so a streamed upload can be replayed.
+        """
+        extra_headers = kwargs.pop("headers", {})
+        self.ensure_token()
+        for attempt in range(2):
+            headers = {**extra_headers, "Authorization": f"Bearer {self.token}"}
+            try:
+                res = self._send(method, endpoint, data=data() if callable(data) else data, headers=headers, **kwargs)
+            except ApiError as e:
+                if e.status_code != 401 or attempt:
+                    raise
+                self.refresh_token()
+                continue
+            self.last_request_at = time.time()
+            return res
+
+    def post(self, endpoint: str, payload=None, **kwargs) -> dict:
+        return self.request("POST", endpoint, json=payload, **kwargs).json()
+
+    def stream(self, endpoint: str, payload):
+        """Yield (event, data) pairs from a server-sent-event endpoint as they arrive."""
+        with self.request("POST", endpoint, json=payload, headers={"Accept": "text/event-stream"}, stream=True) as res:
+            event = "message"
+            for line in res.iter_lines(decode_unicode=True):
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    yield event, json.loads(line[len("data:"):])
+
+    # === Hash-first Updates ===
+    def _is_synced(self, kind: str, key: str) -> bool:
+        return self.synced.get(kind) == key and time.time() - self.last_request_at <= SESSION_RESYNC_SECONDS
+
+    def upload_dataset(self, file, filename: str, digest: str = None) -> dict:
+        """Make `file` the session's dataset: no request if it already is, an id switch if the server has it."""
+        digest = digest or file_digest(file)
+        if self._is_synced("dataset", digest):
+            return {"dataset_id": digest, "unchanged": True, "uploaded": False}
+        try:
+            result = self.post("activate-df", {"dataset_id": digest})
+            result.update(cached=True, uploaded=False)
+        except ApiError as e:
+            if e.status_code != 404:
+                raise
+            result = self.request(
+                "POST", "update-df-stream", data=lambda: iter_file_chunks(file), params={"filename": filename},
+                headers={"Content-Type": "application/octet-stream"},
+            ).json()
+            result["uploaded"] = True
+        self.synced["dataset"] = result.get("dataset_id")
+        return result
+
+    def update_context(self, text: str) -> dict:
+        """Make `text` the session's RAG context, posting the text only if the server has never indexed it."""
+        digest = text_digest(text)
+        if self._is_synced("context", digest):
+            return {"context_hash": digest, "unchanged": True, "uploaded": False}
+        try:
+            result = self.post("activate-context", {"context_hash": digest})
+            result["uploaded"] = False
+        except ApiError as e:
+            if e.status_code != 404:
+                raise
+            result = self.post("update-context", {"text": text})
+            result["uploaded"] = True
+        self.synced["context"] = digest
+        return result
+
+    def update_sql(self, db_uri: str) -> dict:
+        if self._is_synced("db", db_uri):
+            return {"message": f"SQL database updated to: {db_uri}", "unchanged": True}
+        result = self.post("update-sql", {"db_uri": db_uri})
+        self.synced["db"] = db_uri
+        return result
+
+    def close(self):
+        self.http.close()
@@ -3,7 +3,8 @@ import streamlit as st
 import pandas as pd
 import requests
 import tempfile
-import time
+import uuid
+from api_client import ApiClient, ApiError, file_digest
 
 # Set wide layout
 st.set_page_config(page_title="📊 AI Analytics Agent", layout="wide")
@@ -13,72 +14,83 @@ API_URL = st.secrets["api_url"]
 SECRET_ID = st.secrets["secret_id"]
 SECRET_KEY = st.secrets["secret_key"]
 
-# ======= SESSION STATE SETUP =======
-for key in ["bearer_token", "token_expiry"]:
-    if key not in st.session_state:
-        st.session_state[key] = None
-
-TOKEN_EXPIRE_SECONDS = 360
-TOKEN_REFRESH_BUFFER = 30
+PREVIEW_ROWS = 25
+# Uploaded .db files are written here once per content hash (the API reads them by path)
+DB_UPLOAD_DIR = os.path.join(tempfile.gettempdir(), "analytics-agent-db")
 
-# ======= TOKEN HANDLING =======
-def get_token(secret_id, secret_key):
-    try:
-        res = requests.post(
-            f"{API_URL}/auth/token",
-            json={"secret_id": secret_id, "secret_key": secret_key},
-        )
-        if res.status_code == 200:
-            token_info = res.json()
-            st.session_state.bearer_token = token_info["access_token"]
-            st.session_state.token_expiry = time.time() + token_info.get("expires_in", 3600) - 30
-            return True
-        else:
-            return False
-    except Exception as e:
-        st.error(f"Token request failed: {e}")
-        return False
-
-def ensure_token():
-    token_expiry = st.session_state.get("token_expiry")
-    if (
-            "bearer_token" not in st.session_state
-            or token_expiry is None
-            or time.time() >= token_expiry
-    ):
-        # Try to refresh if credentials are available
-        if "secret_id" in st.session_state and "secret_key" in st.session_state:
-            return get_token(st.session_state.secret_id, st.session_state.secret_key)
-        else:
-            return False
-    return True
+# ======= SESSION STATE SETUP =======
+# Each browser session gets its own server-side agent state and its own keep-alive connection pool
+if "api" not in st.session_state:
+    st.session_state.api = ApiClient(API_URL, uuid.uuid4().hex)
+api = st.session_state.api
+
+# Upload digests by Streamlit file id: a file is hashed once, not on every rerun
+if "file_digests" not in st.session_state:
+    st.session_state.file_digests = {}
+
+def uploaded_digest(file):
+    key = (getattr(file, "file_id", None), file.name, file.size)
+    digest = st.session_state.file_digests.get(key)
+    if digest is None:
+        digest = st.session_state.file_digests[key] = file_digest(file)
+    return digest
 
 # ======= AUTH UI =======
 with st.sidebar:
     st.header("🔐 Login (One-time only)")
-    st.session_state.secret_id = st.text_input("Secret ID", type="password")
-    st.session_state.secret_key = st.text_input("Secret Key", type="password")
+    secret_id = st.text_input("Secret ID", type="password")
+    secret_key = st.text_input("Secret Key", type="password")
     if st.button("Generate Token"):
-        if get_token(st.session_state.secret_id, st.session_state.secret_key):
+        try:
+            api.login(secret_id, secret_key)
             st.success("Token generated and stored successfully.")
+        except (ApiError, requests.RequestException) as e:
+            st.error(f"Token request failed: {e}")
 
-# ======= API CALL FUNCTION =======
-def send_authenticated_request(endpoint, payload):
-    if not ensure_token():
+# ======= API CALL FUNCTIONS =======
+def call_api(fn, *args, **kwargs):
+    """Run an ApiClient call, showing errors in the page instead of raising."""
+    if not api.logged_in:
         st.warning("⚠️ Could not authenticate. Please check your credentials.")
         return None
+    try:
+        return fn(*args, **kwargs)
+    except ApiError as e:
+        st.error(str(e))
+    except requests.RequestException as e:
+        st.error(f"Request failed: {e}")
+    return None
 
-    headers = {"Authorization": f"Bearer {st.session_state.bearer_token}"}
+def send_authenticated_request(endpoint, payload):
+    return call_api(api.post, endpoint, payload)
+
+def stream_authenticated_request(endpoint, payload):
+    """Yield (event, data) pairs from a server-sent-event endpoint as they arrive."""
+    if not api.logged_in:
+        st.warning("⚠️ Could not authenticate. Please check your credentials.")
+        return
     try:
-        response = requests.post(f"{API_URL}/{endpoint}", json=payload, headers=headers)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            st.error(f"API Error: {response.status_code} - {response.text}")
-            return None
-    except Exception as e:
+        yield from api.stream(endpoint, payload)
+    except ApiError as e:
+        st.error(str(e))
+    except requests.RequestException as e:
         st.error(f"Request failed: {e}")
-        return None
+
+def stream_reply(endpoint, payload, placeholder):
+    """Render agent steps and answer tokens into `placeholder` while streaming; return the final answer."""
+    steps, text, final = [], "", None
+    for event, data in stream_authenticated_request(endpoint, payload):
+        if event == "step":
+            steps.append(f"🔧 _Running `{data['tool']}`…_")
+            text = ""  # tokens so far were the agent thinking, not the answer
+        elif event == "token":
+            text += data["text"]
+        elif event == "final":
+            final = data["response"]
+        elif event == "error":
+            st.error(f"Agent error: {data.get('detail')}")
+        placeholder.markdown("\n\n".join(steps + [final or text or "..."]))
+    return final if final is not None else "❌ Error retrieving response."
 
 # ======= Initialize chat states =======
 for key in ["df_chat_history", "context_chat_history", "sql_chat_history"]:
@@ -114,33 +126,52 @@ if option == "DataFrame Agent":
 
     @st.cache_data
     def load_default_data():
-        return pd.read_csv("data/retail_transactions_dataset.csv")
+        return pd.read_csv("data/retail_transactions_dataset.csv", nrows=PREVIEW_ROWS)
 
     if "df" not in st.session_state:
         st.session_state.df = load_default_data()
 
-    uploaded_file = st.file_uploader("Upload your data file", type=["csv", "xlsx", "xls"])
+    @st.cache_data(max_entries=16)
+    def load_preview(digest, name, _file, rows=PREVIEW_ROWS):
+        # Only the preview rows are parsed locally, once per file content (the leading
+        # underscore keeps Streamlit from hashing the file itself); the API gets the raw bytes
+        name = name.lower()
+        _file.seek(0)
+        if name.endswith(".csv"):
+            return pd.read_csv(_file, nrows=rows)
+        if name.endswith((".xlsx", ".xls")):
+            return pd.read_excel(_file, nrows=rows)
+        if name.endswith(".parquet"):
+            import pyarrow.parquet as pq
+            return next(pq.ParquetFile(_file).iter_batches(batch_size=rows)).to_pandas()
+        import pyarrow as pa
+        import pyarrow.ipc as ipc
+        try:
+            reader = ipc.open_file(_file)
+            return reader.get_batch(0).to_pandas().head(rows)
+        except pa.ArrowInvalid:
+            _file.seek(0)
+            return ipc.open_stream(_file).read_next_batch().to_pandas().head(rows)
+
+    uploaded_file = st.file_uploader("Upload your data file", type=["csv", "xlsx", "xls", "parquet", "arrow", "feather"])
     if uploaded_file:
-        prev_file_name = st.session_state.get("last_df_file")
-        if uploaded_file.name != prev_file_name:
-            # New file detected
-            if uploaded_file.name.endswith(".csv"):
-                st.session_state.df = pd.read_csv(uploaded_file)
-            else:
-                st.session_state.df = pd.read_excel(uploaded_file)
-
-            st.session_state.last_df_file = uploaded_file.name
+        digest = uploaded_digest(uploaded_file)
+        if digest != st.session_state.get("last_df_digest"):
+            # New file content detected (a renamed copy of the same data is not re-sent)
+            st.session_state.df = load_preview(digest, uploaded_file.name, uploaded_file)
+            st.session_state.last_df_digest = digest
             st.session_state.df_chat_history = []  # Only reset on new upload
 
-            df_json = st.session_state.df.to_json(orient="split")
-            result = send_authenticated_request("update-df", {"data": df_json})
-            if result:
-                st.success("✅ LLM Data (Tabular) updated successfully!")
-            else:
-                st.error("❌ Failed to update LLM Data (Tabular).")
+        # No request while the server session already has this file; otherwise its hash
+        # is sent first and the bytes only if the server has never seen the file
+        result = call_api(api.upload_dataset, uploaded_file, uploaded_file.name, digest)
+        if result is None:
+            st.error("❌ Failed to update LLM Data (Tabular).")
+        elif not result.get("unchanged"):
+            st.success("✅ LLM Data (Tabular) updated successfully!")
 
     st.write("#### 📄 Data Preview (Used by LLM Agent):")
-    st.dataframe(st.session_state.df.head(25), height=200)
+    st.dataframe(st.session_state.df.head(PREVIEW_ROWS), height=200)
 
     for msg in st.session_state.df_chat_history:
         with st.chat_message(msg["role"]):
@@ -157,8 +188,7 @@ if option == "DataFrame Agent":
             loading.markdown("...")
 
         messages = [{"role": "system", "content": "You are a helpful assistant"}] + st.session_state.df_chat_history[-5:]
-        result = send_authenticated_request("chat", {"messages": messages})
-        assistant_reply = result["response"] if result else "❌ Error retrieving response."
+        assistant_reply = stream_reply("chat/stream", {"messages": messages}, loading)
 
         loading.markdown(assistant_reply)
         st.session_state.df_chat_history.append({"role": "assistant", "content": assistant_reply})
@@ -177,19 +207,17 @@ elif option == "Context Agent":
 
     context_file = st.file_uploader("Upload a context file (.txt)", type=["txt"])
     if context_file:
-        prev_context_file = st.session_state.get("last_context_file")
-        if context_file.name != prev_context_file:
-            st.session_state.context_text = context_file.read().decode("utf-8")
-            st.session_state.last_context_file = context_file.name
-
-            result = send_authenticated_request("update-context", {"text": st.session_state.context_text})
-            if result:
-                st.success("✅ RAG context updated successfully!")
-                st.session_state.context_chat_history = []  # Only clear if new file
-            else:
-                st.error("❌ Failed to update RAG context.")
-    else:
-        send_authenticated_request("update-context", {"text": st.session_state.context_text})
+        digest = uploaded_digest(context_file)
+        if digest != st.session_state.get("last_context_digest"):
+            st.session_state.context_text = context_file.getvalue().decode("utf-8")
+            st.session_state.last_context_digest = digest
+            st.session_state.context_chat_history = []  # Only clear if new file
+
+    # A no-op while the server session already has this text; otherwise its hash is sent
+    # first and the text itself only if the server has never indexed it
+    result = call_api(api.update_context, st.session_state.context_text)
+    if result is not None and not result.get("unchanged") and st.session_state.get("last_context_digest"):
+        st.success("✅ RAG context updated successfully!")
 
     st.write("#### 📄 Context File Preview (Used by RAG Agent):")
     st.text_area("Context Preview", st.session_state.context_text, height=150, disabled=True)
@@ -210,8 +238,7 @@ elif option == "Context Agent":
             loading.markdown("...")
 
         messages = [{"role": "system", "content": "You are a helpful assistant"}] + st.session_state.context_chat_history[-5:]
-        result = send_authenticated_request("context", {"messages": messages})
-        reply = result["response"] if result else "❌ Error retrieving response."
+        reply = stream_reply("context/stream", {"messages": messages}, loading)
 
         loading.markdown(reply)
         st.session_state.context_chat_history.append({"role": "assistant", "content": reply})
@@ -228,19 +255,25 @@ elif option == "SQL Agent":
 
     uploaded_db = st.file_uploader("Upload a new SQLite DB file (.db)", type=["db", "sqlite"])
     if uploaded_db:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".db") as tmp:
-            tmp.write(uploaded_db.getbuffer())
-            tmp_path = tmp.name
-
-        new_db_uri = f"sqlite:///{tmp_path}"
+        # One file per content hash, written once: reruns and re-uploads reuse it (and the
+        # server's per-file caches keyed by its path)
+        db_path = os.path.join(DB_UPLOAD_DIR, f"{uploaded_digest(uploaded_db)}.db")
+        if not os.path.exists(db_path):
+            os.makedirs(DB_UPLOAD_DIR, exist_ok=True)
+            with tempfile.NamedTemporaryFile(delete=False, dir=DB_UPLOAD_DIR, suffix=".tmp") as tmp:
+                tmp.write(uploaded_db.getbuffer())
+            os.replace(tmp.name, db_path)
+
+        new_db_uri = f"sqlite:///{db_path}"
+        if new_db_uri != st.session_state.sql_db_uri:
+            st.session_state.sql_chat_history = []
         st.session_state.sql_db_uri = new_db_uri
-        result = send_authenticated_request("update-sql", {"db_uri": new_db_uri})
 
-        if result:
-            st.success(f"✅ SQL DB updated: {uploaded_db.name}")
-            st.session_state.sql_chat_history = []
-        else:
-            st.error("❌ Failed to update SQL DB.")
+    if st.session_state.sql_db_uri != DEFAULT_DB_URI:
+        # Sent only when the server session does not point at this DB yet
+        result = call_api(api.update_sql, st.session_state.sql_db_uri)
+        if result is not None and not result.get("unchanged"):
+            st.success(f"✅ SQL DB updated: {os.path.basename(st.session_state.sql_db_uri)}")
 
     st.write(f"#### Current DB: `{st.session_state.sql_db_uri}`")
 
@@ -260,8 +293,7 @@ elif option == "SQL Agent":
             loading.markdown("...")
 
         messages = [{"role": "system", "content": "You are an expert SQL assistant."}] + st.session_state.sql_chat_history[-5:]
-        result = send_authenticated_request("sql", {"messages": messages})
-        reply = result["response"] if result else "❌ Error retrieving response."
+        reply = stream_reply("sql/stream", {"messages": messages}, loading)
 
         loading.markdown(reply)
         st.session_state.sql_chat_history.append({"role": "assistant", "content": reply})